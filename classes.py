@@ -15,8 +15,9 @@ import time
 import aiohttp
 
 import settings
+from controller import CellModel
 from hardware import measure_all, PID, initialize
-from utils import NetworkQueue, clamp, roughly_equal, fetch, StopHeatingError
+from utils import AdaptiveBatchPolicy, NetworkQueue, clamp, roughly_equal, fetch, StopHeatingError
 
 
 class Run(object):
@@ -25,7 +26,7 @@ class Run(object):
 
     def __init__(self, run_id, start_temp, target_temp, ramp_rate, max_ramp_rate,
                  PID_ref, PID_sample, interval, min_upload_length, stabilization_duration,
-                 temp_tolerance):
+                 temp_tolerance, ramp_offset=settings.RAMP_OFFSET, ramp_gain=settings.RAMP_GAIN):
         """
         Generic init method that initiates the class.
 
@@ -53,12 +54,18 @@ class Run(object):
         :type temp_tolerance: float
         :param temp_tolerance: Maximum difference between two temperature readings, in degrees Celsius,
             for them to be considered equivalent.
+        :type ramp_offset: float
+        :param ramp_offset: Ramp calibration offset, in degrees Celsius per minute, see :attr:`real_ramp_rate`.
+        :type ramp_gain: float
+        :param ramp_gain: Ramp calibration gain, in minutes per cycle, see :attr:`real_ramp_rate`.
         """
         self.id = run_id
         self.start_temp = start_temp
         self.target_temp = target_temp
         self.ramp_rate = ramp_rate
-        self.max_ramp_rate = (max_ramp_rate + 0.434) * 0.02  # degrees per minute -> degrees per cycle
+        self.ramp_offset = ramp_offset
+        self.ramp_gain = ramp_gain
+        self.max_ramp_rate = (max_ramp_rate + ramp_offset) * ramp_gain  # degrees per minute -> degrees per cycle
 
         self.PID_ref = PID_ref
         self.PID_sample = PID_sample
@@ -77,8 +84,14 @@ class Run(object):
 
         self.last_time = time.time()
         self.network_queue = NetworkQueue(threshold_time=interval, threshold_qsize=min_upload_length)
+        self.upload_policy = AdaptiveBatchPolicy(
+            sample_interval=interval, flush_interval=self.network_queue.threshold_time,
+            batch_size=self.network_queue.threshold_qsize, adaptive=settings.WEB_API_ADAPTIVE_BATCHING)
         self.data_points = []
 
+        self.upload_sequence = 0
+        self.uploads = []  # upload tasks awaiting a response, oldest first
+
     async def make_measurement(self, _loop):
         """
         Make a new measurement asynchronously and store it to the series of measurements related to this run.
@@ -104,8 +117,8 @@ class Run(object):
         measurement = await DataPoint.async_measure_raw(self, _loop)
         self.data_points.append(measurement)
 
-        # send its json representation into the upload queue
-        await self.network_queue.put(measurement.jsonify())
+        # send it into the upload queue, to be encoded when uploaded
+        await self.network_queue.put(measurement)
 
         # batch update pid values
         self.duty_cycle_ref = clamp(self.PID_ref.update(measurement.temp_ref))
@@ -119,56 +132,92 @@ class Run(object):
 
     async def queue_upload(self, _loop, override_threshold=None):
         """An asynchronous function that uploads payloads by consuming from the network queue
-        only when a specified amount of time has passed from time of last processing
-        and when a specified number of items exist in the queue.
+        only when the run's :class:`utils.AdaptiveBatchPolicy` decides that enough time has passed
+        from time of last processing, or that enough items exist in the queue.
         The asynchronous process breaks otherwise.
 
+        Each batch is numbered, so that the server can discard repeats and uploads can be retried safely.
+        Uploads run in the background, up to :const:`settings.WEB_API_MAX_UPLOADS_IN_FLIGHT` at a time,
+        and their responses are handled in the order they were sent.
+
         :type _loop: asyncio.BaseEventLoop
         :param _loop: the main event loop
         :type override_threshold: bool
-        :param override_threshold: whether qsize and delta time constraints for batch uploading should be overrode
+        :param override_threshold: whether qsize and delta time constraints for batch uploading should be overrode.
+            All uploads are also waited for, so that every measurement has reached the server on return.
         :rtype: bool
         :returns: if sample has been inserted and formal temp ramp can begin
 
         :exception StopHeatingError: When this error is raised, any async function that calls it must give control \
         back to the idle loop and stop heating. Raised if a 'stop_flag' field returns True from the web API response.
         """
-        while True:
-            # Only make HTTP requests above certain item number threshold
-            # and after a set amount of time since last upload
-            q, qsize = self.network_queue, self.network_queue.qsize()
-
-            if override_threshold or (
-                    qsize >= q.threshold_qsize and (time.time() - q.last_time) >= q.threshold_time):
-
-                # collect all items in the queue
-                data = await asyncio.gather(
-                    *[asyncio.ensure_future(q.get()) for _ in range(q.qsize())],
-                    loop=_loop
-                )
-
-                # make the request and clear the local waiting list
-                payload = {
-                    'data': data,
-                    'run': self.id,
-                    'stabilized_at_start': self.stabilized_at_start,
-                    'is_finished': self.is_finished,
-                }
-                async with aiohttp.ClientSession(loop=_loop) as session:
-                    response = await fetch(session, 'POST', settings.WEB_API_DATA_ADDRESS, payload=payload)
-                if settings.DEBUG:
-                    print(response)
-
-                # reset network queue last processed time
-                q.last_time = time.time()
+        # Only make HTTP requests above certain item number threshold
+        # or after enough time since last upload, as adapted to the connection
+        q, qsize, policy = self.network_queue, self.network_queue.qsize(), self.upload_policy
+
+        if override_threshold or policy.should_flush(qsize, time.time() - q.last_time):
+
+            # collect all items in the queue, up to the size limit of one upload unless flushing
+            count = qsize if override_threshold else min(qsize, policy.max_batch_size)
+            data = await asyncio.gather(
+                *[asyncio.ensure_future(q.get()) for _ in range(count)],
+                loop=_loop
+            )
+
+            # start the request and clear the local waiting list
+            self.upload_sequence += 1
+            payload = {
+                'data': data,
+                'run': self.id,
+                'sequence': self.upload_sequence,
+                'stabilized_at_start': self.stabilized_at_start,
+                'is_finished': self.is_finished,
+                'batching': dict(policy.snapshot(), in_flight=len(self.uploads)),
+            }
+            self.uploads.append(asyncio.ensure_future(self.upload(_loop, payload), loop=_loop))
+
+            # reset network queue last processed time
+            q.last_time = time.time()
+
+        # Wait for the oldest uploads while too many are in flight
+        max_uploads = 0 if override_threshold else settings.WEB_API_MAX_UPLOADS_IN_FLIGHT
+        while len(self.uploads) > max_uploads:
+            await asyncio.wait(self.uploads[:1], loop=_loop)
+            self.handle_upload_responses()
+
+        self.handle_upload_responses()
+        return self.is_ready
+
+    async def upload(self, _loop, payload):
+        """Posts a batch of measurements to the web API, retrying failed attempts.
+        The batch is encoded as set by :const:`settings.WEB_API_UPLOAD_FORMAT`.
+
+        :param payload: payload whose `data` field is a list of :class:`DataPoint` objects
+        :return: decoded JSON response
+        """
+        if settings.WEB_API_UPLOAD_FORMAT == 'json':
+            payload = dict(payload, data=[data_point.jsonify() for data_point in payload['data']])
+        async with aiohttp.ClientSession(loop=_loop) as session:
+            return await fetch(session, 'POST', settings.WEB_API_DATA_ADDRESS, payload=payload,
+                               retries=settings.WEB_API_UPLOAD_RETRIES, wire_format=settings.WEB_API_UPLOAD_FORMAT,
+                               policy=self.upload_policy)
+
+    def handle_upload_responses(self):
+        """Handles the responses of finished uploads, in the order they were sent.
+
+        :exception StopHeatingError: if an upload has failed, or a 'stop_flag' field returns True \
+        from the web API response.
+        """
+        while self.uploads and self.uploads[0].done():
+            # raises any exception of a failed upload
+            response = self.uploads.pop(0).result()
+            if settings.DEBUG:
+                print(response)
 
-                # Check for stop heating and sample inserted flags from the web API
-                if response.get('stop_flag'):
-                    raise StopHeatingError
-                self.is_ready = response.get('is_ready')
-                return self.is_ready
-            else:
-                break
+            # Check for stop heating and sample inserted flags from the web API
+            if response.get('stop_flag'):
+                raise StopHeatingError
+            self.is_ready = response.get('is_ready')
 
     def batch_setpoint(self, setpoint):
         """
@@ -251,9 +300,9 @@ class Run(object):
         :rtype: float
         :return: Temperature increase per cycle, in degrees Celsius.
         """
-        # the following relationship was determined by testing + calibration by Lily and Rebeca
-        # celsius_per_cycle = (self.ramp_rate + 0.434) * 0.06411489
-        celsius_per_cycle = (self.ramp_rate + 0.434) * 0.02
+        # the default calibration was determined by testing + calibration by Lily and Rebeca,
+        # the web server fits one per calorimeter from its recorded runs
+        celsius_per_cycle = (self.ramp_rate + self.ramp_offset) * self.ramp_gain
         return clamp(celsius_per_cycle, 0, self.max_ramp_rate)
 
     @classmethod
@@ -277,8 +326,8 @@ class Run(object):
             'Kd': json_data['K_d'],
             'set_point': run_data['start_temp']
         }
-        PID_ref = PID(temp_ref, **PID_init_kwargs)
-        PID_sample = PID(temp_sample, **PID_init_kwargs)
+        PID_ref = PID(temp_ref, model=cell_model(json_data, 'ref'), **PID_init_kwargs)
+        PID_sample = PID(temp_sample, model=cell_model(json_data, 'sample'), **PID_init_kwargs)
 
         return cls(run_data['id'], run_data['start_temp'], run_data['target_temp'],
                    run_data['ramp_rate'], run_data.get('max_ramp_rate') or settings.MAX_RAMP_RATE,
@@ -286,7 +335,26 @@ class Run(object):
                    json_data.get('active_loop_interval') or settings.MAIN_LOOP_INTERVAL,
                    json_data.get('web_api_min_upload_length') or settings.WEB_API_MIN_UPLOAD_LENGTH,
                    json_data.get('stabilization_duration') or settings.TEMP_STABILISATION_MIN_DURATION,
-                   json_data.get('temp_tolerance_range') or settings.TEMP_TOLERANCE)
+                   json_data.get('temp_tolerance_range') or settings.TEMP_TOLERANCE,
+                   # zero is a valid calibration
+                   settings.RAMP_OFFSET if json_data.get('ramp_offset') is None else json_data['ramp_offset'],
+                   json_data.get('ramp_gain') or settings.RAMP_GAIN)
+
+
+def cell_model(json_data, cell):
+    """
+    The model of a cell for the feed-forward term of its PID controller,
+    if feed-forward control is enabled on the web interface and the web server has fitted a model.
+
+    :param json_data: Returned JSON response of the web status API page.
+    :param cell: 'ref' or 'sample'
+    :rtype: controller.CellModel | None
+    """
+    fields = ('heat_capacity', 'loss_coefficient', 'heater_gain', 'ambient_temp', 'sensor_lag')
+    params = [json_data.get('{0}_{1}'.format(cell, field)) for field in fields]
+    if not json_data.get('feed_forward') or None in params or not params[2]:
+        return None
+    return CellModel(*params)
 
 
 class DataPoint(object):
@@ -0,0 +1,252 @@
+"""
+The PID controller computing heater duty cycles from temperature readings.
+
+It has no hardware dependencies, so that the same controller can be run against a simulated calorimeter,
+as the web server's PID tuning tool does, with a simulated clock in place of the system clock.
+:mod:`hardware` re-exports it with the default gains of :mod:`settings`.
+
+The relay auto-tuner, :class:`RelayTuner`, and the cell model giving the PID its optional feed-forward term,
+:class:`CellModel`, also live here, for the same reason.
+
+Jin Cheng & Hayley Weir 08/12/16:
+    the PID class, first in `hardware.py`
+"""
+
+import math
+import time
+
+
+class PID(object):
+    """
+    An object representing a PID controller,
+    allowing the two heaters to have separate PID params.
+
+    Stores historical integral and derivative values so far,
+    while the set point can be updated after class construction and at any point in time.
+
+    Given a :class:`CellModel` of the heated cell, the duty cycle it predicts for the set point and the rate at which
+    the set point is moving is added to the output, so that the PID terms only correct what the model misses.
+    """
+
+    def __init__(self, init_val, Kp, Ki, Kd, set_point=None, clock=time.time, model=None):
+        """
+        Class constructor.
+
+        :param init_val: initial value,
+        :param Kp: PID proportionality factor,
+        :param Ki: PID integral factor,
+        :param Kd: PID derivative factor,
+        :param set_point: initial set point,
+        :param clock: function returning the current time in seconds, the system clock by default,
+        :param model: optional :class:`CellModel` of the heated cell, for a feed-forward term.
+        """
+        self.init_val = float(init_val)
+        self.set_point = set_point
+        self.last_error, self.proportional, self.integral, self.derivative = 0., 0., 0., 0.
+
+        self.Kp, self.Ki, self.Kd = Kp, Ki, Kd
+
+        self.clock = clock
+        self.last_time = clock()
+
+        self.model = model
+        self.set_point_rate, self.set_point_time, self.feed_forward = 0., self.last_time, 0.
+
+    def set_setpoint(self, set_point):
+        """Set a new set-point temperature for this PID controller object.
+        The rate at which the set point moves, used by the feed-forward term, is taken from successive set points.
+
+        :type set_point: float | int
+        :param set_point: New setpoint.
+        """
+        now = self.clock()
+        if self.set_point is not None and now > self.set_point_time:
+            self.set_point_rate = (float(set_point) - self.set_point) / (now - self.set_point_time)
+        self.set_point, self.set_point_time = float(set_point), now
+
+    def clear(self):
+        """Clears all PID computations and coefficients.
+        """
+        self.set_point = 0.
+        self.proportional, self.integral, self.derivative, self.last_error = 0., 0., 0., 0.
+
+    def update(self, feedback_value):
+        """Calculates PID output for a given feedback from sensor.
+
+        .. math::
+            u(t) = K_p e(t) + K_i \int_{0}^{t} e(t) dt + K_d \\frac{de}{dt}
+
+        plus the feed-forward term of the :class:`CellModel`, if any.
+
+        :type feedback_value: float | int
+        :param feedback_value: temperature reading
+        :rtype: float
+        :return: PID output after accounting for feedback value
+        """
+        error = self.set_point - feedback_value
+        delta_error = error - self.last_error
+
+        now = self.clock()
+        delta_time = now - self.last_time
+
+        self.proportional = self.Kp * error
+        self.integral += delta_time * error
+        self.derivative = delta_error / delta_time
+
+        # reset last_time and last_error for next calculation
+        self.last_error, self.last_time = error, now
+
+        if self.model is not None:
+            self.feed_forward = self.model.duty_cycle(self.set_point, self.set_point_rate)
+
+        return self.proportional + self.Ki*self.integral + self.Kd*self.derivative + self.feed_forward
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def __unicode__(self):
+        return "<PID controller object (Kp, Ki, Kd)=({0}, {1}, {2}) " \
+               "SP={3} IV={4}>".format(self.Kp, self.Ki, self.Kd, self.set_point, self.init_val)
+
+
+class CellModel(object):
+    """
+    A lumped thermal model of a calorimeter cell, as fitted from recorded runs by the web server:
+    its heater heats it, it loses heat in proportion to its temperature above ambient,
+    and its sensor follows its temperature with a first order lag.
+    """
+
+    def __init__(self, heat_capacity, loss_coefficient, heater_gain, ambient_temp, sensor_lag=0.):
+        """
+        Class constructor.
+
+        :param heat_capacity: heat needed to warm the cell by one degree, in mJ per degree Celsius,
+        :param loss_coefficient: heat flow lost per degree above ambient, in mW per degree Celsius,
+        :param heater_gain: heat flow of the heater per percent of duty cycle, in mW,
+        :param ambient_temp: temperature of the surroundings, in degrees Celsius,
+        :param sensor_lag: time constant of the temperature sensor, in seconds.
+        """
+        self.heat_capacity = heat_capacity
+        self.loss_coefficient = loss_coefficient
+        self.heater_gain = heater_gain
+        self.ambient_temp = ambient_temp
+        self.sensor_lag = sensor_lag
+
+    def duty_cycle(self, set_point, rate):
+        """
+        The duty cycle holding the sensed temperature at a set point moving at a steady rate.
+        The cell itself must then lead the set point by the sensor lag.
+
+        :param set_point: set point in degrees Celsius
+        :param rate: rate at which the set point moves, in degrees Celsius per second
+        :return: duty cycle in percent, unclamped
+        """
+        temperature = set_point + self.sensor_lag * rate
+        heat_flow = self.loss_coefficient * (temperature - self.ambient_temp) + self.heat_capacity * rate
+        return heat_flow / self.heater_gain
+
+
+class RelayTuner(object):
+    """
+    A relay feedback experiment finding the ultimate gain and period of a cell,
+    from which :func:`relay_gains` derives PID gains.
+
+    The heater is first run at full duty cycle up to the set point. From then on it is switched between
+    two duty cycles, ``bias + amplitude`` and ``bias - amplitude``, whenever the temperature leaves a band of
+    ``hysteresis`` around the set point, which makes the temperature oscillate at the cell's ultimate period.
+    After every cycle the bias is moved towards the duty cycle holding the set point,
+    so that the heater is on for as long as it is off.
+    """
+
+    def __init__(self, set_point, amplitude, hysteresis, cycles, settling_cycles=2, clock=time.time):
+        """
+        Class constructor.
+
+        :param set_point: temperature to oscillate around,
+        :param amplitude: half the difference between the two duty cycles, in percent,
+        :param hysteresis: half the width of the band around the set point,
+        :param cycles: number of cycles measured,
+        :param settling_cycles: number of cycles left for the oscillation to settle before measuring,
+        :param clock: function returning the current time in seconds, the system clock by default.
+        """
+        self.set_point = float(set_point)
+        self.amplitude, self.hysteresis = amplitude, hysteresis
+        self.cycles, self.settling_cycles = cycles, settling_cycles
+        self.clock = clock
+
+        self.bias = 50.
+        self.heating = True
+        self.switch_times = []  # alternately switching off and on, starting with the end of the heat-up
+        self.extreme = None  # highest temperature since switching off, or lowest since switching on
+        self.trough = None
+        self.periods, self.half_heights = [], []
+
+    def update(self, feedback_value):
+        """Calculates the duty cycle for a given feedback from sensor.
+
+        :type feedback_value: float | int
+        :param feedback_value: temperature reading
+        :rtype: float
+        :return: duty cycle in percent
+        """
+        now = self.clock()
+        if self.extreme is not None:
+            self.extreme = min(self.extreme, feedback_value) if self.heating else max(self.extreme, feedback_value)
+
+        if self.heating and feedback_value > self.set_point + self.hysteresis:
+            self.trough = self.extreme
+            self.heating, self.extreme = False, feedback_value
+            self.switch_times.append(now)
+        elif not self.heating and feedback_value < self.set_point - self.hysteresis:
+            if self.trough is not None:
+                # a full cycle from switching on to switching on again
+                on_time, off_time = self.switch_times[-2:]
+                period, heating_time = now - on_time, off_time - on_time
+                self.periods.append(period)
+                self.half_heights.append((self.extreme - self.trough) / 2)
+                self.bias += self.amplitude * (2 * heating_time - period) / period
+                self.bias = min(max(self.bias, self.amplitude), 100 - self.amplitude)
+            self.heating, self.extreme = True, feedback_value
+            self.switch_times.append(now)
+
+        if not self.switch_times:
+            return 100.
+        return self.bias + self.amplitude if self.heating else self.bias - self.amplitude
+
+    @property
+    def is_finished(self):
+        """Whether enough cycles have been measured."""
+        return len(self.periods) >= self.settling_cycles + self.cycles
+
+    def ultimate(self):
+        """
+        The ultimate gain and period of the cell, from the describing function of a relay with hysteresis:
+
+        .. math::
+            K_u = \\frac{4 d}{\\pi \\sqrt{a^2 - h^2}}
+
+        with :math:`d` the relay amplitude, :math:`a` the amplitude of the oscillation
+        and :math:`h` the hysteresis.
+
+        :rtype: tuple[float, float]
+        :return: ultimate gain in percent duty cycle per degree, ultimate period in seconds
+        """
+        periods = self.periods[self.settling_cycles:]
+        half_heights = self.half_heights[self.settling_cycles:]
+        half_height = sum(half_heights) / len(half_heights)
+        if half_height > self.hysteresis:
+            half_height = math.sqrt(half_height ** 2 - self.hysteresis ** 2)
+        return 4 * self.amplitude / (math.pi * half_height), sum(periods) / len(periods)
+
+
+def relay_gains(ultimate_gain, ultimate_period):
+    """
+    PID gains from the ultimate gain and period of a cell, by the Tyreus-Luyben rules for a PI controller,
+    which overshoot far less than those of Ziegler and Nichols.
+    The derivative factor is left at zero, as the derivative of the coarse temperature readings is mostly noise.
+
+    :rtype: tuple[float, float, float]
+    :return: the proportionality, integral and derivative factors
+    """
+    Kp = ultimate_gain / 3.2
+    return Kp, Kp / (2.2 * ultimate_period), 0.
@@ -0,0 +1,56 @@
+"""
+Fixed-point delta encoding of measurement series, for compact uploads.
+
+Each series is stored as integer multiples of its sensor resolution (the quantum),
+as differences between consecutive values, zigzag-mapped to unsigned integers and written as base-128 varints.
+Temperatures and heat flows change by a few quanta at most between measurements,
+so most values take a single byte.
+
+Layout of an encoded block, with numbers little-endian:
+
+#. The 4 bytes of :const:`MAGIC`.
+#. The length of the header, as an unsigned 32-bit integer.
+#. The header: UTF-8 JSON with `count`, the number of values per series,
+   and `columns`, a list of ``[name, quantum]`` pairs.
+#. The varints of all deltas, series after series in the order of `columns`.
+   The first delta of each series is from zero.
+
+The web server decodes blocks in `controls/deltacodec.py`, which also uses this layout to store finished runs.
+"""
+
+import json
+import struct
+
+MAGIC = b'DLT1'
+
+
+def encode(columns, count):
+    """
+    Encodes measurement series.
+
+    :type columns: list
+    :param columns: list of ``(name, quantum, values)`` tuples, where values is a sequence of numbers.
+        A quantum of 1 keeps integer values exact.
+    :type count: int
+    :param count: number of values in every series
+    :rtype: bytes
+    :return: the encoded block
+    """
+    header = json.dumps({'count': count, 'columns': [[name, quantum] for name, quantum, _ in columns]})
+    header = header.encode('utf-8')
+    body = bytearray(MAGIC + struct.pack('<I', len(header)) + header)
+
+    for name, quantum, values in columns:
+        previous = 0
+        for value in values:
+            current = int(round(value / quantum))
+            delta = current - previous
+            previous = current
+
+            # zigzag mapping interleaves negative and positive deltas, so small changes take few bytes
+            delta = delta * 2 if delta >= 0 else -delta * 2 - 1
+            while delta > 0x7f:
+                body.append((delta & 0x7f) | 0x80)
+                delta >>= 7
+            body.append(delta)
+    return bytes(body)
@@ -21,6 +21,8 @@ Jin Cheng 12/12/16:
 
 Jin Cheng 17/01/17:
     allow customisation of PID params from the web interface
+
+The PID class itself is in :mod:`controller`, so that it can be used without the hardware.
 """
 
 import asyncio
@@ -28,6 +30,7 @@ import os
 import subprocess
 import time
 
+import controller
 import settings
 
 if not settings.FAKE_HARDWARE:
@@ -37,82 +40,30 @@ else:
     import random
 
 
-class PID(object):
+class PID(controller.PID):
     """
-    An object representing a PID controller,
-    allowing the two heaters to have separate PID params.
-
-    Stores historical integral and derivative values so far,
-    while the set point can be updated after class construction and at any point in time.
+    The :class:`controller.PID` controller,
+    using the PID params in :const:`settings.PID_PARAMS` for those not specified.
     """
 
-    def __init__(self, init_val, Kp=None, Ki=None, Kd=None, set_point=None):
+    def __init__(self, init_val, Kp=None, Ki=None, Kd=None, set_point=None, clock=time.time, model=None):
         """
         Class constructor.
 
         :param init_val: initial value,
         :param Kp: custom PID proportionality factor,
         :param Ki: custom PID integral factor,
-        :param Kd: custom PID derivative factor.
+        :param Kd: custom PID derivative factor,
+        :param set_point: initial set point,
+        :param clock: function returning the current time in seconds, the system clock by default,
+        :param model: optional :class:`controller.CellModel` of the heated cell, for a feed-forward term.
         """
-        self.init_val = float(init_val)
-        self.set_point = set_point
-        self.last_error, self.proportional, self.integral, self.derivative = 0., 0., 0., 0.
-
         # if not specified in object construction, use the PID params in settings.py
-        self.Kp = Kp or settings.PID_PARAMS['P']
-        self.Ki = Ki or settings.PID_PARAMS['I']
-        self.Kd = Kd or settings.PID_PARAMS['D']
-
-        self.last_time = time.time()
-
-    def set_setpoint(self, set_point):
-        """Set a new set-point temperature for this PID controller object.
-
-        :type set_point: float | int
-        :param set_point: New setpoint.
-        """
-        self.set_point = float(set_point)
-
-    def clear(self):
-        """Clears all PID computations and coefficients.
-        """
-        self.set_point = 0.
-        self.proportional, self.integral, self.derivative, self.last_error = 0., 0., 0., 0.
-
-    def update(self, feedback_value):
-        """Calculates PID output for a given feedback from sensor.
-
-        .. math::
-            u(t) = K_p e(t) + K_i \int_{0}^{t} e(t) dt + K_d \\frac{de}{dt}
-
-
-        :type feedback_value: float | int
-        :param feedback_value: temperature reading
-        :rtype: float
-        :return: PID output after accounting for feedback value
-        """
-        error = self.set_point - feedback_value
-        delta_error = error - self.last_error
-
-        now = time.time()
-        delta_time = now - self.last_time
-
-        self.proportional = self.Kp * error
-        self.integral += delta_time * error
-        self.derivative = delta_error / delta_time
-
-        # reset last_time and last_error for next calculation
-        self.last_error, self.last_time = error, now
-
-        return self.proportional + self.Ki*self.integral + self.Kd*self.derivative
-
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
-
-    def __unicode__(self):
-        return "<PID controller object (Kp, Ki, Kd)=({0}, {1}, {2}) " \
-               "SP={3} IV={4}>".format(self.Kp, self.Ki, self.Kd, self.set_point, self.init_val)
+        super(PID, self).__init__(init_val,
+                                  Kp or settings.PID_PARAMS['P'],
+                                  Ki or settings.PID_PARAMS['I'],
+                                  Kd or settings.PID_PARAMS['D'],
+                                  set_point=set_point, clock=clock, model=model)
 
 
 HAS_INITIALZED_MODPROBE = False
@@ -22,6 +22,8 @@ Jin Cheng, 16/01/17:
 Jin Cheng, 17/01/17:
     Major refactor of common flow logic code into classes,
     optimisation of the temperature ramp logic to make temp profile as linear as possible.
+
+PID auto-tuning, requested from the Calibrate page, runs from the idle loop in :func:`autotune`.
 """
 
 import asyncio
@@ -33,8 +35,10 @@ import aiohttp
 
 import settings
 from classes import Run
-from hardware import (read_temp_ref, read_temp_sample, initialize, indicate_heating, indicate_starting_up, cleanup)
-from utils import fetch, StopHeatingError
+from controller import RelayTuner, relay_gains
+from hardware import (PID, read_temp_ref, read_temp_sample, initialize, indicate_heating, indicate_starting_up,
+                      cleanup)
+from utils import clamp, fetch, roughly_equal, StopHeatingError
 
 
 async def idle(_loop):
@@ -53,6 +57,7 @@ async def idle(_loop):
        :const:`settings.WEB_API_BASE_ADDRESS` value.
     #. If the web response includes some basic information about a user-specified new calorimetry job,
        enter the :func:`main.active` loop.
+       If instead PID auto-tuning has been requested, run :func:`main.autotune`.
     #. After the :func:`main.active` loop has finished running, this function will have control again,
        which suggests that the active job has ended.
     #. Renew running this loop after a certain time interval.
@@ -84,9 +89,16 @@ async def idle(_loop):
         active_run = data['has_active_runs']
 
         if isinstance(active_run, bool) and not active_run:
-            # Sleep for a set interval determined in settings.py
-            # so this can be refreshed later
-            await asyncio.sleep(data.get('idle_loop_interval') or settings.WEB_API_IDLE_INTERVAL)
+            if data.get('autotune_requested'):
+                if settings.DEBUG:
+                    print('****************************************'
+                          '\nThe main event loop has entered the AUTO-TUNE LOOP.')
+
+                await autotune(_loop, **data)
+            else:
+                # Sleep for a set interval determined in settings.py
+                # so this can be refreshed later
+                await asyncio.sleep(data.get('idle_loop_interval') or settings.WEB_API_IDLE_INTERVAL)
 
         elif isinstance(active_run, dict):
             # pass the active run information to the active function,
@@ -228,6 +240,10 @@ async def run_calorimetry(_loop, run):
     #. If temperatures have stabilised around the end temperature for a specified duration,
        stop heating and upload the remainder of all measurement data.
 
+    If feed-forward control is enabled on the web interface, the PID controllers of the run
+    also give the heaters the duty cycle the model of each cell predicts for the moving set point
+    (see :class:`controller.CellModel`), so that the ramp no longer lags while errors build up.
+
     :param _loop: the main event loop
     :param run: the object representing the run params.
     :exception StopHeatingError: raised when the end temperature has been reached for a certain amount of time.
@@ -267,6 +283,147 @@ async def run_calorimetry(_loop, run):
         await asyncio.sleep(run.interval)
 
 
+async def autotune(_loop, **calorimeter_data):
+    """
+    An asynchronous coroutine tuning the PID parameters of the calorimeter with its real heaters,
+    when requested from the Calibrate page of the web interface.
+
+    #. Run a relay feedback experiment on both cells at once with :class:`controller.RelayTuner`,
+       around the auto-tune temperature from the web API. The heaters are switched between two duty cycles
+       and the resulting oscillation gives the ultimate gain and period of each cell.
+    #. Derive PID parameters with :func:`controller.relay_gains`, from the smaller ultimate gain and the longer
+       ultimate period of the two cells, so that the parameters suit both.
+    #. Validate the parameters by stepping the set point up by :const:`settings.AUTOTUNE_VALIDATION_STEP`:
+       the cells must settle at it within :const:`settings.AUTOTUNE_VALIDATION_TIMEOUT` seconds,
+       without overshooting it by more than the temperature tolerance.
+    #. Upload the parameters if they are valid, and the outcome either way, which also clears the request.
+
+    Auto-tuning is abandoned if the request is withdrawn on the web interface,
+    as checked every :const:`settings.WEB_API_IDLE_INTERVAL` seconds.
+
+    :param _loop: The main event loop.
+    :param calorimeter_data: JSON representation of the calorimeter from the server API.
+    """
+    set_point = calorimeter_data.get('autotune_temp') or settings.AUTOTUNE_TEMP
+    interval = calorimeter_data.get('active_loop_interval') or settings.MAIN_LOOP_INTERVAL
+    tolerance = calorimeter_data.get('temp_tolerance_range') or settings.TEMP_TOLERANCE
+    duration = calorimeter_data.get('temp_tolerance_duration') or settings.TEMP_STABILISATION_MIN_DURATION
+
+    heater_ref, heater_sample, _ = initialize()
+    heaters = (heater_ref, heater_sample)
+    heater_ref.start(0), heater_sample.start(0)
+    _loop.call_soon(indicate_starting_up)
+
+    try:
+        # relay feedback experiment
+        tuners = [RelayTuner(set_point, settings.AUTOTUNE_RELAY_AMPLITUDE, settings.AUTOTUNE_HYSTERESIS,
+                             settings.AUTOTUNE_CYCLES, clock=_loop.time) for _ in heaters]
+        oscillated = await drive_heaters(_loop, heaters, tuners, interval, settings.AUTOTUNE_TIMEOUT,
+                                         lambda temps: all(tuner.is_finished for tuner in tuners))
+        if not oscillated:
+            await report_autotune(_loop, "The cells did not oscillate steadily around {0} °C within {1} s; "
+                                         "PID parameters are unchanged.".format(set_point, settings.AUTOTUNE_TIMEOUT))
+            return
+
+        ultimate = [tuner.ultimate() for tuner in tuners]
+        ultimate_gain = min(gain for gain, _ in ultimate)
+        ultimate_period = max(period for _, period in ultimate)
+        Kp, Ki, Kd = relay_gains(ultimate_gain, ultimate_period)
+        summary = "ultimate gain {0:.3g} %/°C and period {1:.3g} s give K_p={2:.3g}, K_i={3:.3g}, K_d={4:.3g}".format(
+            ultimate_gain, ultimate_period, Kp, Ki, Kd)
+        if settings.DEBUG:
+            print('Auto-tune: ' + summary)
+
+        # validation with a step of the set point
+        new_set_point = set_point + settings.AUTOTUNE_VALIDATION_STEP
+        pids = [PID(temp, Kp, Ki, Kd, set_point=new_set_point)
+                for temp in await asyncio.gather(read_temp_ref(), read_temp_sample(), loop=_loop)]
+        overshoot, settled_since = [0.], [_loop.time()]
+
+        def has_settled(temps):
+            now = _loop.time()
+            overshoot[0] = max([overshoot[0]] + [temp - new_set_point for temp in temps])
+            if not roughly_equal(temps[0], temps[1], new_set_point, tolerence=tolerance):
+                settled_since[0] = now
+            return now - settled_since[0] >= duration
+
+        started = _loop.time()
+        settled = await drive_heaters(_loop, heaters, pids, interval, settings.AUTOTUNE_VALIDATION_TIMEOUT,
+                                      has_settled)
+        if not settled:
+            await report_autotune(_loop, "Auto-tuning found {0}, but with them the cells did not settle within {1} s; "
+                                         "PID parameters are unchanged.".format(
+                                             summary, settings.AUTOTUNE_VALIDATION_TIMEOUT))
+        elif overshoot[0] > tolerance:
+            await report_autotune(_loop, "Auto-tuning found {0}, but with them the cells overshot by {1:.2g} °C; "
+                                         "PID parameters are unchanged.".format(summary, overshoot[0]))
+        else:
+            await report_autotune(_loop, "Auto-tuning found {0}, which settled a {1} °C step in {2:.0f} s "
+                                         "with {3:.2g} °C overshoot.".format(
+                                             summary, settings.AUTOTUNE_VALIDATION_STEP,
+                                             _loop.time() - started - duration, overshoot[0]),
+                                  K_p=Kp, K_i=Ki, K_d=Kd)
+
+    # when the request is withdrawn, stop heating and return to idle function
+    except StopHeatingError:
+        pass
+
+    finally:
+        cleanup(heater_sample, heater_ref, wipe=True)
+        initialize(board_only=True)
+
+
+async def drive_heaters(_loop, heaters, controllers, interval, timeout, is_done):
+    """
+    Drives each heater with a controller, either a :class:`hardware.PID` or a :class:`controller.RelayTuner`,
+    from the temperature of its cell, until a condition on the temperatures is met.
+    Used by :func:`autotune`, which uploads no measurements, so the web API is only checked for withdrawal of the
+    auto-tune request, every :const:`settings.WEB_API_IDLE_INTERVAL` seconds.
+
+    :param heaters: reference and sample heater PWM objects
+    :param controllers: controllers of the reference and sample heaters
+    :param interval: seconds between updates of the heaters
+    :param timeout: seconds after which to give up
+    :param is_done: function of the reference and sample temperatures, returning whether to stop
+    :return: whether the condition was met before the time out
+    :exception StopHeatingError: if auto-tuning is no longer requested
+    """
+    started = last_checked = _loop.time()
+    while _loop.time() - started < timeout:
+        temps = await asyncio.gather(read_temp_ref(), read_temp_sample(), loop=_loop)
+        for heater, controller, temp in zip(heaters, controllers, temps):
+            _loop.call_soon(heater.ChangeDutyCycle, clamp(controller.update(temp)))
+        if is_done(temps):
+            return True
+
+        if _loop.time() - last_checked >= settings.WEB_API_IDLE_INTERVAL:
+            last_checked = _loop.time()
+            async with aiohttp.ClientSession(loop=_loop) as session:
+                data = await fetch(session, 'PUT', settings.WEB_API_STATUS_ADDRESS,
+                                   timeout=settings.WEB_API_IDLE_INTERVAL,
+                                   payload={'current_ref_temp': temps[0], 'current_sample_temp': temps[1]})
+            if not data.get('autotune_requested'):
+                raise StopHeatingError
+
+        await asyncio.sleep(interval)
+    return False
+
+
+async def report_autotune(_loop, result, **gains):
+    """
+    Uploads the outcome of :func:`autotune`, clearing the request.
+
+    :param result: description of the outcome, shown on the Calibrate page
+    :param gains: `K_p`, `K_i` and `K_d` to save, if tuning succeeded
+    """
+    if settings.DEBUG:
+        print(result)
+    async with aiohttp.ClientSession(loop=_loop) as session:
+        await fetch(session, 'PUT', settings.WEB_API_STATUS_ADDRESS, timeout=settings.WEB_API_IDLE_INTERVAL,
+                    retries=settings.WEB_API_UPLOAD_RETRIES,
+                    payload=dict(gains, autotune_requested=False, autotune_result=result))
+
+
 if __name__ == '__main__':
     # For some reason, some imports on the raspberry pi do not work unless the following is included
     ROOT_DIR = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
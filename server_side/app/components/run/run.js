@@ -83,12 +83,14 @@ export default class Run extends Component {
       expanded: false,
       data_points: [],
       autorefreshInt: null,
+      eventSource: null,
       stopDialogOpen: false,
       has_retrieved_from_server: false,
       is_ready_checkbox_loading: false,
       show_is_ready_notification: false,
     };
     this.refresh = this.refresh.bind(this);
+    this.subscribe = this.subscribe.bind(this);
     this.onExpandChange = this.onExpandChange.bind(this);
     this.renderDetails = this.renderDetails.bind(this);
     this.cancelAutorefresh = this.cancelAutorefresh.bind(this);
@@ -97,19 +99,17 @@ export default class Run extends Component {
   }
 
   normalize(data_points) {
-    const sorted = data_points.sort((prev, next) => {
-      return new Date(prev.measured_at) - new Date(next.measured_at)
-    });
-    const oldest_point = sorted[0];
+    // heat_diff, temp_average and elapsed_s are computed by the server when data points are received
+    const sorted = data_points.sort((prev, next) => prev.elapsed_s - next.elapsed_s);
     return sorted.map((value) => {
-      const new_value = value;
-      const measured_at = moment(value.measured_at);
-      new_value.time_since = Math.abs(measured_at.diff(oldest_point.measured_at, 'seconds'));
-      new_value.time_of_day = measured_at.unix();
-      if (new_value.temp_sample >= this.props.run.start_temp) {
-        new_value.heat_diff = LPF.next(value.heat_sample - value.heat_ref);
+      // points normalized on an earlier refresh are kept as they are, so each is only smoothed once
+      if (value.time_since !== undefined) {
+        return value;
       }
-      new_value.temp_average = (value.temp_sample + value.temp_ref) / 2;
+      const new_value = value;
+      new_value.time_since = value.elapsed_s;
+      new_value.time_of_day = moment(value.measured_at).unix();
+      new_value.heat_diff = value.temp_sample >= this.props.run.start_temp ? LPF.next(value.heat_diff) : undefined;
       return new_value;
     });
   }
@@ -138,19 +138,38 @@ export default class Run extends Component {
         toggleLoading();
       })
   }
+  subscribe() {
+    // live data points are pushed by the server, so one open page costs no database queries
+    const {run, code} = this.props;
+    const eventSource = new EventSource(`/api/stream/?access_code=${code}&run=${run.id}`);
+    eventSource.addEventListener('data', (event) => {
+      const concatenated = concat(this.state.data_points, JSON.parse(event.data));
+      this.setState({ data_points: this.normalize(concatenated), has_retrieved_from_server: true });
+    });
+    eventSource.addEventListener('finished', () => eventSource.close());
+    return eventSource;
+  }
   cancelAutorefresh() {
-    const {autorefreshInt} = this.state;
+    const {autorefreshInt, eventSource} = this.state;
     window.clearInterval(autorefreshInt);
+    if(!!eventSource) {
+      eventSource.close();
+    }
   }
   componentWillReceiveProps(nextProps) {
-    const { expanded, autorefreshInt } = this.state;
+    const { expanded, autorefreshInt, eventSource } = this.state;
     const { autorefresh } = this.props;
     const { is_running, is_finished, show_is_ready_notification } = this.props.run;
-    if( expanded && !autorefreshInt && (!is_finished || is_running) ) {
-      this.refresh();
-      const int = window.setInterval(this.refresh, 5000);
-      this.setState({autorefreshInt: int});
-    } else if ( !autorefresh && autorefreshInt ) {
+    if( expanded && !autorefreshInt && !eventSource && (!is_finished || is_running) ) {
+      if( !!window.EventSource ) {
+        this.setState({eventSource: this.subscribe()});
+        this.refresh();
+      } else {
+        this.refresh();
+        const int = window.setInterval(this.refresh, 5000);
+        this.setState({autorefreshInt: int});
+      }
+    } else if ( !autorefresh && (autorefreshInt || eventSource) ) {
       this.cancelAutorefresh();
     } else if ( !nextProps.run.is_ready && nextProps.run.stabilized_at_start && !show_is_ready_notification) {
       this.setState({show_is_ready_notification: true});
@@ -164,8 +183,8 @@ export default class Run extends Component {
     }
   }
   componentWillUnmount() {
-    const {autorefreshInt} = this.state;
-    if(!!autorefreshInt || autorefreshInt == 0) {
+    const {autorefreshInt, eventSource} = this.state;
+    if(!!autorefreshInt || autorefreshInt == 0 || !!eventSource) {
       this.cancelAutorefresh();
     }
   }
@@ -216,7 +235,7 @@ export default class Run extends Component {
     )
   }
   render() {
-    const { run } = this.props;
+    const { run, code } = this.props;
     const { expanded, data_points, stopDialogOpen, has_retrieved_from_server,
       is_ready_checkbox_loading, show_is_ready_notification } = this.state;
     const { id, name, is_running, is_ready, is_finished, data_point_count, stabilized_at_start } = run;
@@ -242,7 +261,7 @@ export default class Run extends Component {
                         disabled={is_ready_checkbox_loading || is_ready}
                         onTouchTap={this.onIsReadyChecked} />
           }
-          {data_point_count > 0 && <RaisedButton href={`/download/${id}/?format=csv`} target="_blank"
+          {data_point_count > 0 && <RaisedButton href={`/download/${id}/?format=csv&access_code=${code}`} target="_blank"
             label="Download As .csv" icon={<CloudDownload/>}/>}
           {!is_active && <RaisedButton onTouchTap={this.onExpandChange}
             label={expanded ? "Hide Data" : "View Data"} icon={<MoreVert/>} /> }
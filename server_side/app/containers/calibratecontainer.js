@@ -6,6 +6,7 @@ import CardText from 'material-ui/Card/CardText';
 import FlatButton from 'material-ui/FlatButton';
 import RaisedButton from 'material-ui/RaisedButton';
 import TextField from 'material-ui/TextField';
+import Toggle from 'material-ui/Toggle';
 import Snackbar from 'material-ui/Snackbar';
 
 import {teal900} from 'material-ui/styles/colors';
@@ -22,6 +23,7 @@ export default class CalibrateContainer extends Component {
     this.onFieldChange = this.onFieldChange.bind(this);
     this.renderTextField = this.renderTextField.bind(this);
     this.submit = this.submit.bind(this);
+    this.requestAutotune = this.requestAutotune.bind(this);
   }
 
   onFieldChange(field, event, newValue) {
@@ -35,8 +37,10 @@ export default class CalibrateContainer extends Component {
 
   submit() {
     const { toggleLoading, statusRefresh } = this.props;
+    // the auto-tune request is only changed with its own buttons, and its outcome only by the device
+    const { autotune_requested, autotune_result, ...calorimeter } = this.state.calorimeter;
     toggleLoading();
-    axios.put('/api/status/', this.state.calorimeter)
+    axios.put('/api/status/', calorimeter)
       .then((response) => {
         toggleLoading();
         statusRefresh();
@@ -48,6 +52,25 @@ export default class CalibrateContainer extends Component {
       })
   }
 
+  requestAutotune(requested) {
+    const { toggleLoading, statusRefresh } = this.props;
+    toggleLoading();
+    axios.put('/api/status/', {
+      access_code: this.props.code,
+      autotune_requested: requested,
+      autotune_temp: this.state.calorimeter.autotune_temp,
+    })
+      .then((response) => {
+        toggleLoading();
+        statusRefresh();
+        this.setState({calorimeter: {...this.state.calorimeter, autotune_requested: response.data.autotune_requested}});
+      })
+      .catch((error) => {
+        toggleLoading();
+        alert(!!error.response ? error.response.data : error);
+      })
+  }
+
   renderTextField(field, floatingLabel, fixedLabel) {
     return (
       <div style={{minWidth: '80%', marginBottom: '1.5em'}}>
@@ -70,6 +93,35 @@ export default class CalibrateContainer extends Component {
           {renderTextField('K_p', 'Proportionality Factor')}
           {renderTextField('K_i', 'Integral Factor')}
           {renderTextField('K_d', 'Derivative Factor')}
+          <div style={{minWidth: '80%', marginBottom: '1.5em'}}>
+            <Toggle label="Feed-forward from the thermal model" labelPosition="right"
+                    toggled={!!this.state.calorimeter.feed_forward}
+                    disabled={!this.state.calorimeter.plant_fitted_at}
+                    onToggle={this.onFieldChange.bind(null, 'feed_forward')}/>
+            <p className="text-muted" style={{fontSize: '90%'}}>
+              {!!this.state.calorimeter.plant_fitted_at ?
+                'The heaters are given the power the thermal model of each cell predicts for the current set point and ramp rate, and the PID controller only corrects the remainder. This keeps fast ramps linear.' :
+                'Available once thermal models of the cells have been fitted from recorded runs.'}
+            </p>
+          </div>
+          <br/>
+
+          <h3>PID Auto-tune</h3>
+          <p>
+            The device can find PID parameters itself, by switching its heaters on and off around a temperature
+            and timing the oscillation, then checking the parameters on a small step.
+            This takes several minutes, during which no jobs can be started.
+            Valid parameters replace those above.
+          </p>
+          {renderTextField('autotune_temp', 'Auto-tune temperature',
+            'Pick a temperature in the middle of the range your jobs usually cover. Unit: °C.')}
+          {!!this.props.calorimeter.autotune_result &&
+            <p className="text-muted" style={{fontSize: '90%'}}>Last auto-tune: {this.props.calorimeter.autotune_result}</p>}
+          <div className="text-right">
+            {this.state.calorimeter.autotune_requested ?
+              <FlatButton label="Cancel Auto-tune" onTouchTap={this.requestAutotune.bind(null, false)}/> :
+              <RaisedButton label="Auto-tune" secondary onTouchTap={this.requestAutotune.bind(null, true)}/>}
+          </div>
           <br/>
 
           <h3>Temperature Stabilization</h3>
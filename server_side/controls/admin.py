@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Calorimeter, Run, DataPoint
+from .models import Calorimeter, Run, DataPoint, Notification
 
 
 @admin.register(Calorimeter)
@@ -17,3 +17,9 @@ class DataPointInline(admin.TabularInline):
 @admin.register(Run)
 class RunAdmin(admin.ModelAdmin):
     inlines = (DataPointInline, )
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'created_at', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('kind', )
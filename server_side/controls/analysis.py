@@ -0,0 +1,318 @@
+""" Thermogram analysis of the data points of a run.
+
+The differential heat flow (sample minus reference, in mW), less that of a matching blank run if there is one
+(see :mod:`controls.baselines`), is smoothed, plotted against sample temperature,
+and corrected by subtracting a polynomial baseline fitted to the parts of the run without thermal events.
+Thermal events are found as excursions of the corrected heat flow well beyond its noise,
+and each is described by its onset, peak and end temperatures and its enthalpy,
+the integral of the corrected heat flow over time.
+
+A positive heat flow means that the sample cell took more heat than the reference cell,
+so positive peaks are endothermic and negative peaks exothermic.
+
+Every step is vectorised with NumPy, so runs of a hundred thousand data points are analysed in milliseconds.
+NumPy is optional; :func:`is_available` tells whether analysis is possible on this server.
+
+Results are stored as :class:`controls.models.AnalysisResult` by :func:`cached_analysis`,
+and reused until the run receives more data points.
+"""
+
+import hashlib
+import json
+
+from server_side.controls.baselines import blank_heat_flow, describe_blank, find_blank
+from server_side.controls.exports import load_run_columns
+from server_side.controls.models import AnalysisResult
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_PARAMETERS = {
+    'smoothing': 9,
+    'baseline_order': 1,
+    'threshold': 5.,
+    'min_width': 5,
+    'points': 500,
+    'blank': 1,
+}
+"""Analysis parameters and their defaults:
+
+* `smoothing`: width, in data points, of the centred moving average applied to the heat flow. 1 disables smoothing.
+* `baseline_order`: degree of the baseline polynomial in temperature, from 0 to 3.
+* `threshold`: height, in multiples of the noise, that the corrected heat flow must reach to be a peak.
+* `min_width`: fewest data points in a peak.
+* `points`: most points of the curves returned for plotting. 0 leaves the curves out.
+* `blank`: 1 subtracts the heat flow of the blank run found by :func:`controls.baselines.find_blank`, 0 does not.
+"""
+
+BASELINE_ITERATIONS = 5
+"""Number of times the baseline is refitted, each time leaving out the data points of thermal events."""
+
+NOISE_SCALE = 1.4826
+"""Ratio of the standard deviation of normally distributed noise to its median absolute deviation."""
+
+
+def is_available():
+    """Whether NumPy, which analysis needs, is installed."""
+    return numpy is not None
+
+
+def parse_parameters(query):
+    """
+    Reads analysis parameters from a query dict, using defaults for missing ones.
+
+    :param query: dict-like of parameter name to string, e.g. a request's GET parameters
+    :return: dict of all parameters in :const:`DEFAULT_PARAMETERS`, converted to their types
+    :exception ValueError: if a parameter is malformed or out of range
+    """
+    parameters = {}
+    for name, default in DEFAULT_PARAMETERS.items():
+        parameters[name] = type(default)(query.get(name, default))
+
+    if parameters['smoothing'] < 1 or parameters['min_width'] < 1 or parameters['points'] < 0:
+        raise ValueError("Smoothing, minimum width and points must be positive.")
+    if not 0 <= parameters['baseline_order'] <= 3:
+        raise ValueError("Baseline order must be from 0 to 3.")
+    if not parameters['threshold'] > 0:
+        raise ValueError("Threshold must be positive.")
+    if parameters['blank'] not in (0, 1):
+        raise ValueError("Blank must be 0 or 1.")
+    return parameters
+
+
+def smooth(values, width):
+    """
+    Centred moving average, computed from cumulative sums in O(n).
+    Near the ends the window shrinks to the available data points.
+
+    :param values: 1D array
+    :param width: window width in data points
+    :return: array of the same length
+    """
+    if width <= 1 or len(values) == 0:
+        return numpy.asarray(values, dtype=numpy.float64)
+    half = width // 2
+    cumulative = numpy.concatenate(([0.], numpy.cumsum(values, dtype=numpy.float64)))
+    indexes = numpy.arange(len(values))
+    lower = numpy.maximum(indexes - half, 0)
+    upper = numpy.minimum(indexes + half + 1, len(values))
+    return (cumulative[upper] - cumulative[lower]) / (upper - lower)
+
+
+def estimate_noise(values):
+    """Standard deviation of the noise in a series, estimated robustly from its median absolute deviation."""
+    if len(values) == 0:
+        return 0.
+    return float(NOISE_SCALE * numpy.median(numpy.abs(values - numpy.median(values))))
+
+
+def fit_baseline(temperature, heat_flow, order, threshold):
+    """
+    Fits a polynomial baseline of heat flow against temperature.
+    The fit is repeated leaving out data points further from the previous baseline than the threshold allows,
+    so that thermal events do not pull the baseline towards them.
+
+    :return: tuple of the polynomial coefficients, highest degree first, and the baseline at every data point
+    """
+    included = numpy.ones(len(temperature), dtype=bool)
+    coefficients = numpy.zeros(order + 1)
+    for _ in range(BASELINE_ITERATIONS):
+        if included.sum() <= order:
+            break
+        coefficients = numpy.polyfit(temperature[included], heat_flow[included], order)
+        residual = heat_flow - numpy.polyval(coefficients, temperature)
+        noise = estimate_noise(residual[included])
+        still_included = numpy.abs(residual) <= threshold * noise if noise > 0 else included
+        if numpy.array_equal(still_included, included):
+            break
+        included = still_included
+    return coefficients, numpy.polyval(coefficients, temperature)
+
+
+def _runs(mask):
+    """Start and end (exclusive) indexes of the runs of consecutive True values in a boolean array."""
+    edges = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+
+def _extend_to_baseline(signed, starts, ends):
+    """
+    Widens runs of data points above the noise to the data points where the heat flow returns to the baseline,
+    so that their tails are included, merging runs that share the same stretch above the baseline.
+    """
+    # bounded by virtual baseline points just before the first and just after the last data point
+    at_baseline = numpy.concatenate(([-1], numpy.flatnonzero(signed <= 0), [len(signed)]))
+    starts = at_baseline[numpy.searchsorted(at_baseline, starts) - 1] + 1
+    ends = at_baseline[numpy.searchsorted(at_baseline, ends)]
+    return numpy.unique(starts), numpy.unique(ends)
+
+
+def find_peaks(time, temperature, corrected, noise, threshold, min_width):
+    """
+    Finds thermal events in a baseline-corrected heat flow.
+
+    A peak is a stretch of data points on the same side of the baseline, at least `min_width` long,
+    which somewhere reaches `threshold` times the noise.
+
+    :return: list of peak dicts, in order of time. Temperatures are in degrees Celsius, times in seconds,
+        `height` is the corrected heat flow at the peak in mW and `enthalpy` is in mJ.
+    """
+    if noise <= 0 or len(corrected) == 0:
+        return []
+
+    peaks = []
+    for sign, direction in ((1, 'endothermic'), (-1, 'exothermic')):
+        signed = sign * corrected
+        starts, ends = _runs(signed > noise)
+        if not len(starts):
+            continue
+        starts, ends = _extend_to_baseline(signed, starts, ends)
+        heights = numpy.maximum.reduceat(signed, starts)
+        keep = (heights >= threshold * noise) & (ends - starts >= min_width)
+
+        for start, end in zip(starts[keep], ends[keep]):
+            peak = start + int(numpy.argmax(signed[start:end]))
+            peaks.append({
+                'direction': direction,
+                'onset_temp': _onset_temperature(time, temperature, signed, start, peak),
+                'peak_temp': float(temperature[peak]),
+                'end_temp': float(temperature[end - 1]),
+                'start_time': float(time[start]),
+                'peak_time': float(time[peak]),
+                'end_time': float(time[end - 1]),
+                'height': float(corrected[peak]),
+                'enthalpy': _integrate(corrected[start:end], time[start:end]),
+            })
+    return sorted(peaks, key=lambda peak: peak['start_time'])
+
+
+def _integrate(values, time):
+    """Integral of a series over time, by the trapezoidal rule."""
+    return float(numpy.sum((values[1:] + values[:-1]) * numpy.diff(time)) / 2)
+
+
+def _onset_temperature(time, temperature, signed, start, peak):
+    """
+    Extrapolated onset temperature of a peak: where the tangent to its leading edge meets the baseline.
+    The tangent is fitted to the leading edge between a quarter and three quarters of the peak height,
+    as slopes between single data points are swamped by noise.
+    Falls back to the temperature at the start of the peak if the edge has too few data points.
+    """
+    edge_time, edge = time[start:peak + 1], signed[start:peak + 1]
+    height = signed[peak]
+    fitted = (edge >= height / 4) & (edge <= height * 3 / 4)
+    if fitted.sum() < 2:
+        return float(temperature[start])
+    slope, intercept = numpy.polyfit(edge_time[fitted], edge[fitted], 1)
+    if slope <= 0:
+        return float(temperature[start])
+    onset_time = min(max(-intercept / slope, edge_time[0]), edge_time[-1])
+    return float(numpy.interp(onset_time, time, temperature))
+
+
+def downsample(count, points):
+    """Indexes of at most `points` evenly spaced data points out of `count`, including the first and last."""
+    if count <= points:
+        return numpy.arange(count)
+    return numpy.unique(numpy.linspace(0, count - 1, points).round().astype(numpy.int64))
+
+
+def analyze_columns(columns, parameters, start_temp=None, blank=None):
+    """
+    Analyses measurement columns.
+
+    :param columns: dict with arrays `time` (seconds), `temp_sample` and `heat_diff`,
+        as returned by :func:`controls.exports.load_run_columns`
+    :param parameters: analysis parameters, as returned by :func:`parse_parameters`
+    :param start_temp: if given, data points at lower sample temperatures are left out,
+        as they were measured while the calorimeter was settling at the start temperature
+    :param blank: if given, a :class:`controls.models.BlankBaseline` whose heat flow is subtracted
+    :return: JSON-ifiable dict of the analysis
+    """
+    time = numpy.asarray(columns['time'], dtype=numpy.float64)
+    temperature = numpy.asarray(columns['temp_sample'], dtype=numpy.float64)
+    heat_flow = numpy.asarray(columns['heat_diff'], dtype=numpy.float64)
+    if start_temp is not None:
+        included = temperature >= start_temp
+        time, temperature, heat_flow = time[included], temperature[included], heat_flow[included]
+    if blank is not None:
+        heat_flow = heat_flow - blank_heat_flow(blank, temperature)
+
+    result = {
+        'parameters': parameters,
+        'count': len(time),
+        'blank': describe_blank(blank) if blank is not None else None,
+        'baseline': None,
+        'noise': None,
+        'peaks': [],
+        'curves': None,
+    }
+    if len(time) <= parameters['baseline_order']:
+        return result
+
+    smoothed = smooth(heat_flow, parameters['smoothing'])
+    coefficients, baseline = fit_baseline(temperature, smoothed, parameters['baseline_order'],
+                                          parameters['threshold'])
+    corrected = smoothed - baseline
+    noise = estimate_noise(corrected)
+
+    result['baseline'] = [float(coefficient) for coefficient in coefficients]
+    result['noise'] = noise
+    result['peaks'] = find_peaks(time, temperature, corrected, noise,
+                                 parameters['threshold'], parameters['min_width'])
+    if parameters['points']:
+        indexes = downsample(len(time), parameters['points'])
+        result['curves'] = {
+            'time': time[indexes].tolist(),
+            'temp_sample': temperature[indexes].tolist(),
+            'heat_diff': smoothed[indexes].tolist(),
+            'baseline': baseline[indexes].tolist(),
+            'corrected': corrected[indexes].tolist(),
+        }
+    return result
+
+
+def analyze_run(run, parameters):
+    """
+    Analyses all data points of a run, whether stored as rows or archived.
+
+    :param run: a :class:`controls.models.Run`
+    :param parameters: analysis parameters, as returned by :func:`parse_parameters`
+    :return: JSON-ifiable dict of the analysis, see :func:`analyze_columns`
+    """
+    blank = find_blank(run) if parameters['blank'] else None
+    return analyze_columns(load_run_columns(run), parameters, start_temp=run.start_temp, blank=blank)
+
+
+def parameters_hash(run, parameters, blank=None):
+    """Hash of the analysis parameters and the run settings and blank run that the analysis depends on."""
+    blank_key = (blank.run_id, blank.computed_at.isoformat()) if blank is not None else None
+    key = json.dumps(dict(parameters, start_temp=run.start_temp, blank_run=blank_key), sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def cached_analysis(run, parameters):
+    """
+    Analyses a run like :func:`analyze_run`, reusing the stored result
+    if the run has not received data points since, and its blank run has not changed.
+
+    :param run: a :class:`controls.models.Run`
+    :param parameters: analysis parameters, as returned by :func:`parse_parameters`
+    :return: JSON-ifiable dict of the analysis, see :func:`analyze_columns`
+    """
+    blank = find_blank(run) if parameters['blank'] else None
+    key = parameters_hash(run, parameters, blank)
+    stored = AnalysisResult.objects.filter(run=run, parameters_hash=key).first()
+    if stored is not None and stored.watermark == run.data_point_count:
+        return json.loads(stored.result)
+
+    result = analyze_columns(load_run_columns(run), parameters, start_temp=run.start_temp, blank=blank)
+
+    # the count read with the run is kept, as data points received during the analysis may not be in it
+    AnalysisResult.objects.update_or_create(run=run, parameters_hash=key, defaults={
+        'watermark': run.data_point_count,
+        'result': json.dumps(result),
+    })
+    return result
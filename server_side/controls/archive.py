@@ -0,0 +1,115 @@
+""" Compact storage of the data points of finished runs.
+
+A run's data points take a database row each, around a hundred bytes with indexes.
+Once a run has finished they are never changed again, so :func:`archive_run` replaces them with
+a :class:`controls.models.RunArchive` holding all of them in the fixed-point delta encoding of
+:mod:`controls.deltacodec`, typically a few bytes per data point.
+Measurements are rounded to the resolution of the sensors and times to whole milliseconds.
+
+Code reading the data points of a run checks :func:`get_archive` first,
+and reads archived runs through :func:`load_archived_columns` or :func:`archived_data_points`.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+
+from server_side.controls import deltacodec
+from server_side.controls.models import AnalysisResult, DataPoint, RunArchive
+from server_side.controls.rollups import EPOCH
+
+MILLISECOND = timedelta(milliseconds=1)
+
+ARCHIVE_COLUMNS = (
+    ('measured_at', 1),
+    ('received_at', 1),
+    ('temp_ref', deltacodec.TEMP_QUANTUM),
+    ('temp_sample', deltacodec.TEMP_QUANTUM),
+    ('heat_ref', deltacodec.HEAT_QUANTUM),
+    ('heat_sample', deltacodec.HEAT_QUANTUM),
+)
+"""Data point fields stored in archives with their quanta. Times are stored as milliseconds since the POSIX epoch."""
+
+
+def get_archive(run):
+    """The :class:`controls.models.RunArchive` of a run, or None if its data points are stored as rows."""
+    try:
+        return run.archive
+    except RunArchive.DoesNotExist:
+        return None
+
+
+def encode_data_points(run):
+    """
+    Encodes all data points of a run, in order of measurement time.
+
+    :return: tuple of the encoded bytes and the number of data points
+    """
+    fields = [name for name, _ in ARCHIVE_COLUMNS]
+    rows = DataPoint.objects.filter(run=run).order_by('measured_at', 'id').values_list(*fields)
+    columns = list(zip(*rows.iterator())) or [()] * len(fields)
+
+    series = []
+    for (name, quantum), values in zip(ARCHIVE_COLUMNS, columns):
+        if name in ('measured_at', 'received_at'):
+            values = [(value - EPOCH) // MILLISECOND for value in values]
+        series.append((name, quantum, values))
+    return deltacodec.encode(series), len(columns[0])
+
+
+def archive_run(run):
+    """
+    Moves the data points of a finished run into a :class:`controls.models.RunArchive`, deleting their rows.
+    The archive is decoded and checked against the rows before they are deleted.
+    Stored analyses of the run are deleted too, as archived measurements are rounded.
+
+    :param run: a finished :class:`controls.models.Run` without an archive
+    :return: the new archive
+    :exception ValueError: if the run is not finished, or the archive does not match the rows
+    """
+    if not run.is_finished:
+        raise ValueError("{0} has not finished.".format(repr(run)))
+
+    with transaction.atomic():
+        data, count = encode_data_points(run)
+        archive = RunArchive(run=run, data=data, data_point_count=count)
+
+        decoded = load_archived_columns(archive)
+        if any(len(values) != count for values in decoded.values()):
+            raise ValueError("Archive of {0} does not hold all {1} data points.".format(repr(run), count))
+
+        archive.save()
+        DataPoint.objects.filter(run=run).delete()
+        AnalysisResult.objects.filter(run=run).delete()
+    return archive
+
+
+def load_archived_columns(archive):
+    """
+    Decodes an archive into columns.
+
+    :return: dict of field name to values, NumPy arrays if NumPy is installed and lists otherwise.
+        ``measured_at`` and ``received_at`` hold milliseconds since the POSIX epoch.
+    """
+    return deltacodec.decode(bytes(archive.data))
+
+
+def archived_data_points(archive):
+    """
+    Decodes an archive into unsaved :class:`controls.models.DataPoint` objects, in order of measurement time.
+    Derived fields are computed again, as they are not archived.
+    """
+    columns = load_archived_columns(archive)
+    names = [name for name, _ in ARCHIVE_COLUMNS]
+    data_points = []
+    for values in zip(*[columns[name] for name in names]):
+        fields = {name: float(value) for name, value in zip(names, values)}
+        fields['measured_at'] = EPOCH + int(fields['measured_at']) * MILLISECOND
+        fields['received_at'] = EPOCH + int(fields['received_at']) * MILLISECOND
+        data_points.append(DataPoint(run_id=archive.run_id, **fields))
+
+    if data_points:
+        time_origin = archive.run.time_origin or data_points[0].measured_at
+        for data_point in data_points:
+            data_point.derive(time_origin)
+    return data_points
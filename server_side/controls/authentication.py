@@ -0,0 +1,103 @@
+""" Resolution of the calorimeter making or targeted by an API request,
+from the access code (and optionally the serial number) it carries.
+
+Devices upload every few seconds, so resolved calorimeters are kept in Django's cache for a few seconds
+instead of being fetched from the database on every request.
+Cached entries are discarded whenever a calorimeter is saved or deleted.
+With the default local-memory cache this only happens within the saving server process;
+configure a shared cache backend to invalidate across processes.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from server_side.controls.models import Calorimeter
+
+DEVICE_CACHE_TIMEOUT = 15
+"""Seconds for which a resolved calorimeter may be reused without reading the database."""
+
+_UNKNOWN = 'unknown'
+"""Cached in place of a calorimeter when no calorimeter has the access code, so wrong codes are cheap too."""
+
+
+def _get_credential(request, name):
+    """Reads a field from the GET parameters of GET and DELETE requests, or from the request body otherwise."""
+    if request.method in ('GET', 'DELETE',):
+        return request.GET.get(name)
+    try:
+        return request.data.get(name)
+    except AttributeError:
+        return None
+
+
+def get_access_code(request):
+    """
+    Reads the access code of a request.
+
+    :param request: REST framework request object
+    :return: the access code, or None if the request does not have one
+    """
+    return _get_credential(request, 'access_code')
+
+
+def get_serial(request):
+    """
+    Reads the serial number of a request. Devices send theirs so that they can share an access code.
+
+    :param request: REST framework request object
+    :return: the serial number, or None if the request does not have one
+    """
+    return _get_credential(request, 'serial')
+
+
+def _cache_key(access_code, serial=None):
+    credentials = '{0}:{1}'.format(serial or '', access_code)
+    return 'device:{0}'.format(hashlib.md5(credentials.encode('utf-8')).hexdigest())
+
+
+def get_device(access_code, serial=None):
+    """
+    Resolves the calorimeter with an access code, and a serial number if given, from the cache if possible.
+
+    :param access_code: access code given in a request
+    :param serial: serial number given in a request
+    :return: a :class:`controls.models.Calorimeter` object, or None if no calorimeter has these credentials
+    """
+    if not access_code:
+        return None
+
+    key = _cache_key(access_code, serial)
+    calorimeter = cache.get(key)
+    if calorimeter is None:
+        calorimeters = Calorimeter.objects.filter(access_code=access_code)
+        if serial:
+            calorimeters = calorimeters.filter(serial=serial)
+        calorimeter = calorimeters.order_by('pk').first() or _UNKNOWN
+        cache.set(key, calorimeter, DEVICE_CACHE_TIMEOUT)
+    return None if calorimeter == _UNKNOWN else calorimeter
+
+
+def remember_device(calorimeter):
+    """
+    Stores a calorimeter whose readings were changed with a queryset update, which does not send signals.
+    The entry keyed by access code alone is discarded instead, as other calorimeters may share the code.
+    """
+    cache.set(_cache_key(calorimeter.access_code, calorimeter.serial), calorimeter, DEVICE_CACHE_TIMEOUT)
+    cache.delete(_cache_key(calorimeter.access_code))
+
+
+def forget_device(calorimeter):
+    """Discards the cached copies of a calorimeter, so that the next request reads it from the database."""
+    cache.delete_many([
+        _cache_key(calorimeter.access_code),
+        _cache_key(calorimeter.access_code, calorimeter.serial),
+    ])
+
+
+@receiver(post_save, sender=Calorimeter)
+@receiver(post_delete, sender=Calorimeter)
+def invalidate_device(sender, instance, **kwargs):
+    forget_device(instance)
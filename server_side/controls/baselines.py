@@ -0,0 +1,109 @@
+""" A library of blank runs, subtracted from the heat flow of other runs.
+
+Even with empty pans, the two cells of a calorimeter never take exactly the same heat,
+and the difference changes with temperature and ramp rate.
+A run made with empty pans can be marked as a blank run with :func:`build_blank`,
+which stores its differential heat flow against sample temperature as a :class:`controls.models.BlankBaseline`,
+resampled once onto an evenly spaced grid.
+Later runs of the same calorimeter at about the same ramp rate are then corrected with :func:`blank_heat_flow`,
+a single interpolation of the stored curve at their temperatures, without reading the blank run's data points.
+
+:mod:`controls.analysis` and the exports of :mod:`controls.exports` apply the blank found by :func:`find_blank`.
+Like :mod:`controls.analysis`, this needs NumPy.
+"""
+
+from django.db.models import F, Func
+
+from server_side.controls.exports import load_run_columns
+from server_side.controls.models import BlankBaseline
+from server_side.controls.overlay import MAX_POINTS, heat_flow_by_temperature, make_grid
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLANK_STEP = 0.05
+"""Spacing in degrees Celsius of the temperature grid of blank runs, finer than the sensors resolve over a ramp."""
+
+RAMP_RATE_TOLERANCE = 0.1
+"""Largest difference in ramp rate between a run and a blank run applied to it, as a fraction of the run's."""
+
+
+def build_blank(run):
+    """
+    Marks a run as a blank run of its calorimeter, or recomputes its stored heat flow.
+
+    :param run: a finished :class:`controls.models.Run` made with empty pans
+    :return: the saved :class:`controls.models.BlankBaseline`
+    :exception ValueError: if the run has no temperature ramp to speak of
+    """
+    temperatures, heat_flows = heat_flow_by_temperature(load_run_columns(run), run.start_temp)
+    if len(temperatures) < 2:
+        raise ValueError("A blank run needs data points at two or more temperatures above its start temperature.")
+    grid = make_grid(temperatures[0], temperatures[-1], BLANK_STEP, MAX_POINTS)
+
+    blank, _ = BlankBaseline.objects.update_or_create(run=run, defaults={
+        'calorimeter_id': run.calorimeter_id,
+        'ramp_rate': run.ramp_rate,
+        'temp_min': float(grid[0]),
+        'temp_max': float(grid[-1]),
+        'point_count': len(grid),
+        'heat_diff': numpy.interp(grid, temperatures, heat_flows).astype('<f8').tobytes(),
+    })
+    return blank
+
+
+def find_blank(run):
+    """
+    The blank run to subtract from a run: of the same calorimeter, with the nearest ramp rate
+    within :const:`RAMP_RATE_TOLERANCE`, and the most recently computed of those.
+
+    :param run: a :class:`controls.models.Run`
+    :return: a :class:`controls.models.BlankBaseline`, or None if no blank run matches
+    """
+    tolerance = abs(run.ramp_rate) * RAMP_RATE_TOLERANCE
+    return BlankBaseline.objects \
+        .filter(calorimeter_id=run.calorimeter_id, ramp_rate__range=(run.ramp_rate - tolerance,
+                                                                      run.ramp_rate + tolerance)) \
+        .exclude(run_id=run.pk) \
+        .annotate(distance=Func(F('ramp_rate') - run.ramp_rate, function='ABS')) \
+        .order_by('distance', '-computed_at').first()
+
+
+def blank_grid(blank):
+    """The temperatures at which the heat flow of a blank run is stored."""
+    return numpy.linspace(blank.temp_min, blank.temp_max, blank.point_count)
+
+
+def blank_heat_flow(blank, temperature):
+    """
+    The heat flow of a blank run at the given sample temperatures.
+    Beyond the temperatures the blank run reached, its heat flow at the nearest end is used.
+
+    :param blank: a :class:`controls.models.BlankBaseline`
+    :param temperature: array of sample temperatures
+    :return: float64 array of heat flows
+    """
+    curve = numpy.frombuffer(bytes(blank.heat_diff), dtype='<f8')
+    return numpy.interp(temperature, blank_grid(blank), curve)
+
+
+def describe_blank(blank, curve=False):
+    """
+    :param blank: a :class:`controls.models.BlankBaseline`
+    :param curve: whether to include the stored heat flow, as lists `temperature` and `heat_diff`
+    :return: JSON-ifiable dict
+    """
+    description = {
+        'run': blank.run_id,
+        'ramp_rate': blank.ramp_rate,
+        'temp_min': blank.temp_min,
+        'temp_max': blank.temp_max,
+        'point_count': blank.point_count,
+        'computed_at': blank.computed_at.isoformat(),
+    }
+    if curve:
+        description['temperature'] = blank_grid(blank).tolist()
+        description['heat_diff'] = numpy.frombuffer(bytes(blank.heat_diff), dtype='<f8').tolist()
+    return description
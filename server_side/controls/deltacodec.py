@@ -0,0 +1,184 @@
+""" Fixed-point delta encoding of measurement series.
+
+Sensors only resolve temperatures to 1/16 °C and currents to one ADC step,
+and consecutive measurements half a second apart rarely differ by more than a few such steps.
+Each series is therefore stored as integer multiples of a quantum (its sensor resolution),
+as differences between consecutive values, zigzag-mapped to unsigned integers and written as
+base-128 varints, so a typical measurement takes one or two bytes instead of eight.
+
+Layout of an encoded block, with numbers little-endian:
+
+#. The 4 bytes of :const:`MAGIC`.
+#. The length of the header, as an unsigned 32-bit integer.
+#. The header: UTF-8 JSON with `count`, the number of values per series,
+   and `columns`, a list of ``[name, quantum]`` pairs.
+#. The varints of all deltas, series after series in the order of `columns`.
+   The first delta of each series is from zero.
+
+The device encodes uploads with its own ``deltacodec.py``, which writes the same layout.
+Decoding is vectorised with NumPy when it is installed, decoding millions of values per second.
+"""
+
+import json
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'DLT1'
+
+TEMP_QUANTUM = 1 / 16
+"""Resolution of the DS18B20 temperature sensors, in degrees Celsius."""
+
+HEAT_QUANTUM = 3.3 * 1000 / 185000
+"""Heat flow, in mW, of one step of the current sensing ADC at full duty cycle and the device's 3.3 V supply.
+Heat flows are measured no finer than this."""
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def encode(columns, count=None):
+    """
+    Encodes measurement series.
+
+    :param columns: list of ``(name, quantum, values)`` tuples, where values is a sequence of numbers.
+        A quantum of 1 keeps integer values exact.
+    :param count: number of values in every series, by default the length of the first
+    :return: bytes of the encoded block
+    """
+    if count is None:
+        count = len(columns[0][2]) if columns else 0
+    header = json.dumps({'count': count, 'columns': [[name, quantum] for name, quantum, _ in columns]})
+    header = header.encode('utf-8')
+    body = bytearray(MAGIC + struct.pack('<I', len(header)) + header)
+
+    for name, quantum, values in columns:
+        if len(values) != count:
+            raise ValueError("Series {0} has {1} values instead of {2}.".format(name, len(values), count))
+        if numpy is not None:
+            body += _encode_deltas_vectorized(values, quantum)
+            continue
+
+        previous = 0
+        for value in values:
+            current = int(round(value / quantum))
+            delta = _zigzag(current - previous)
+            previous = current
+            while delta > 0x7f:
+                body.append((delta & 0x7f) | 0x80)
+                delta >>= 7
+            body.append(delta)
+    return bytes(body)
+
+
+def _encode_deltas_vectorized(values, quantum):
+    """Varint bytes of the zigzag deltas of one series, computed with NumPy."""
+    quantized = numpy.rint(numpy.asarray(values, dtype=numpy.float64) / quantum).astype(numpy.int64)
+    deltas = numpy.diff(quantized, prepend=0)
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).astype(numpy.uint64)
+
+    # number of 7-bit groups needed by each value
+    lengths = numpy.ones(len(zigzag), dtype=numpy.int64)
+    remainder = zigzag >> numpy.uint64(7)
+    while remainder.any():
+        lengths += remainder > 0
+        remainder >>= numpy.uint64(7)
+
+    out = numpy.empty(int(lengths.sum()), dtype=numpy.uint8)
+    starts = numpy.cumsum(lengths) - lengths
+    for group in range(int(lengths.max()) if len(lengths) else 0):
+        present = lengths > group
+        byte = (zigzag[present] >> numpy.uint64(7 * group)) & numpy.uint64(0x7f)
+        more = (lengths[present] > group + 1).astype(numpy.uint64) << numpy.uint64(7)
+        out[starts[present] + group] = (byte | more).astype(numpy.uint8)
+    return out.tobytes()
+
+
+def read_header(data):
+    """
+    Reads the header of an encoded block.
+
+    :return: tuple of the header dict and the offset of the first varint
+    :exception ValueError: if the data is not an encoded block
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a delta encoded block.")
+    try:
+        header_length, = struct.unpack_from('<I', data, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(data[start:start + header_length]).decode('utf-8'))
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError("Malformed delta encoded block: {0!r}".format(e))
+    if not isinstance(header, dict) or 'count' not in header or 'columns' not in header:
+        raise ValueError("Malformed delta encoded block header.")
+    return header, start + header_length
+
+
+def decode(data):
+    """
+    Decodes an encoded block.
+
+    :param data: bytes of the block
+    :return: dict of series name to values: NumPy arrays if NumPy is installed, lists otherwise.
+        Series with a quantum of 1 hold integers.
+    :exception ValueError: if the data is not a valid encoded block
+    """
+    header, position = read_header(data)
+    count, columns = header['count'], header['columns']
+    if numpy is not None:
+        return _decode_vectorized(data, position, count, columns)
+
+    values, value = [], 0
+    shift = 0
+    for byte in data[position:]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(_unzigzag(value))
+            value, shift = 0, 0
+    if shift or len(values) != count * len(columns):
+        raise ValueError("Delta encoded block holds {0} values instead of {1}.".format(
+            len(values), count * len(columns)))
+
+    series = {}
+    for index, (name, quantum) in enumerate(columns):
+        total, decoded = 0, []
+        for delta in values[index * count:(index + 1) * count]:
+            total += delta
+            decoded.append(total * quantum)
+        series[name] = decoded
+    return series
+
+
+def _decode_vectorized(data, position, count, columns):
+    """:func:`decode` of the varints from a position on, computed with NumPy."""
+    encoded = numpy.frombuffer(data, dtype=numpy.uint8, offset=position)
+    ends = numpy.flatnonzero(encoded < 0x80)
+    truncated = len(encoded) > 0 and (len(ends) == 0 or ends[-1] != len(encoded) - 1)
+    if truncated or len(ends) != count * len(columns):
+        raise ValueError("Delta encoded block holds {0} values instead of {1}.".format(
+            len(ends), count * len(columns)))
+    if not len(ends):
+        return {name: numpy.empty(0) for name, _ in columns}
+
+    # shift each byte's 7 bits into place within its varint, then sum the bytes of each varint
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    shifts = (numpy.arange(len(encoded)) - numpy.repeat(starts, ends - starts + 1)) * 7
+    groups = (encoded & 0x7f).astype(numpy.uint64) << shifts.astype(numpy.uint64)
+    zigzag = numpy.add.reduceat(groups, starts)
+    deltas = (zigzag >> numpy.uint64(1)).astype(numpy.int64) ^ -(zigzag & numpy.uint64(1)).astype(numpy.int64)
+
+    quantized = numpy.cumsum(deltas.reshape(len(columns), count), axis=1)
+    series = {}
+    for index, (name, quantum) in enumerate(columns):
+        series[name] = quantized[index] if quantum == 1 else quantized[index] * quantum
+    return series
@@ -0,0 +1,293 @@
+""" File exports of the data points of a run.
+
+CSV exports are streamed to the client as they are generated,
+reading data points from the database in fixed-size chunks so that memory use does not grow with run length.
+
+Columnar binary exports (NumPy ``.npz``, Parquet and HDF5) hold each measurement as a typed array
+with the run and calorimeter settings embedded, so that analysis code can load them without parsing text.
+Their libraries are optional; a format is only offered if its library can be imported.
+
+If the calorimeter has a blank run at the run's ramp rate (see :mod:`controls.baselines`),
+exports also hold the differential heat flow less that of the blank run.
+"""
+
+import csv
+import functools
+import io
+import json
+from datetime import timedelta
+
+from django.db.models import Q
+
+from server_side.controls.archive import archived_data_points, get_archive, load_archived_columns
+from server_side.controls.models import DataPoint
+from server_side.controls.rollups import EPOCH
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+EXPORT_CHUNK_SIZE = 2000
+"""Number of data points read from the database per query while exporting."""
+
+CSV_HEADER = ['Time', 'Temperature (sample)', 'Temperature (reference)',
+              'Heat Output (sample)', 'Heat Output (reference)',
+              'Heat Output (sample - reference)', 'Temperature (average)']
+CSV_FIELDS = ('elapsed_s', 'temp_sample', 'temp_ref', 'heat_sample', 'heat_ref', 'heat_diff', 'temp_average')
+"""Data point fields written to each CSV line, in the order of :const:`CSV_HEADER`."""
+
+CSV_BLANK_HEADER = 'Heat Output (sample - reference - blank)'
+"""Header of the last CSV column, written if a blank run is subtracted."""
+
+
+class Echo(object):
+    """A pseudo-buffer for :class:`csv.writer` that returns written lines instead of storing them."""
+
+    def write(self, value):
+        return value
+
+
+def iter_data_point_chunks(run, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Reads the data points of a run in order of measurement time, as chunks of value tuples.
+
+    Each chunk is fetched with its own query that continues from the last row of the previous chunk
+    (keyset pagination over the run and measurement time index),
+    so neither Django nor the database driver ever holds more than one chunk in memory.
+
+    :param run: the :class:`controls.models.Run` to read
+    :param fields: names of the data point fields in each tuple
+    :param chunk_size: maximum number of tuples per chunk
+    :return: generator of lists of tuples
+    """
+    archive = get_archive(run)
+    if archive is not None:
+        data_points = archived_data_points(archive)
+        for start in range(0, len(data_points), chunk_size):
+            yield [tuple(getattr(data_point, field) for field in fields)
+                   for data_point in data_points[start:start + chunk_size]]
+        return
+
+    queryset = DataPoint.objects.filter(run=run).order_by('measured_at', 'id')
+    fields = tuple(fields) + ('measured_at', 'id')
+    keyset = Q()
+
+    while True:
+        chunk = list(queryset.filter(keyset).values_list(*fields)[:chunk_size])
+        if not chunk:
+            return
+        yield [row[:-2] for row in chunk]
+
+        last_measured_at, last_id = chunk[-1][-2:]
+        keyset = Q(measured_at__gt=last_measured_at) | Q(measured_at=last_measured_at, id__gt=last_id)
+
+
+def blank_correction(run):
+    """
+    The blank run to subtract from the heat flow of a run in exports, see :func:`controls.baselines.find_blank`.
+
+    :param run: the :class:`controls.models.Run` to export
+    :return: tuple of the :class:`controls.models.BlankBaseline` and a function giving its heat flow
+        at an array of sample temperatures, or (None, None) if no blank run applies or NumPy is not installed
+    """
+    if numpy is None:
+        return None, None
+    # imported here, as blank runs are built from the columns read by this module
+    from server_side.controls.baselines import blank_heat_flow, find_blank
+
+    blank = find_blank(run)
+    if blank is None:
+        return None, None
+    return blank, functools.partial(blank_heat_flow, blank)
+
+
+def stream_csv(run):
+    """
+    Generates a CSV file of a run's data points, line by line.
+    Time is given in seconds since the run's time origin, its first measurement received.
+    All columns are stored with each data point, so lines are written as they are read,
+    with the heat flow less that of the blank run, if one applies, computed for each chunk at once.
+
+    :param run: the :class:`controls.models.Run` to export
+    :return: generator of CSV formatted strings
+    """
+    blank, blank_heat_flow = blank_correction(run)
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER + ([CSV_BLANK_HEADER] if blank is not None else []))
+    for chunk in iter_data_point_chunks(run, CSV_FIELDS):
+        if blank is None:
+            yield ''.join(writer.writerow(values) for values in chunk)
+            continue
+        blank_heat_flows = blank_heat_flow([values[1] for values in chunk]).tolist()
+        yield ''.join(writer.writerow(values + (values[3] - values[4] - subtracted, ))
+                      for values, subtracted in zip(chunk, blank_heat_flows))
+
+
+MICROSECOND = timedelta(microseconds=1)
+
+COLUMN_FIELDS = ('temp_sample', 'temp_ref', 'heat_sample', 'heat_ref')
+"""Float measurements exported as columns, in addition to measurement times."""
+
+DERIVED_COLUMN_FIELDS = ('heat_diff', 'temp_average')
+"""Columns computed from the measurement columns."""
+
+
+def load_run_columns(run):
+    """
+    Reads all data points of a run into typed NumPy arrays, in order of measurement time.
+
+    :param run: the :class:`controls.models.Run` to read
+    :return: dict of column name to array. ``measured_at`` holds int64 microseconds since the POSIX epoch,
+        ``time`` float64 seconds since the first measurement, and the measurement fields,
+        ``heat_diff`` and ``temp_average`` are float64.
+    """
+    archive = get_archive(run)
+    if archive is not None:
+        archived = load_archived_columns(archive)
+        measured_at = numpy.asarray(archived['measured_at'], dtype=numpy.int64) * 1000
+        values = numpy.column_stack([archived[field] for field in COLUMN_FIELDS]).astype(numpy.float64)
+        return columns_from_arrays(measured_at, values)
+
+    # the arrays hold every data point anyway, so one streamed query is cheaper than keyset pagination
+    rows = DataPoint.objects.filter(run=run).order_by('measured_at', 'id') \
+        .values_list('measured_at', *COLUMN_FIELDS).iterator()
+    times, values = [], []
+    for measured_at, *measurements in rows:
+        times.append((measured_at - EPOCH) // MICROSECOND)
+        values.append(measurements)
+
+    measured_at = numpy.array(times, dtype=numpy.int64)
+    values = numpy.array(values, dtype=numpy.float64).reshape(len(times), len(COLUMN_FIELDS))
+    return columns_from_arrays(measured_at, values)
+
+
+def columns_from_arrays(measured_at, values):
+    """
+    Columns as returned by :func:`load_run_columns`.
+
+    :param measured_at: int64 array of measurement times, in microseconds since the POSIX epoch
+    :param values: float64 array with a column for each of :const:`COLUMN_FIELDS`
+    """
+    time_origin = measured_at[0] if len(measured_at) else 0
+    columns = {
+        'measured_at': measured_at,
+        'time': (measured_at - time_origin) / 1e6,
+    }
+    for index, field in enumerate(COLUMN_FIELDS):
+        columns[field] = numpy.ascontiguousarray(values[:, index])
+    # same as the derived fields of data points, see :meth:`controls.models.DataPoint.derive`
+    columns['heat_diff'] = columns['heat_sample'] - columns['heat_ref']
+    columns['temp_average'] = (columns['temp_sample'] + columns['temp_ref']) / 2
+    return columns
+
+
+def load_export_columns(run):
+    """
+    Reads the columns of a run like :func:`load_run_columns`,
+    adding ``heat_diff_corrected``, the heat flow less that of the blank run, if one applies.
+
+    :param run: the :class:`controls.models.Run` to export
+    :return: tuple of the dict of columns and the :class:`controls.models.BlankBaseline` subtracted, or None
+    """
+    columns = load_run_columns(run)
+    blank, blank_heat_flow = blank_correction(run)
+    if blank is not None:
+        columns['heat_diff_corrected'] = columns['heat_diff'] - blank_heat_flow(columns['temp_sample'])
+    return columns, blank
+
+
+def run_metadata(run, blank=None):
+    """
+    Describes the run and the calibration of its calorimeter at the time of export.
+
+    :param run: the :class:`controls.models.Run` to describe
+    :param blank: the :class:`controls.models.BlankBaseline` subtracted from the run's heat flow, if any
+    :return: JSON-ifiable dict
+    """
+    calorimeter = run.calorimeter
+    return {
+        'run_id': run.id,
+        'run_name': run.name,
+        'start_temp': run.start_temp,
+        'target_temp': run.target_temp,
+        'ramp_rate': run.ramp_rate,
+        'start_time': run.start_time.isoformat() if run.start_time else None,
+        'finish_time': run.finish_time.isoformat() if run.finish_time else None,
+        'calorimeter_serial': calorimeter.serial,
+        'K_p': calorimeter.K_p,
+        'K_i': calorimeter.K_i,
+        'K_d': calorimeter.K_d,
+        'max_ramp_rate': calorimeter.max_ramp_rate,
+        'active_loop_interval': calorimeter.active_loop_interval,
+        'blank_run_id': blank.run_id if blank is not None else None,
+    }
+
+
+def export_npz(run):
+    """
+    Exports a run as an uncompressed NumPy ``.npz`` archive, loadable with :func:`numpy.load`.
+    Metadata is stored as a JSON string in the ``metadata`` array.
+    """
+    buffer = io.BytesIO()
+    columns, blank = load_export_columns(run)
+    numpy.savez(buffer, metadata=numpy.array(json.dumps(run_metadata(run, blank))), **columns)
+    return buffer.getvalue()
+
+
+def export_parquet(run):
+    """
+    Exports a run as a Parquet file, loadable with :func:`pandas.read_parquet`.
+    Measurement times are stored as UTC timestamps and metadata is stored as JSON in the schema metadata.
+    """
+    columns, blank = load_export_columns(run)
+    arrays = [pyarrow.array(columns['measured_at'], type=pyarrow.timestamp('us', tz='UTC'))]
+    names = ('time', ) + COLUMN_FIELDS + DERIVED_COLUMN_FIELDS
+    if blank is not None:
+        names += ('heat_diff_corrected', )
+    arrays += [pyarrow.array(columns[name]) for name in names]
+    table = pyarrow.Table.from_arrays(arrays, names=['measured_at'] + list(names))
+    table = table.replace_schema_metadata({'robotchem': json.dumps(run_metadata(run, blank))})
+
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(table, buffer)
+    return buffer.getvalue()
+
+
+def export_hdf5(run):
+    """
+    Exports a run as an HDF5 file with one dataset per column and metadata stored as root attributes.
+    """
+    buffer = io.BytesIO()
+    columns, blank = load_export_columns(run)
+    with h5py.File(buffer, 'w') as f:
+        for name, column in columns.items():
+            f.create_dataset(name, data=column)
+        for key, value in run_metadata(run, blank).items():
+            if value is not None:
+                f.attrs[key] = value
+    return buffer.getvalue()
+
+
+BINARY_EXPORT_FORMATS = {
+    'npz': (export_npz, 'application/octet-stream', (numpy, )),
+    'parquet': (export_parquet, 'application/vnd.apache.parquet', (numpy, pyarrow)),
+    'hdf5': (export_hdf5, 'application/x-hdf5', (numpy, h5py)),
+}
+"""Columnar export formats, as a dict of format name to the export function, MIME type and required libraries."""
+
+
+def is_format_available(file_format):
+    """Whether the libraries needed to export in a binary format are installed."""
+    return all(library is not None for library in BINARY_EXPORT_FORMATS[file_format][2])
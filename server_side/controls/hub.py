@@ -0,0 +1,157 @@
+""" Fan-out hub for live data.
+
+Batches of data points uploaded by the device are published once to the hub,
+which pushes them to every browser subscribed to the run (see :class:`controls.views.DataStreamAPI`),
+so the number of viewers no longer multiplies database queries.
+
+The broker is chosen by the ``DATA_HUB_BROKER`` setting.
+:class:`InProcessBroker` only reaches subscribers within the same server process,
+which suffices for a single (threaded or gevent) worker;
+:class:`RedisBroker` relays messages through a Redis server shared by all workers.
+"""
+
+import json
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class InProcessBroker(object):
+    """A publish-subscribe broker that delivers messages to subscribers in the current process."""
+
+    max_backlog = 100
+    """Maximum number of undelivered messages per subscriber. The oldest messages are dropped beyond this."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        """
+        Sends a message to all current subscribers of a channel.
+
+        :param channel: channel name
+        :param message: a string
+        """
+        with self._lock:
+            subscribers = list(self._subscribers[channel])
+
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    pass
+                # a slow subscriber loses its oldest message rather than holding up the publisher;
+                # another publisher may fill the freed slot first, in which case the oldest is dropped again
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def subscribe(self, channel):
+        """
+        Starts receiving messages published to a channel from now on.
+
+        :param channel: channel name
+        :return: a :class:`Subscription` object, which must be closed when no longer used.
+        """
+        subscriber = queue.Queue(maxsize=self.max_backlog)
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+
+        def close():
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+        return Subscription(subscriber.get, close)
+
+
+class RedisBroker(object):
+    """A publish-subscribe broker backed by Redis, reaching subscribers in all server processes.
+    The Redis server address is given by the ``DATA_HUB_REDIS_URL`` setting."""
+
+    def __init__(self):
+        if redis is None:
+            raise ImportError("The redis package is required to use RedisBroker.")
+        self._client = redis.StrictRedis.from_url(getattr(settings, 'DATA_HUB_REDIS_URL', 'redis://localhost:6379/0'))
+
+    def publish(self, channel, message):
+        self._client.publish(channel, message)
+
+    def subscribe(self, channel):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+
+        def get(timeout):
+            message = pubsub.get_message(timeout=timeout)
+            if message is None:
+                raise queue.Empty
+            return message['data'].decode('utf-8')
+
+        return Subscription(get, pubsub.close)
+
+
+class Subscription(object):
+    """A subscriber's handle on a channel."""
+
+    def __init__(self, get, close):
+        self._get = get
+        self.close = close
+
+    def get(self, timeout=None):
+        """
+        Waits for the next message.
+
+        :param timeout: maximum time to wait, in seconds
+        :return: the message string
+        :exception queue.Empty: if no message is published within the timeout.
+        """
+        return self._get(timeout=timeout)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Instantiates, once per process, the broker class named by the ``DATA_HUB_BROKER`` setting."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            broker_class = getattr(settings, 'DATA_HUB_BROKER', 'server_side.controls.hub.InProcessBroker')
+            _broker = import_string(broker_class)()
+    return _broker
+
+
+def reaches_other_processes():
+    """Whether events published by this process reach subscribers in other server processes."""
+    return not isinstance(get_broker(), InProcessBroker)
+
+
+def run_channel(run_id):
+    """Name of the channel carrying live events of a run."""
+    return 'run:{0}'.format(run_id)
+
+
+def publish_run_event(run_id, event, data):
+    """
+    Publishes an event to all browsers subscribed to a run.
+
+    :param run_id: ID of the run
+    :param event: event name, e.g. ``data`` for a batch of data points or ``finished`` when the run ends
+    :param data: JSON-ifiable event payload
+    """
+    message = json.dumps({'event': event, 'data': data})
+    get_broker().publish(run_channel(run_id), message)
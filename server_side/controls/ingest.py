@@ -0,0 +1,247 @@
+""" Recording of data point batches uploaded by devices.
+
+A batch is written to the database by :func:`ingest_batch`,
+either straight away within the upload request, or later by the ``drain_ingest_queue`` management command
+when the ``INGEST_MODE`` setting is ``'queued'``.
+In queued mode :class:`controls.views.DataPointListAPI` only validates a batch and appends it to
+a spool directory on disk (the ``INGEST_QUEUE_DIR`` setting) before answering the device,
+so that the device's upload time does not depend on how long the database takes to write.
+"""
+
+import json
+import os
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from server_side.controls.hub import publish_run_event
+from server_side.controls.models import Calorimeter, Run, DataPoint, UploadBatch
+from server_side.controls.notifications import queue_run_completion
+from server_side.controls.rollups import update_rollups
+from server_side.controls.serializers import RunSerializer
+from server_side.controls.summaries import update_summary
+
+INGEST_SYNC = 'sync'
+INGEST_QUEUED = 'queued'
+
+BATCH_FIELDS = ('measured_at', 'temp_ref', 'temp_sample', 'heat_ref', 'heat_sample',
+                'heat_diff', 'temp_average', 'elapsed_s', )
+"""Fields of each data point kept in a queued batch."""
+
+FAILED_DIR_NAME = 'failed'
+"""Subdirectory of the queue to which batches that could not be recorded are moved, for inspection."""
+
+
+def get_ingest_mode():
+    """Either :data:`INGEST_SYNC` or :data:`INGEST_QUEUED`, as set by the ``INGEST_MODE`` setting."""
+    return getattr(settings, 'INGEST_MODE', INGEST_SYNC)
+
+
+def get_queue_dir():
+    """Directory holding queued batches, as set by the ``INGEST_QUEUE_DIR`` setting."""
+    return getattr(settings, 'INGEST_QUEUE_DIR', os.path.join(settings.BASE_DIR, 'ingest_queue'))
+
+
+def get_time_origin(run_id, data_points):
+    """
+    Reads the time origin of a run, setting it to the earliest measurement time in a batch if the run has none.
+    Of batches arriving concurrently at a new run, the first to be recorded sets the origin for all.
+
+    :param run_id: ID of the run
+    :param data_points: non-empty list of :class:`controls.models.DataPoint` objects of the run
+    :return: the run's time origin
+    """
+    earliest = min(data_point.measured_at for data_point in data_points)
+    Run.objects.filter(id=run_id, time_origin__isnull=True).update(time_origin=earliest)
+    return Run.objects.filter(id=run_id).values_list('time_origin', flat=True).get()
+
+
+def ingest_batch(run_id, data_points, stabilized, is_finished, stop_flag=False, received_at=None, sequence=None,
+                 time_origin=None):
+    """
+    Saves a batch of data points and applies the run state changes reported alongside it.
+    A numbered batch is only recorded once, however many times it is uploaded,
+    but the calorimeter's stop flag is cleared by any batch it was sent in response to.
+
+    :param run_id: ID of the run the data points belong to
+    :param data_points: list of unsaved :class:`controls.models.DataPoint` objects
+    :param stabilized: whether the device has stabilized at the start temperature
+    :param is_finished: whether the device has finished the run
+    :param stop_flag: whether the device was told to stop in response to this batch,
+        which finishes the run and clears the calorimeter's stop flag
+    :param received_at: time at which the batch reached the server, defaults to now
+    :param sequence: sequence number of the batch within the run, as given by the device
+    :param time_origin: time origin of the run that the derived fields of the data points were computed from,
+        or None if the run had none, to set it from this batch and compute the derived fields again
+    :return: the updated :class:`controls.models.Run`, or None if a batch with this sequence number was recorded before
+    """
+    received_at = received_at or timezone.now()
+    with transaction.atomic():
+        if stop_flag:
+            Calorimeter.objects.filter(run__id=run_id, stop_flag=True) \
+                .update(stop_flag=False, last_changed_time=received_at)
+
+        if sequence is not None:
+            try:
+                with transaction.atomic():
+                    UploadBatch.objects.create(run_id=run_id, sequence=sequence, received_at=received_at,
+                                               data_point_count=len(data_points))
+            except IntegrityError:
+                return None
+
+        if data_points and time_origin is None:
+            time_origin = get_time_origin(run_id, data_points)
+            for data_point in data_points:
+                data_point.derive(time_origin)
+        DataPoint.objects.bulk_create(data_points)
+
+        # keep the denormalized data point count up to date, atomically in case batches arrive concurrently
+        Run.objects.filter(id=run_id).update(data_point_count=F('data_point_count') + len(data_points),
+                                             revision=F('revision') + 1)
+        run = Run.objects.get(id=run_id)
+        update_rollups(run, data_points)
+        update_summary(run, data_points)
+        was_finished = run.is_finished
+
+        # batches may arrive out of order, so an earlier batch must not undo stabilization
+        run.stabilized_at_start = run.stabilized_at_start or stabilized
+        if data_points and not run.is_running and not run.is_finished \
+                and data_points[-1].temp_sample >= run.start_temp:
+            run.is_running = True
+            run.start_time = received_at
+        completed = not run.is_finished and run.is_running and is_finished
+        if completed or (stop_flag and not run.is_finished):
+            run.is_running = False
+            run.is_finished = True
+            run.finish_time = received_at
+        run.save(update_fields=('stabilized_at_start', 'is_running', 'start_time', 'is_finished', 'finish_time'))
+        if completed and run.email:
+            queue_run_completion(run)
+
+        # Change this calorimeter's last communication time and temperatures
+        # so that we can determine whether it's actively connected to the server
+        # and display semi-real-time temp to user.
+        # Only the changed columns are written, leaving `last_changed_time` untouched.
+        if data_points:
+            Calorimeter.objects.filter(pk=run.calorimeter_id).update(
+                last_comm_time=received_at,
+                current_ref_temp=data_points[-1].temp_ref,
+                current_sample_temp=data_points[-1].temp_sample,
+            )
+
+    if run.is_finished and not was_finished:
+        publish_run_event(run.id, 'finished', RunSerializer(run).data)
+    return run
+
+
+def enqueue_batch(run_id, data_points, stabilized, is_finished, stop_flag, received_at, sequence=None,
+                  time_origin=None):
+    """
+    Appends a batch to the queue, for :func:`drain_queue` to pass to :func:`ingest_batch` later.
+    Takes the same arguments as :func:`ingest_batch`.
+
+    The batch is flushed to disk before this returns, so it survives a crash of the server.
+    Files are named after the time they are queued, so that batches are recorded in the order they arrived.
+    """
+    queue_dir = get_queue_dir()
+    os.makedirs(queue_dir, exist_ok=True)
+
+    batch = {
+        'run': run_id,
+        'sequence': sequence,
+        'stabilized_at_start': stabilized,
+        'is_finished': is_finished,
+        'stop_flag': stop_flag,
+        'received_at': received_at,
+        'time_origin': time_origin,
+        'data': [{field: getattr(data_point, field) for field in BATCH_FIELDS} for data_point in data_points],
+    }
+    name = '{0:020d}-{1}.json'.format(int(received_at.timestamp() * 1e6), uuid.uuid4().hex)
+    temp_path = os.path.join(queue_dir, '.' + name)
+    with open(temp_path, 'w') as f:
+        json.dump(batch, f, default=datetime.isoformat)
+        f.flush()
+        os.fsync(f.fileno())
+    # the batch only becomes visible to the queue once it is completely written
+    os.replace(temp_path, os.path.join(queue_dir, name))
+
+
+def load_batch(path):
+    """Reads a queued batch back into the keyword arguments of :func:`ingest_batch`."""
+    with open(path) as f:
+        batch = json.load(f)
+
+    received_at = parse_datetime(batch['received_at'])
+    time_origin = batch.get('time_origin')
+    data_points = []
+    for fields in batch['data']:
+        fields['measured_at'] = parse_datetime(fields['measured_at'])
+        data_points.append(DataPoint(run_id=batch['run'], received_at=received_at, **fields))
+    return {
+        'run_id': batch['run'],
+        'data_points': data_points,
+        'stabilized': batch['stabilized_at_start'],
+        'is_finished': batch['is_finished'],
+        'stop_flag': batch['stop_flag'],
+        'received_at': received_at,
+        'sequence': batch.get('sequence'),
+        'time_origin': parse_datetime(time_origin) if time_origin else None,
+    }
+
+
+def queued_batch_paths():
+    """Paths of the batches waiting in the queue, oldest first."""
+    queue_dir = get_queue_dir()
+    try:
+        names = os.listdir(queue_dir)
+    except FileNotFoundError:
+        return []
+    # batches still being written are hidden behind a leading dot
+    return [os.path.join(queue_dir, name) for name in sorted(names)
+            if name.endswith('.json') and not name.startswith('.')]
+
+
+def _quarantine(path):
+    """Moves a queued batch that cannot be recorded to the :data:`FAILED_DIR_NAME` subdirectory of the queue."""
+    failed_dir = os.path.join(os.path.dirname(path), FAILED_DIR_NAME)
+    os.makedirs(failed_dir, exist_ok=True)
+    os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+
+
+def drain_queue(limit=None):
+    """
+    Records queued batches in the order they arrived, removing each from the queue once it is in the database.
+    Repeated uploads of a numbered batch are discarded.
+    Batches that cannot be read back, or that the database refuses, such as those of a deleted run,
+    are moved to the :data:`FAILED_DIR_NAME` subdirectory of the queue.
+
+    Any other error, such as the database being unreachable, stops the draining and is raised,
+    leaving the batch in the queue to be recorded on the next attempt.
+
+    :param limit: maximum number of batches to record
+    :return: list of ``(path, exception)`` tuples, where exception is None for each batch recorded successfully
+    """
+    results = []
+    for path in queued_batch_paths()[:limit]:
+        try:
+            batch = load_batch(path)
+        except (ValueError, KeyError, TypeError) as e:
+            _quarantine(path)
+            results.append((path, e))
+            continue
+
+        try:
+            ingest_batch(**batch)
+        except (IntegrityError, ObjectDoesNotExist) as e:
+            _quarantine(path)
+            results.append((path, e))
+        else:
+            os.remove(path)
+            results.append((path, None))
+    return results
@@ -0,0 +1,66 @@
+""" Recomputes data derived from raw data points for runs recorded before it was maintained at ingest time.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+
+from server_side.controls.archive import get_archive
+from server_side.controls.models import DataPoint, Run
+from server_side.controls.rollups import rebuild_rollups
+from server_side.controls.summaries import rebuild_summary
+
+
+class Command(BaseCommand):
+    help = "Rebuilds rollups, summaries, data point counts and derived data point fields of all runs, " \
+           "or of the runs whose IDs are given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        runs = Run.objects.order_by('id')
+        if options['run_ids']:
+            runs = runs.filter(id__in=options['run_ids'])
+
+        for run in runs:
+            rebuild_rollups(run)
+            rebuild_summary(run)
+            archive = get_archive(run)
+            run.data_point_count = archive.data_point_count if archive else run.datapoint_set.count()
+            if archive is None:
+                self.derive_data_points(run)
+            run.save(update_fields=('data_point_count', 'time_origin'))
+            self.stdout.write("Rebuilt {0}".format(repr(run)))
+
+    @staticmethod
+    def derive_data_points(run, chunk_size=200):
+        """
+        Fills in the derived fields of a run's data points, and the run's time origin if it has none.
+
+        :param chunk_size: number of data points whose elapsed time is set by each UPDATE query
+        """
+        data_points = run.datapoint_set.all()
+        if run.time_origin is None:
+            run.time_origin = data_points.order_by('measured_at').values_list('measured_at', flat=True).first()
+
+        with transaction.atomic():
+            data_points.update(heat_diff=F('heat_sample') - F('heat_ref'),
+                               temp_average=(F('temp_sample') + F('temp_ref')) / 2)
+            # elapsed time is a difference of datetimes, which is computed here rather than by the database,
+            # and written to a chunk of data points at a time with a CASE expression
+            chunk = []
+            for pk, measured_at in list(data_points.values_list('id', 'measured_at')):
+                chunk.append((pk, (measured_at - run.time_origin).total_seconds()))
+                if len(chunk) >= chunk_size:
+                    Command.set_elapsed_times(chunk)
+                    chunk = []
+            Command.set_elapsed_times(chunk)
+
+    @staticmethod
+    def set_elapsed_times(elapsed_times):
+        """Sets the elapsed times of data points by a single query, from a list of ``(id, elapsed_s)`` tuples."""
+        if elapsed_times:
+            cases = [When(pk=pk, then=Value(elapsed_s)) for pk, elapsed_s in elapsed_times]
+            DataPoint.objects.filter(pk__in=[pk for pk, _ in elapsed_times]) \
+                .update(elapsed_s=Case(*cases, output_field=FloatField()))
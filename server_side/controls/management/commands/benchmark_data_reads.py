@@ -0,0 +1,45 @@
+""" Compares the throughput of the two response shapes of the data point list API on a recorded run.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from server_side.controls.models import Run
+from server_side.controls.serializers import DataPointSerializer, serialize_data_points_columnar
+
+
+class Command(BaseCommand):
+    help = "Measures rows per second of the default and columnar data point serialization for a run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_id', type=int)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Number of timed repetitions of each path; the fastest is reported.")
+
+    def handle(self, *args, **options):
+        try:
+            run = Run.objects.get(id=options['run_id'])
+        except Run.DoesNotExist:
+            raise CommandError("Run #{0} does not exist.".format(options['run_id']))
+
+        data_points = run.datapoint_set.all()
+        row_count = data_points.count()
+        if row_count == 0:
+            raise CommandError("{0} has no data points.".format(repr(run)))
+
+        paths = (
+            ('serializer', lambda: JSONRenderer().render(DataPointSerializer(data_points.all(), many=True).data)),
+            ('columnar', lambda: serialize_data_points_columnar(data_points.all())),
+        )
+        for name, serialize in paths:
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                content = serialize()
+                timings.append(time.perf_counter() - start)
+
+            best = min(timings)
+            self.stdout.write("{0:>10}: {1:>12,.0f} rows/s  ({2:.3f}s for {3} rows, {4} bytes)".format(
+                name, row_count / best, best, row_count, len(content)))
@@ -0,0 +1,36 @@
+""" Moves the data points of finished runs into compact archives.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from server_side.controls.archive import archive_run
+from server_side.controls.models import Run
+
+
+class Command(BaseCommand):
+    help = "Replaces the data point rows of finished runs with compact archives, " \
+           "rounding measurements to sensor resolution."
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int)
+        parser.add_argument('--min-age', type=float, default=24,
+                            help="Only compact runs that finished at least this many hours ago.")
+
+    def handle(self, *args, **options):
+        runs = Run.objects.filter(is_finished=True, archive__isnull=True).order_by('id')
+        if options['run_ids']:
+            runs = runs.filter(id__in=options['run_ids'])
+        else:
+            runs = runs.filter(finish_time__lte=timezone.now() - timedelta(hours=options['min_age']))
+
+        for run in runs:
+            try:
+                archive = archive_run(run)
+            except ValueError as e:
+                self.stderr.write(str(e))
+                continue
+            self.stdout.write("Compacted {0}: {1} data points into {2} bytes".format(
+                repr(run), archive.data_point_count, len(archive.data)))
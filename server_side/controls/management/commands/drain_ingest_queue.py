@@ -0,0 +1,47 @@
+""" Background writer recording the data point batches queued by the device upload API in queued ingest mode.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections
+
+from server_side.controls.hub import reaches_other_processes
+from server_side.controls.ingest import drain_queue, get_queue_dir
+
+
+class Command(BaseCommand):
+    help = "Writes queued data point batches to the database, oldest first. Only one instance should run at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of waiting for new batches.")
+        parser.add_argument('--interval', type=float, default=0.5,
+                            help="Seconds to wait before checking an empty queue again.")
+
+    def handle(self, *args, **options):
+        # runs finished and data recorded here are announced to browsers watching from the web server processes
+        if not reaches_other_processes():
+            raise CommandError("Live events published while draining would not reach browsers. "
+                               "Set DATA_HUB_BROKER to 'server_side.controls.hub.RedisBroker'.")
+        self.stdout.write("Draining {0}".format(get_queue_dir()))
+        while True:
+            try:
+                results = drain_queue()
+            except DatabaseError as e:
+                # the batch stays in the queue, to be recorded once the database is back
+                if options['once']:
+                    raise CommandError("Database error, queue left in place: {0!r}".format(e))
+                self.stderr.write("Database error, retrying: {0!r}".format(e))
+                close_old_connections()
+                time.sleep(options['interval'])
+                continue
+
+            for path, error in results:
+                if error is not None:
+                    self.stderr.write("Failed to record {0}: {1!r}".format(path, error))
+
+            if not results:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,40 @@
+""" Fits a thermal model of each cell of a calorimeter and its ramp calibration from its recorded runs.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from server_side.controls import sysid
+from server_side.controls.models import Calorimeter
+
+
+class Command(BaseCommand):
+    help = "Identifies a thermal model of each cell of a calorimeter from its recorded runs, " \
+           "fits the ramp calibration of the device with them, and saves both to the calorimeter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('serial', help="Serial number of the calorimeter.")
+        parser.add_argument('--runs', type=int, nargs='+',
+                            help="IDs of the runs to identify the cells from, "
+                                 "by default its {0} most recent finished runs.".format(sysid.RECENT_RUNS))
+
+    def handle(self, *args, **options):
+        if sysid.numpy is None:
+            raise CommandError("Identification needs NumPy.")
+        try:
+            calorimeter = Calorimeter.objects.get(serial=options['serial'])
+        except Calorimeter.DoesNotExist:
+            raise CommandError("No calorimeter has serial {0}.".format(options['serial']))
+
+        runs = sysid.recent_runs(calorimeter, options['runs'])
+        if not runs:
+            raise CommandError("{0} has no runs to identify its cells from.".format(repr(calorimeter)))
+        try:
+            plants = sysid.identify_calorimeter(calorimeter, runs)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for cell, plant in zip(('Reference', 'Sample'), plants):
+            self.stdout.write("{0} cell: {1!r}".format(cell, plant))
+        self.stdout.write("Cycle overhead: {0:.3g} s".format(calorimeter.cycle_overhead))
+        self.stdout.write("Ramp calibration: offset {0:.4g} C/min, gain {1:.4g} min/cycle".format(
+            calorimeter.ramp_offset, calorimeter.ramp_gain))
@@ -0,0 +1,30 @@
+""" Background sender delivering the emails recorded in the notification outbox.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from server_side.controls.notifications import send_pending_notifications
+
+
+class Command(BaseCommand):
+    help = "Sends pending notification emails, retrying failed ones later. Only one instance should run at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit after one pass over the due notifications instead of waiting for more.")
+        parser.add_argument('--interval', type=float, default=10,
+                            help="Seconds to wait between passes.")
+
+    def handle(self, *args, **options):
+        while True:
+            for notification, error in send_pending_notifications():
+                if error is None:
+                    self.stdout.write("Sent {0}".format(repr(notification)))
+                else:
+                    self.stderr.write("Failed to send {0}: {1!r}".format(repr(notification), error))
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
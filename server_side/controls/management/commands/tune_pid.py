@@ -0,0 +1,110 @@
+""" Searches for the PID gains and loop interval of a calorimeter by simulating runs with its recorded behaviour.
+"""
+
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+
+from server_side.controls import sysid, tuning
+from server_side.controls.models import Calorimeter
+
+
+class Command(BaseCommand):
+    help = "Simulates runs of a calorimeter with candidate PID gains and loop intervals, using the thermal models " \
+           "of its cells, and reports the best candidates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('serial', help="Serial number of the calorimeter.")
+        parser.add_argument('--identify', action='store_true',
+                            help="Identify the cells again from recorded runs, as identify_plants does, "
+                                 "even if they have been identified before.")
+        parser.add_argument('--runs', type=int, nargs='+',
+                            help="IDs of the runs to identify the cells from, "
+                                 "by default its {0} most recent finished runs.".format(sysid.RECENT_RUNS))
+        parser.add_argument('--search', choices=('grid', 'random'), default='grid',
+                            help="Evaluate a fixed grid of candidates, or random candidates.")
+        parser.add_argument('--samples', type=int, default=200, help="Number of random candidates.")
+        parser.add_argument('--seed', type=int, help="Seed for random candidates.")
+        parser.add_argument('--workers', type=int, help="Number of processes, by default one per processor.")
+        parser.add_argument('--start-temp', type=float, help="Start temperature of the simulated run, "
+                                                             "by default that of the most recent run.")
+        parser.add_argument('--target-temp', type=float, help="Target temperature of the simulated run.")
+        parser.add_argument('--ramp-rate', type=float, help="Ramp rate of the simulated run, in Celsius per minute.")
+        parser.add_argument('--top', type=int, default=10, help="Number of candidates to report.")
+        parser.add_argument('--apply', action='store_true',
+                            help="Save the best candidate's gains and loop interval to the calorimeter, "
+                                 "and fit its ramp calibration again with them.")
+
+    def handle(self, *args, **options):
+        if sysid.numpy is None:
+            raise CommandError("Tuning needs NumPy.")
+        try:
+            calorimeter = Calorimeter.objects.get(serial=options['serial'])
+        except Calorimeter.DoesNotExist:
+            raise CommandError("No calorimeter has serial {0}.".format(options['serial']))
+
+        runs = sysid.recent_runs(calorimeter, options['runs'])
+        if not runs:
+            raise CommandError("{0} has no runs to identify its cells from.".format(repr(calorimeter)))
+        plants = sysid.stored_plants(calorimeter)
+        if plants is None or options['identify'] or options['runs']:
+            try:
+                plants = sysid.identify_calorimeter(calorimeter, runs)
+            except ValueError as e:
+                raise CommandError(str(e))
+        for cell, plant in zip(('Reference', 'Sample'), plants):
+            self.stdout.write("{0} cell: {1!r}".format(cell, plant))
+
+        latest = runs[0]
+        scenario = tuning.Scenario(
+            start_temp=options['start_temp'] if options['start_temp'] is not None else latest.start_temp,
+            target_temp=options['target_temp'] if options['target_temp'] is not None else latest.target_temp,
+            ramp_rate=options['ramp_rate'] if options['ramp_rate'] is not None else latest.ramp_rate,
+            max_ramp_rate=calorimeter.max_ramp_rate,
+            temp_tolerance=calorimeter.temp_tolerance_range,
+            stabilization_duration=calorimeter.temp_tolerance_duration,
+            initial_temp=sum(plant.ambient_temp for plant in plants) / len(plants),
+            ramp_offset=calorimeter.ramp_offset,
+            ramp_gain=calorimeter.ramp_gain,
+            cycle_overhead=calorimeter.cycle_overhead,
+            feed_forward=calorimeter.feed_forward,
+        )
+
+        if options['search'] == 'grid':
+            candidates = tuning.grid_candidates()
+        else:
+            candidates = tuning.random_candidates(options['samples'], seed=options['seed'])
+        current = {field: getattr(calorimeter, field) for field in tuning.TUNED_FIELDS}
+        results = tuning.search(plants, scenario, [current] + candidates, workers=options['workers'])
+
+        self.stdout.write("{0:>8} {1:>8} {2:>8} {3:>9} {4:>10} {5:>10} {6:>10} {7:>10}".format(
+            'K_p', 'K_i', 'K_d', 'interval', 'settling', 'overshoot', 'ramp err', 'cost'))
+        for result in results[:options['top']]:
+            self.stdout.write(self.format_result(result))
+        current_result = next(result for result in results if all(result[field] == current[field]
+                                                                    for field in tuning.TUNED_FIELDS))
+        self.stdout.write("Current settings:\n" + self.format_result(current_result))
+
+        best = results[0]
+        if options['apply']:
+            if best['settling_time'] is None:
+                raise CommandError("No candidate stabilised at the start temperature; nothing was saved.")
+            for field in tuning.TUNED_FIELDS:
+                setattr(calorimeter, field, best[field])
+            try:
+                calorimeter.ramp_offset, calorimeter.ramp_gain = sysid.fit_ramp_calibration(plants, calorimeter)
+            except ValueError as e:
+                raise CommandError("{0} Nothing was saved.".format(e))
+            calorimeter.save()
+            self.stdout.write("Saved the best candidate to {0}, with ramp calibration offset {1:.4g} C/min "
+                              "and gain {2:.4g} min/cycle.".format(repr(calorimeter), calorimeter.ramp_offset,
+                                                                   calorimeter.ramp_gain))
+
+    @staticmethod
+    def format_result(result):
+        def number(value, unit=''):
+            return 'never' if value is None else '{0:.3g}{1}'.format(value, unit)
+        return "{0:>8.3g} {1:>8.3g} {2:>8.3g} {3:>9.3g} {4:>10} {5:>10} {6:>10} {7:>10}".format(
+            result['K_p'], result['K_i'], result['K_d'], result['active_loop_interval'],
+            number(result['settling_time'], 's'), number(result['overshoot'], 'C'),
+            number(result['ramp_error'], 'C'), number(None if math.isinf(result['cost']) else result['cost']))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0003_datapoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calorimeter',
+            name='K_d',
+            field=models.FloatField(blank=True, default=0.0003, verbose_name='PID Derivative Factor'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='K_i',
+            field=models.FloatField(blank=True, default=1.0, verbose_name='PID Integral Factor'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='K_p',
+            field=models.FloatField(blank=True, default=5.0, verbose_name='PID Proportionality Factor'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='active_loop_interval',
+            field=models.FloatField(default=5.0, verbose_name='Web API / PID Calculation Refresh Rate with job running'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='current_ref_temp',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='current_sample_temp',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='idle_loop_interval',
+            field=models.FloatField(blank=True, default=10.0, verbose_name='Web API Refresh Rate when no jobs are running'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='max_ramp_rate',
+            field=models.FloatField(blank=True, default=5.0, verbose_name='Max Ramp Rate'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='stop_flag',
+            field=models.BooleanField(default=False, verbose_name='Stop Flag'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='temp_tolerance_duration',
+            field=models.FloatField(blank=True, default=15.0, verbose_name='Stabilization duration'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='temp_tolerance_range',
+            field=models.FloatField(blank=True, default=1.0, verbose_name='Temperature tolerance'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='web_api_min_upload_length',
+            field=models.IntegerField(default=5, verbose_name='Minimum number of data points to collect before uploading'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254, null=True, verbose_name='Notification Email Address'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='finish_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Finish Time'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='is_ready',
+            field=models.BooleanField(default=False, verbose_name='Is Ready to Start?'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='stabilized_at_start',
+            field=models.BooleanField(default=False, verbose_name='Temp Has Stabilized at Start Temp'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='start_temp',
+            field=models.FloatField(default=20.0, verbose_name='Start Temperature (Celsius)'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='datapoint',
+            name='heat_ref',
+            field=models.FloatField(verbose_name='Reference Heat Flow Since Last (Joules)'),
+        ),
+        migrations.AlterField(
+            model_name='datapoint',
+            name='heat_sample',
+            field=models.FloatField(verbose_name='Sample Heat Flow Since Last (Joules)'),
+        ),
+        migrations.AlterField(
+            model_name='run',
+            name='ramp_rate',
+            field=models.FloatField(verbose_name='Rate of Temp Ramp (Celsius per minute)'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0004_calorimeter_settings_and_run_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataPointRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(verbose_name='Bucket Length (seconds)')),
+                ('bucket_start', models.DateTimeField(verbose_name='Bucket Start')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Number of Data Points')),
+                ('temp_ref_min', models.FloatField(verbose_name='Minimum Reference Temp (Celsius)')),
+                ('temp_ref_max', models.FloatField(verbose_name='Maximum Reference Temp (Celsius)')),
+                ('temp_ref_sum', models.FloatField(verbose_name='Sum of Reference Temps (Celsius)')),
+                ('temp_sample_min', models.FloatField(verbose_name='Minimum Sample Temp (Celsius)')),
+                ('temp_sample_max', models.FloatField(verbose_name='Maximum Sample Temp (Celsius)')),
+                ('temp_sample_sum', models.FloatField(verbose_name='Sum of Sample Temps (Celsius)')),
+                ('heat_ref_min', models.FloatField(verbose_name='Minimum Reference Heat Flow')),
+                ('heat_ref_max', models.FloatField(verbose_name='Maximum Reference Heat Flow')),
+                ('heat_ref_sum', models.FloatField(verbose_name='Sum of Reference Heat Flows')),
+                ('heat_sample_min', models.FloatField(verbose_name='Minimum Sample Heat Flow')),
+                ('heat_sample_max', models.FloatField(verbose_name='Maximum Sample Heat Flow')),
+                ('heat_sample_sum', models.FloatField(verbose_name='Sum of Sample Heat Flows')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='datapointrollup',
+            unique_together=set([('run', 'resolution', 'bucket_start')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:37
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0005_datapointrollup'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='datapoint',
+            index_together=set([('run', 'measured_at')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0006_datapoint_run_measured_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='revision',
+            field=models.PositiveIntegerField(blank=True, default=0, verbose_name='Revision'),
+        ),
+    ]
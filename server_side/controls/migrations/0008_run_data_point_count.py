@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0007_run_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='data_point_count',
+            field=models.PositiveIntegerField(blank=True, default=0, verbose_name='Number of Data Points'),
+        ),
+        migrations.AlterIndexTogether(
+            name='run',
+            index_together=set([('calorimeter', 'is_finished')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0008_run_data_point_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='calorimeter',
+            name='access_code',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='Access Code'),
+        ),
+    ]
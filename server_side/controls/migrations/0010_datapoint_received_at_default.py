@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0009_calorimeter_access_code_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='datapoint',
+            name='received_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, verbose_name='Received At'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0010_datapoint_received_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('run_completion', 'Run completion')], max_length=30, verbose_name='Kind')),
+                ('recipient', models.EmailField(max_length=254, verbose_name='Recipient')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Next Attempt At')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Failed Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last Error')),
+                ('sent_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Sent At')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+    ]
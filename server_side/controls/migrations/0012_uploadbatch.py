@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0011_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField(verbose_name='Sequence Number')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Received At')),
+                ('data_point_count', models.PositiveIntegerField(default=0, verbose_name='Number of Data Points')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='uploadbatch',
+            unique_together=set([('run', 'sequence')]),
+        ),
+    ]
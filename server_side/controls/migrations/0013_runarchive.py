@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0012_uploadbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField(verbose_name='Encoded Data Points')),
+                ('data_point_count', models.PositiveIntegerField(verbose_name='Number of Data Points')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+    ]
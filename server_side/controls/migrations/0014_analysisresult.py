@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0013_runarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parameters_hash', models.CharField(max_length=40, verbose_name='Parameters Hash')),
+                ('watermark', models.PositiveIntegerField(verbose_name='Number of Data Points Analysed')),
+                ('result', models.TextField(verbose_name='Result (JSON)')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='Computed At')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='analysisresult',
+            unique_together=set([('run', 'parameters_hash')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0014_analysisresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Number of Data Points')),
+                ('first_measured_at', models.DateTimeField(blank=True, null=True, verbose_name='First Measured At')),
+                ('last_measured_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Measured At')),
+                ('temp_ref_min', models.FloatField(blank=True, null=True, verbose_name='Minimum Reference Temp (Celsius)')),
+                ('temp_ref_max', models.FloatField(blank=True, null=True, verbose_name='Maximum Reference Temp (Celsius)')),
+                ('temp_ref_sum', models.FloatField(default=0, verbose_name='Sum of Reference Temps (Celsius)')),
+                ('temp_sample_min', models.FloatField(blank=True, null=True, verbose_name='Minimum Sample Temp (Celsius)')),
+                ('temp_sample_max', models.FloatField(blank=True, null=True, verbose_name='Maximum Sample Temp (Celsius)')),
+                ('temp_sample_sum', models.FloatField(default=0, verbose_name='Sum of Sample Temps (Celsius)')),
+                ('heat_ref_total', models.FloatField(default=0, verbose_name='Cumulative Reference Heat (mJ)')),
+                ('heat_sample_total', models.FloatField(default=0, verbose_name='Cumulative Sample Heat (mJ)')),
+                ('last_heat_ref', models.FloatField(blank=True, null=True, verbose_name='Last Reference Heat Flow')),
+                ('last_heat_sample', models.FloatField(blank=True, null=True, verbose_name='Last Sample Heat Flow')),
+                ('last_temp_sample', models.FloatField(blank=True, null=True, verbose_name='Last Sample Temp (Celsius)')),
+                ('ramp_started_at', models.DateTimeField(blank=True, null=True, verbose_name='Ramp Started At')),
+                ('ramp_start_temp', models.FloatField(blank=True, null=True, verbose_name='Sample Temp at Ramp Start (Celsius)')),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0015_runsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datapoint',
+            name='elapsed_s',
+            field=models.FloatField(blank=True, null=True, verbose_name='Seconds Since Run Time Origin'),
+        ),
+        migrations.AddField(
+            model_name='datapoint',
+            name='heat_diff',
+            field=models.FloatField(blank=True, null=True, verbose_name='Heat Flow Difference (Sample - Reference)'),
+        ),
+        migrations.AddField(
+            model_name='datapoint',
+            name='temp_average',
+            field=models.FloatField(blank=True, null=True, verbose_name='Average Temp (Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='time_origin',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Time Origin'),
+        ),
+        migrations.AlterIndexTogether(
+            name='datapoint',
+            index_together=set([('run', 'elapsed_s'), ('run', 'measured_at')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0016_datapoint_derived_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlankBaseline',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ramp_rate', models.FloatField(verbose_name='Rate of Temp Ramp (Celsius per minute)')),
+                ('temp_min', models.FloatField(verbose_name='Lowest Temp of the Grid (Celsius)')),
+                ('temp_max', models.FloatField(verbose_name='Highest Temp of the Grid (Celsius)')),
+                ('point_count', models.PositiveIntegerField(verbose_name='Number of Temps in the Grid')),
+                ('heat_diff', models.BinaryField(verbose_name='Heat Flow Difference at each Temp (float64)')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='Computed At')),
+                ('calorimeter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='controls.Calorimeter', verbose_name='Calorimeter')),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='blank_baseline', to='controls.Run', verbose_name='Run')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='blankbaseline',
+            index_together=set([('calorimeter', 'ramp_rate')]),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0017_blankbaseline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calorimeter',
+            name='cycle_overhead',
+            field=models.FloatField(blank=True, default=0.0, verbose_name='Time per Loop Cycle Spent Measuring (seconds)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='plant_fitted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Thermal Model Fitted At'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ramp_gain',
+            field=models.FloatField(blank=True, default=0.02, verbose_name='Ramp Calibration Gain (minutes per cycle)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ramp_offset',
+            field=models.FloatField(blank=True, default=0.434, verbose_name='Ramp Calibration Offset (Celsius per minute)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ref_ambient_temp',
+            field=models.FloatField(blank=True, null=True, verbose_name='Reference Cell Ambient Temp (Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ref_heat_capacity',
+            field=models.FloatField(blank=True, null=True, verbose_name='Reference Cell Heat Capacity (mJ per Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ref_heater_gain',
+            field=models.FloatField(blank=True, null=True, verbose_name='Reference Heater Gain (mW per % Duty Cycle)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ref_loss_coefficient',
+            field=models.FloatField(blank=True, null=True, verbose_name='Reference Cell Heat Loss (mW per Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='ref_sensor_lag',
+            field=models.FloatField(blank=True, null=True, verbose_name='Reference Sensor Lag (seconds)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='sample_ambient_temp',
+            field=models.FloatField(blank=True, null=True, verbose_name='Sample Cell Ambient Temp (Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='sample_heat_capacity',
+            field=models.FloatField(blank=True, null=True, verbose_name='Sample Cell Heat Capacity (mJ per Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='sample_heater_gain',
+            field=models.FloatField(blank=True, null=True, verbose_name='Sample Heater Gain (mW per % Duty Cycle)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='sample_loss_coefficient',
+            field=models.FloatField(blank=True, null=True, verbose_name='Sample Cell Heat Loss (mW per Celsius)'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='sample_sensor_lag',
+            field=models.FloatField(blank=True, null=True, verbose_name='Sample Sensor Lag (seconds)'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0018_calorimeter_thermal_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calorimeter',
+            name='autotune_requested',
+            field=models.BooleanField(default=False, verbose_name='Auto-tune Requested'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='autotune_result',
+            field=models.CharField(blank=True, default='', max_length=500, verbose_name='Outcome of Last Auto-tune'),
+        ),
+        migrations.AddField(
+            model_name='calorimeter',
+            name='autotune_temp',
+            field=models.FloatField(blank=True, default=50.0, verbose_name='Auto-tune Temperature'),
+        ),
+    ]
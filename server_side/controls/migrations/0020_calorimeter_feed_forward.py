@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 04:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0019_calorimeter_autotune'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calorimeter',
+            name='feed_forward',
+            field=models.BooleanField(default=False, verbose_name='Feed-forward From Thermal Model'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Case, F, FloatField, Min, Value, When
+
+CHUNK_SIZE = 200
+"""Number of data points whose elapsed time is set by each UPDATE query."""
+
+
+def fill_derived_fields(apps, schema_editor):
+    """
+    Fills in the derived fields of data points recorded before 0016, and the time origins of their runs,
+    as the ``backfill_runs`` command does, so that exports of existing runs have every column.
+    """
+    Run = apps.get_model('controls', 'Run')
+    DataPoint = apps.get_model('controls', 'DataPoint')
+
+    run_ids = DataPoint.objects.filter(elapsed_s__isnull=True).values_list('run_id', flat=True).distinct()
+    for run in Run.objects.filter(id__in=list(run_ids)):
+        data_points = DataPoint.objects.filter(run=run)
+        if run.time_origin is None:
+            run.time_origin = data_points.aggregate(first=Min('measured_at'))['first']
+            run.save(update_fields=('time_origin', ))
+
+        missing = data_points.filter(elapsed_s__isnull=True)
+        missing.update(heat_diff=F('heat_sample') - F('heat_ref'),
+                       temp_average=(F('temp_sample') + F('temp_ref')) / 2)
+        elapsed_times = [(pk, (measured_at - run.time_origin).total_seconds())
+                         for pk, measured_at in missing.values_list('id', 'measured_at')]
+        for start in range(0, len(elapsed_times), CHUNK_SIZE):
+            chunk = elapsed_times[start:start + CHUNK_SIZE]
+            DataPoint.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                elapsed_s=Case(*[When(pk=pk, then=Value(elapsed_s)) for pk, elapsed_s in chunk],
+                               output_field=FloatField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controls', '0020_calorimeter_feed_forward'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_derived_fields, migrations.RunPython.noop),
+    ]
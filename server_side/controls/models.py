@@ -4,6 +4,7 @@ Jin Cheng, 2/12/16
 
 """
 from django.db import models
+from django.utils import timezone
 
 
 class Calorimeter(models.Model):
@@ -13,7 +14,7 @@ class Calorimeter(models.Model):
     and whether user at browser can access / control the device.
     """
     serial = models.CharField('Raspberry Pi Serial', max_length=50, unique=True)
-    access_code = models.CharField('Access Code', max_length=100)
+    access_code = models.CharField('Access Code', max_length=100, db_index=True)
     name = models.CharField('Nickname', max_length=100, blank=True, null=True)
     creation_time = models.DateTimeField(auto_now_add=True, blank=True)
 
@@ -31,11 +32,33 @@ class Calorimeter(models.Model):
     web_api_min_upload_length = models.IntegerField("Minimum number of data points to collect before uploading",
                                                     default=5)
 
+    # lumped thermal model of each cell and the device's ramp calibration, fitted from recorded runs by controls.sysid
+    ref_heat_capacity = models.FloatField("Reference Cell Heat Capacity (mJ per Celsius)", blank=True, null=True)
+    ref_loss_coefficient = models.FloatField("Reference Cell Heat Loss (mW per Celsius)", blank=True, null=True)
+    ref_heater_gain = models.FloatField("Reference Heater Gain (mW per % Duty Cycle)", blank=True, null=True)
+    ref_ambient_temp = models.FloatField("Reference Cell Ambient Temp (Celsius)", blank=True, null=True)
+    ref_sensor_lag = models.FloatField("Reference Sensor Lag (seconds)", blank=True, null=True)
+    sample_heat_capacity = models.FloatField("Sample Cell Heat Capacity (mJ per Celsius)", blank=True, null=True)
+    sample_loss_coefficient = models.FloatField("Sample Cell Heat Loss (mW per Celsius)", blank=True, null=True)
+    sample_heater_gain = models.FloatField("Sample Heater Gain (mW per % Duty Cycle)", blank=True, null=True)
+    sample_ambient_temp = models.FloatField("Sample Cell Ambient Temp (Celsius)", blank=True, null=True)
+    sample_sensor_lag = models.FloatField("Sample Sensor Lag (seconds)", blank=True, null=True)
+    cycle_overhead = models.FloatField("Time per Loop Cycle Spent Measuring (seconds)", default=0., blank=True)
+    ramp_offset = models.FloatField("Ramp Calibration Offset (Celsius per minute)", default=0.434, blank=True)
+    ramp_gain = models.FloatField("Ramp Calibration Gain (minutes per cycle)", default=0.02, blank=True)
+    plant_fitted_at = models.DateTimeField("Thermal Model Fitted At", blank=True, null=True)
+    feed_forward = models.BooleanField("Feed-forward From Thermal Model", default=False, blank=True)
+
     last_changed_time = models.DateTimeField(auto_now=True, blank=True)
     last_comm_time = models.DateTimeField('Time of Last Communication From Device')
 
     stop_flag = models.BooleanField('Stop Flag', default=False, blank=True)
 
+    # relay auto-tuning of the PID parameters by the device, requested from the Calibrate page
+    autotune_requested = models.BooleanField('Auto-tune Requested', default=False, blank=True)
+    autotune_temp = models.FloatField('Auto-tune Temperature', default=50., blank=True)
+    autotune_result = models.CharField('Outcome of Last Auto-tune', max_length=500, default='', blank=True)
+
     def __repr__(self):
         if self.name:
             return "{0} ({1})".format(self.name, self.serial)
@@ -75,6 +98,21 @@ class Run(models.Model):
 
     email = models.EmailField('Notification Email Address', blank=True, null=True)
 
+    # maintained as data points are received, so that listing runs does not need to count them
+    data_point_count = models.PositiveIntegerField('Number of Data Points', default=0, blank=True)
+
+    # incremented with every change, including new data points, to tag cached responses
+    revision = models.PositiveIntegerField('Revision', default=0, blank=True)
+
+    # measurement time of the first data point received, from which the elapsed time of data points is counted
+    time_origin = models.DateTimeField('Time Origin', blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        self.revision += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = tuple(kwargs['update_fields']) + ('revision', )
+        super(Run, self).save(*args, **kwargs)
+
     def __repr__(self):
         if self.name:
             return self.name
@@ -86,6 +124,7 @@ class Run(models.Model):
 
     class Meta:
         app_label = "controls"
+        index_together = (('calorimeter', 'is_finished'), )
 
 
 class DataPoint(models.Model):
@@ -97,7 +136,7 @@ class DataPoint(models.Model):
 
     # time of measurement is saved independently to eliminate inconsistent network lags
     measured_at = models.DateTimeField("Measured At")
-    received_at = models.DateTimeField("Received At", auto_now_add=True, blank=True)
+    received_at = models.DateTimeField("Received At", default=timezone.now, blank=True)
 
     # measurements made on device
     temp_ref = models.FloatField("Reference Temp (Celsius)")
@@ -105,6 +144,21 @@ class DataPoint(models.Model):
     heat_ref = models.FloatField("Reference Heat Flow Since Last (Joules)")
     heat_sample = models.FloatField("Sample Heat Flow Since Last (Joules)")
 
+    # derived from the measurements once, when received, so that consumers read them as plain columns
+    heat_diff = models.FloatField("Heat Flow Difference (Sample - Reference)", blank=True, null=True)
+    temp_average = models.FloatField("Average Temp (Celsius)", blank=True, null=True)
+    elapsed_s = models.FloatField("Seconds Since Run Time Origin", blank=True, null=True)
+
+    def derive(self, time_origin):
+        """
+        Computes the derived fields from the measurements.
+
+        :param time_origin: the run's :attr:`Run.time_origin`, from which :attr:`elapsed_s` is counted
+        """
+        self.heat_diff = self.heat_sample - self.heat_ref
+        self.temp_average = (self.temp_sample + self.temp_ref) / 2
+        self.elapsed_s = (self.measured_at - time_origin).total_seconds()
+
     def __repr__(self):
         return "#{0} ({1})".format(self.pk, self.measured_at)
 
@@ -113,5 +167,236 @@ class DataPoint(models.Model):
 
     class Meta:
         app_label = "controls"
+        index_together = (('run', 'measured_at'), ('run', 'elapsed_s'), )
+
+
+class RunArchive(models.Model):
+    """
+    The data points of a finished run, stored as one compact block in the fixed-point delta encoding of
+    :mod:`controls.deltacodec` in place of a database row per data point.
+    Created by the ``compact_runs`` management command, which deletes the run's data points.
+    """
+    run = models.OneToOneField(Run, verbose_name="Run", related_name='archive')
+    data = models.BinaryField("Encoded Data Points")
+    data_point_count = models.PositiveIntegerField("Number of Data Points")
+    created_at = models.DateTimeField("Created At", auto_now_add=True, blank=True)
+
+    def __repr__(self):
+        return "Archive of run #{0} ({1} data points in {2} bytes)".format(
+            self.run_id, self.data_point_count, len(self.data))
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+
+
+class UploadBatch(models.Model):
+    """
+    Record of a batch of data points uploaded by the device, identified by a sequence number within its run.
+    The unique constraint lets repeated uploads of a batch, such as retries after a time out, be discarded.
+    """
+    run = models.ForeignKey(Run, verbose_name="Run")
+    sequence = models.PositiveIntegerField("Sequence Number")
+    received_at = models.DateTimeField("Received At", default=timezone.now)
+    data_point_count = models.PositiveIntegerField("Number of Data Points", default=0)
+
+    def __repr__(self):
+        return "#{0} of run #{1}".format(self.sequence, self.run_id)
 
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+        unique_together = ('run', 'sequence')
+
+
+class DataPointRollup(models.Model):
+    """
+    A database representation of all data points of a run measured within one fixed-length time bucket.
+    Rollups at several bucket lengths are maintained as measurements are streamed to the server,
+    so that zoomed-out views of long runs can be answered from a few hundred rows.
+    """
+    run = models.ForeignKey(Run, verbose_name="Run")
+    resolution = models.PositiveIntegerField("Bucket Length (seconds)")
+    bucket_start = models.DateTimeField("Bucket Start")
+    count = models.PositiveIntegerField("Number of Data Points", default=0)
+
+    temp_ref_min = models.FloatField("Minimum Reference Temp (Celsius)")
+    temp_ref_max = models.FloatField("Maximum Reference Temp (Celsius)")
+    temp_ref_sum = models.FloatField("Sum of Reference Temps (Celsius)")
+    temp_sample_min = models.FloatField("Minimum Sample Temp (Celsius)")
+    temp_sample_max = models.FloatField("Maximum Sample Temp (Celsius)")
+    temp_sample_sum = models.FloatField("Sum of Sample Temps (Celsius)")
+    heat_ref_min = models.FloatField("Minimum Reference Heat Flow")
+    heat_ref_max = models.FloatField("Maximum Reference Heat Flow")
+    heat_ref_sum = models.FloatField("Sum of Reference Heat Flows")
+    heat_sample_min = models.FloatField("Minimum Sample Heat Flow")
+    heat_sample_max = models.FloatField("Maximum Sample Heat Flow")
+    heat_sample_sum = models.FloatField("Sum of Sample Heat Flows")
+
+    @property
+    def temp_ref_mean(self):
+        return self.temp_ref_sum / self.count
+
+    @property
+    def temp_sample_mean(self):
+        return self.temp_sample_sum / self.count
+
+    @property
+    def heat_ref_mean(self):
+        return self.heat_ref_sum / self.count
+
+    @property
+    def heat_sample_mean(self):
+        return self.heat_sample_sum / self.count
+
+    def __repr__(self):
+        return "#{0} ({1}s from {2})".format(self.run_id, self.resolution, self.bucket_start)
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+        unique_together = ('run', 'resolution', 'bucket_start')
+
+
+class RunSummary(models.Model):
+    """
+    Summary statistics of all data points of a run, maintained as batches of data points are received
+    (see :mod:`controls.summaries`), so that runs can be described without reading their data points.
+    """
+    run = models.OneToOneField(Run, verbose_name="Run", related_name='summary')
+    count = models.PositiveIntegerField("Number of Data Points", default=0)
+    first_measured_at = models.DateTimeField("First Measured At", blank=True, null=True)
+    last_measured_at = models.DateTimeField("Last Measured At", blank=True, null=True)
 
+    temp_ref_min = models.FloatField("Minimum Reference Temp (Celsius)", blank=True, null=True)
+    temp_ref_max = models.FloatField("Maximum Reference Temp (Celsius)", blank=True, null=True)
+    temp_ref_sum = models.FloatField("Sum of Reference Temps (Celsius)", default=0)
+    temp_sample_min = models.FloatField("Minimum Sample Temp (Celsius)", blank=True, null=True)
+    temp_sample_max = models.FloatField("Maximum Sample Temp (Celsius)", blank=True, null=True)
+    temp_sample_sum = models.FloatField("Sum of Sample Temps (Celsius)", default=0)
+
+    # integrals of heat flow over time, continued from the last data point into each new batch
+    heat_ref_total = models.FloatField("Cumulative Reference Heat (mJ)", default=0)
+    heat_sample_total = models.FloatField("Cumulative Sample Heat (mJ)", default=0)
+    last_heat_ref = models.FloatField("Last Reference Heat Flow", blank=True, null=True)
+    last_heat_sample = models.FloatField("Last Sample Heat Flow", blank=True, null=True)
+    last_temp_sample = models.FloatField("Last Sample Temp (Celsius)", blank=True, null=True)
+
+    # the first data point at or above the start temperature, where the temperature ramp begins
+    ramp_started_at = models.DateTimeField("Ramp Started At", blank=True, null=True)
+    ramp_start_temp = models.FloatField("Sample Temp at Ramp Start (Celsius)", blank=True, null=True)
+
+    @property
+    def temp_ref_mean(self):
+        return self.temp_ref_sum / self.count if self.count else None
+
+    @property
+    def temp_sample_mean(self):
+        return self.temp_sample_sum / self.count if self.count else None
+
+    @property
+    def ramp_rate(self):
+        """Average rate of the sample temperature ramp achieved so far, in degrees Celsius per minute."""
+        if self.ramp_started_at is None or self.last_measured_at <= self.ramp_started_at:
+            return None
+        minutes = (self.last_measured_at - self.ramp_started_at).total_seconds() / 60
+        return (self.last_temp_sample - self.ramp_start_temp) / minutes
+
+    def __repr__(self):
+        return "Summary of run #{0} ({1} data points)".format(self.run_id, self.count)
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+
+
+class Notification(models.Model):
+    """
+    An email waiting to be sent, recorded in the same transaction as the change it announces.
+    Pending notifications are delivered, with retries, by the ``send_notifications`` management command,
+    so that a slow mail server never holds up a request.
+    """
+    RUN_COMPLETION = 'run_completion'
+    KIND_CHOICES = (
+        (RUN_COMPLETION, "Run completion"),
+    )
+
+    run = models.ForeignKey(Run, verbose_name="Run")
+    kind = models.CharField("Kind", max_length=30, choices=KIND_CHOICES)
+    recipient = models.EmailField("Recipient")
+
+    created_at = models.DateTimeField("Created At", auto_now_add=True, blank=True)
+    next_attempt_at = models.DateTimeField("Next Attempt At", default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField("Failed Attempts", default=0)
+    last_error = models.TextField("Last Error", blank=True)
+    sent_at = models.DateTimeField("Sent At", blank=True, null=True, db_index=True)
+
+    def __repr__(self):
+        return "{0} to {1} (run #{2})".format(self.get_kind_display(), self.recipient, self.run_id)
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+
+
+class AnalysisResult(models.Model):
+    """
+    A thermogram analysis of a run (see :mod:`controls.analysis`) with certain parameters,
+    valid while the run has the number of data points it had when the analysis was made.
+    Uploads raise the run's data point count, so they invalidate its results without touching this table.
+    """
+    run = models.ForeignKey(Run, verbose_name="Run")
+    parameters_hash = models.CharField("Parameters Hash", max_length=40)
+    watermark = models.PositiveIntegerField("Number of Data Points Analysed")
+    result = models.TextField("Result (JSON)")
+    computed_at = models.DateTimeField("Computed At", auto_now=True)
+
+    def __repr__(self):
+        return "Analysis {0} of run #{1} ({2} data points)".format(
+            self.parameters_hash[:8], self.run_id, self.watermark)
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+        unique_together = ('run', 'parameters_hash')
+
+
+class BlankBaseline(models.Model):
+    """
+    The differential heat flow of a blank run, with empty pans, against sample temperature,
+    precomputed on an evenly spaced temperature grid (see :mod:`controls.baselines`).
+    Subtracted from the heat flow of other runs of its calorimeter at about the same ramp rate,
+    so that what remains is due to their samples alone.
+    """
+    run = models.OneToOneField(Run, verbose_name="Run", related_name='blank_baseline')
+    calorimeter = models.ForeignKey(Calorimeter, verbose_name="Calorimeter")
+    ramp_rate = models.FloatField("Rate of Temp Ramp (Celsius per minute)")
+
+    # the grid runs from temp_min to temp_max in point_count evenly spaced temperatures
+    temp_min = models.FloatField("Lowest Temp of the Grid (Celsius)")
+    temp_max = models.FloatField("Highest Temp of the Grid (Celsius)")
+    point_count = models.PositiveIntegerField("Number of Temps in the Grid")
+    heat_diff = models.BinaryField("Heat Flow Difference at each Temp (float64)")
+    computed_at = models.DateTimeField("Computed At", auto_now=True)
+
+    def __repr__(self):
+        return "Blank run #{0} ({1} Celsius per minute)".format(self.run_id, self.ramp_rate)
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        app_label = "controls"
+        index_together = (('calorimeter', 'ramp_rate'), )
@@ -0,0 +1,86 @@
+""" Outbox of emails to users, delivered in the background.
+
+Requests only record a :class:`controls.models.Notification`, within the same transaction as the change it announces,
+so a notification is neither lost if the change is saved nor sent if it is rolled back.
+:func:`send_pending_notifications`, run by the ``send_notifications`` management command, renders and sends them,
+retrying failed deliveries with exponential backoff.
+"""
+
+from datetime import timedelta
+
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from server_side.controls.models import Notification
+
+SENDER = 'jinscheng@gmail.com'
+
+MAX_ATTEMPTS = 8
+"""Number of failed deliveries after which a notification is given up on."""
+
+RETRY_DELAY = 60
+"""Seconds to wait after the first failed delivery. The delay doubles with each further failure."""
+
+
+def queue_run_completion(run):
+    """
+    Records that the user who started a run is to be told it has finished.
+    Call this within the transaction that finishes the run.
+
+    :param run: the finished :class:`controls.models.Run`, which must have an email address
+    """
+    return Notification.objects.create(run=run, kind=Notification.RUN_COMPLETION, recipient=run.email)
+
+
+def render_notification(notification):
+    """
+    Renders the email of a notification.
+
+    :return: a tuple of subject and body strings
+    """
+    run = notification.run
+    context = {
+        'run_name': run.name or "Run #{0}".format(run.id),
+        'run_url': 'http://robotchem.chengj.in/history/{0}/'.format(run.id),
+        'access_code': run.calorimeter.access_code,
+    }
+    body = render_to_string('{0}_email_body.txt'.format(notification.kind), context)
+    subject = render_to_string('{0}_email_title.txt'.format(notification.kind), context)
+    # headers may not contain line breaks
+    return ' '.join(subject.split()), body
+
+
+def pending_notifications(now=None):
+    """Notifications due for a delivery attempt, oldest first."""
+    return Notification.objects.filter(
+        sent_at__isnull=True, attempts__lt=MAX_ATTEMPTS, next_attempt_at__lte=now or timezone.now(),
+    ).select_related('run__calorimeter').order_by('next_attempt_at', 'id')
+
+
+def send_pending_notifications(limit=None):
+    """
+    Attempts to send every notification that is due.
+    A failed notification is tried again after :data:`RETRY_DELAY` seconds,
+    doubling with each failure, until it has failed :data:`MAX_ATTEMPTS` times.
+
+    :param limit: maximum number of notifications to attempt
+    :return: list of ``(notification, exception)`` tuples, where exception is None for each notification sent
+    """
+    results = []
+    for notification in pending_notifications()[:limit]:
+        try:
+            subject, body = render_notification(notification)
+            send_mail(subject, body, SENDER, [notification.recipient])
+        except Exception as e:
+            notification.attempts += 1
+            notification.last_error = repr(e)
+            notification.next_attempt_at = timezone.now() + \
+                timedelta(seconds=RETRY_DELAY * 2 ** (notification.attempts - 1))
+            notification.save(update_fields=('attempts', 'last_error', 'next_attempt_at'))
+            results.append((notification, e))
+        else:
+            notification.sent_at = timezone.now()
+            notification.save(update_fields=('sent_at', ))
+            results.append((notification, None))
+    return results
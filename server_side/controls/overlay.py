@@ -0,0 +1,119 @@
+""" Comparison of runs on a common temperature axis.
+
+Runs are measured at their own times and temperatures, so to compare them (the same sample at different ramp rates,
+or a sample against a blank run) each run's differential heat flow is resampled onto one temperature grid.
+Only data points at or above a run's start temperature are used, as they make up its temperature ramp.
+Temperatures are quantised by the sensors, so heat flows measured at the same temperature are averaged first,
+giving a strictly increasing series that is then linearly interpolated with :func:`numpy.interp`.
+
+Like :mod:`controls.analysis`, this needs NumPy.
+"""
+
+from server_side.controls.exports import load_run_columns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAX_RUNS = 10
+"""Most runs compared at once, including the baseline run."""
+
+MAX_POINTS = 5000
+"""Most temperatures in a grid."""
+
+DEFAULT_POINTS = 1000
+"""Number of temperatures in a grid if no step is requested."""
+
+
+def heat_flow_by_temperature(columns, start_temp=None):
+    """
+    The differential heat flow of a run as a function of sample temperature.
+
+    :param columns: dict with arrays `temp_sample` and `heat_diff`, as returned by
+        :func:`controls.exports.load_run_columns`
+    :param start_temp: if given, data points at lower sample temperatures are left out
+    :return: tuple of arrays of strictly increasing temperatures and the mean heat flow measured at each
+    """
+    temperature = numpy.asarray(columns['temp_sample'], dtype=numpy.float64)
+    heat_flow = numpy.asarray(columns['heat_diff'], dtype=numpy.float64)
+    if start_temp is not None:
+        included = temperature >= start_temp
+        temperature, heat_flow = temperature[included], heat_flow[included]
+
+    temperatures, inverse = numpy.unique(temperature, return_inverse=True)
+    means = numpy.bincount(inverse, weights=heat_flow, minlength=len(temperatures)) / \
+        numpy.bincount(inverse, minlength=len(temperatures))
+    return temperatures, means
+
+
+def resample(temperatures, heat_flows, grid):
+    """
+    Interpolates a heat flow series onto a temperature grid.
+
+    :param temperatures: strictly increasing temperatures, as returned by :func:`heat_flow_by_temperature`
+    :param heat_flows: heat flows at those temperatures
+    :param grid: temperatures to interpolate at
+    :return: array of heat flows on the grid, NaN outside the range of temperatures measured
+    """
+    if not len(temperatures):
+        return numpy.full(len(grid), numpy.nan)
+    return numpy.interp(grid, temperatures, heat_flows, left=numpy.nan, right=numpy.nan)
+
+
+def make_grid(low, high, step=None, points=DEFAULT_POINTS):
+    """
+    Evenly spaced temperatures from `low` to `high`.
+
+    :param step: spacing of the temperatures, widened if more than `points` would be needed
+    :param points: number of temperatures, or the most if a step is given; at most :const:`MAX_POINTS`
+    :return: array of temperatures
+    """
+    points = max(min(points, MAX_POINTS), 2)
+    if high <= low:
+        return numpy.array([low])
+    if step is not None and step > 0 and (high - low) / step < points:
+        return low + step * numpy.arange(int((high - low) / step) + 1)
+    return numpy.linspace(low, high, points)
+
+
+def _to_json(values):
+    """A list of floats, with None in place of NaN, which JSON cannot represent."""
+    return [None if value != value else value for value in values.tolist()]
+
+
+def overlay_runs(runs, baseline=None, step=None, points=DEFAULT_POINTS, low=None, high=None):
+    """
+    Resamples the differential heat flow of runs onto a common temperature grid.
+    Each run's data points are read with a single query, or from its archive.
+
+    :param runs: list of :class:`controls.models.Run` objects
+    :param baseline: a :class:`controls.models.Run` whose heat flow is subtracted from every run's, or None
+    :param step: spacing of the grid in degrees Celsius, or None to use `points` temperatures
+    :param points: number of temperatures in the grid, or the most if a step is given
+    :param low: lowest temperature of the grid, by default the lowest at which any run was measured
+    :param high: highest temperature of the grid, by default the highest at which any run was measured
+    :return: JSON-ifiable dict with the grid as `temperature` and a list of `runs`, each with its `heat_diff` on the grid
+    """
+    series = [heat_flow_by_temperature(load_run_columns(run), run.start_temp) for run in runs]
+    measured = [temperatures for temperatures, _ in series if len(temperatures)]
+    if low is None:
+        low = min((temperatures[0] for temperatures in measured), default=0.)
+    if high is None:
+        high = max((temperatures[-1] for temperatures in measured), default=low)
+    grid = make_grid(low, high, step, points)
+
+    subtracted = 0.
+    if baseline is not None:
+        subtracted = resample(*heat_flow_by_temperature(load_run_columns(baseline), baseline.start_temp), grid)
+
+    return {
+        'temperature': grid.tolist(),
+        'baseline': baseline.id if baseline is not None else None,
+        'runs': [{
+            'id': run.id,
+            'name': run.name,
+            'ramp_rate': run.ramp_rate,
+            'heat_diff': _to_json(resample(temperatures, heat_flows, grid) - subtracted),
+        } for run, (temperatures, heat_flows) in zip(runs, series)],
+    }
@@ -0,0 +1,134 @@
+""" Multi-resolution rollups of data points.
+
+Every batch of data points received from the device is folded into fixed-length time buckets
+at each of the resolutions in :const:`ROLLUP_RESOLUTIONS`, keeping the minimum, maximum and sum of every measurement.
+Zoomed-out views of a run can then be answered from the coarsest rollup level
+that still satisfies the requested resolution, instead of re-reading every raw row.
+"""
+
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from server_side.controls.models import DataPointRollup, Run
+
+ROLLUP_RESOLUTIONS = (10, 60, 600)
+"""Bucket lengths, in seconds, of the rollup levels maintained for every run. Must be in ascending order."""
+
+ROLLUP_FIELDS = ('temp_ref', 'temp_sample', 'heat_ref', 'heat_sample')
+"""Data point measurements that are aggregated in each bucket."""
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def get_bucket_start(measured_at, resolution):
+    """
+    Floors a measurement time to the start of the time bucket it belongs to.
+    Buckets are aligned to the POSIX epoch so that all levels nest within each other.
+
+    :param measured_at: timezone-aware Python datetime object
+    :param resolution: bucket length in seconds
+    :return: start time of the bucket, as a Python datetime object
+    """
+    since_epoch = measured_at - EPOCH
+    seconds = since_epoch.days * 86400 + since_epoch.seconds
+    return EPOCH + timedelta(seconds=seconds - seconds % resolution)
+
+
+def select_resolution(requested):
+    """
+    Picks the coarsest rollup level whose buckets are not longer than the requested resolution.
+
+    :param requested: largest acceptable interval, in seconds, between consecutive points
+    :return: bucket length in seconds, or None if raw data points are needed
+    """
+    resolution = None
+    for level in ROLLUP_RESOLUTIONS:
+        if level <= requested:
+            resolution = level
+    return resolution
+
+
+def _fold(rollup, data_point):
+    """Adds a single data point's measurements into a rollup bucket."""
+    if rollup.count == 0:
+        for field in ROLLUP_FIELDS:
+            value = getattr(data_point, field)
+            setattr(rollup, field + '_min', value)
+            setattr(rollup, field + '_max', value)
+            setattr(rollup, field + '_sum', 0.)
+
+    for field in ROLLUP_FIELDS:
+        value = getattr(data_point, field)
+        setattr(rollup, field + '_min', min(getattr(rollup, field + '_min'), value))
+        setattr(rollup, field + '_max', max(getattr(rollup, field + '_max'), value))
+        setattr(rollup, field + '_sum', getattr(rollup, field + '_sum') + value)
+    rollup.count += 1
+
+
+def update_rollups(run, data_points):
+    """
+    Folds a batch of newly saved data points into the rollups of their run, at every resolution.
+    Only the buckets touched by the batch are read and written, so this costs O(batch size).
+    Updates of the same run are serialised on a lock of its row, so that concurrent batches
+    do not both create a bucket that neither of them found.
+
+    :param run: the :class:`controls.models.Run` the data points belong to
+    :param data_points: list of saved :class:`controls.models.DataPoint` objects
+    """
+    if not data_points:
+        return
+
+    with transaction.atomic():
+        Run.objects.select_for_update().get(pk=run.pk)
+        for resolution in ROLLUP_RESOLUTIONS:
+            buckets = {}
+            for data_point in data_points:
+                start = get_bucket_start(data_point.measured_at, resolution)
+                buckets.setdefault(start, []).append(data_point)
+
+            existing = DataPointRollup.objects.select_for_update().filter(
+                run=run, resolution=resolution, bucket_start__in=list(buckets.keys()))
+            rollups = {rollup.bucket_start: rollup for rollup in existing}
+
+            new_rollups = []
+            for start, members in buckets.items():
+                rollup = rollups.get(start)
+                if rollup is None:
+                    rollup = DataPointRollup(run=run, resolution=resolution, bucket_start=start)
+                    new_rollups.append(rollup)
+                for data_point in members:
+                    _fold(rollup, data_point)
+
+            for rollup in rollups.values():
+                rollup.save()
+            DataPointRollup.objects.bulk_create(new_rollups)
+
+
+def rebuild_rollups(run, chunk_size=2000):
+    """
+    Discards and recomputes all rollups of a run from its raw data points.
+    Used to backfill runs recorded before rollups were maintained at ingest time.
+
+    :param run: the :class:`controls.models.Run` to rebuild
+    :param chunk_size: number of data points folded per database round trip
+    """
+    DataPointRollup.objects.filter(run=run).delete()
+
+    # imported here, as archives use this module's epoch
+    from server_side.controls.archive import archived_data_points, get_archive
+
+    archive = get_archive(run)
+    if archive is not None:
+        data_points = archived_data_points(archive)
+    else:
+        data_points = run.datapoint_set.order_by('measured_at').iterator()
+
+    chunk = []
+    for data_point in data_points:
+        chunk.append(data_point)
+        if len(chunk) >= chunk_size:
+            update_rollups(run, chunk)
+            chunk = []
+    update_rollups(run, chunk)
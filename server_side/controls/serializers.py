@@ -5,10 +5,17 @@ or to client Javascript code.
 Jin Cheng, 02/12/16
 """
 
+import json
+
 from django.utils import timezone
 from rest_framework import serializers
 
-from server_side.controls.models import Calorimeter, Run, DataPoint
+from server_side.controls.models import Calorimeter, Run, RunSummary, DataPoint, DataPointRollup
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class CalorimeterSerializer(serializers.ModelSerializer):
@@ -23,10 +30,19 @@ class CalorimeterSerializer(serializers.ModelSerializer):
                   'K_p', 'K_i', 'K_d', 'idle_loop_interval',
                   'max_ramp_rate', 'temp_tolerance_range', 'temp_tolerance_duration',
                   'active_loop_interval', 'web_api_min_upload_length',
+                  'ramp_offset', 'ramp_gain', 'feed_forward', 'plant_fitted_at',
+                  'ref_heat_capacity', 'ref_loss_coefficient', 'ref_heater_gain', 'ref_ambient_temp',
+                  'ref_sensor_lag', 'sample_heat_capacity', 'sample_loss_coefficient', 'sample_heater_gain',
+                  'sample_ambient_temp', 'sample_sensor_lag',
+                  'autotune_requested', 'autotune_temp', 'autotune_result',
                   'last_changed_time', 'last_comm_time',
                   'is_active', 'has_active_runs',
                   )
-        read_only_fields = ('access_code', )
+        # thermal models are only fitted by controls.sysid
+        read_only_fields = ('access_code', 'plant_fitted_at',
+                            'ref_heat_capacity', 'ref_loss_coefficient', 'ref_heater_gain', 'ref_ambient_temp',
+                            'ref_sensor_lag', 'sample_heat_capacity', 'sample_loss_coefficient', 'sample_heater_gain',
+                            'sample_ambient_temp', 'sample_sensor_lag', )
 
     def __init__(self, *args, **kwargs):
         super(CalorimeterSerializer, self).__init__(*args, **kwargs)
@@ -40,15 +56,31 @@ class CalorimeterSerializer(serializers.ModelSerializer):
         return abs(time_delta.total_seconds()) < 60
 
     def check_active_runs(self, instance):
-        kwargs = {'calorimeter': instance, 'is_finished': False}
-        if Run.objects.filter(**kwargs).exists():
-            active_run = Run.objects.filter(**kwargs).order_by('-start_time')[0]
+        active_run = Run.objects.filter(calorimeter=instance, is_finished=False).select_related('summary') \
+            .order_by('-start_time').first()
+        if active_run is not None:
             return RunSerializer(active_run).data
         return False
 
+    def validate_autotune_requested(self, value):
+        """Auto-tuning heats the cells, so it cannot start during a run."""
+        if value and self.instance is not None and \
+                Run.objects.filter(calorimeter=self.instance, is_finished=False).exists():
+            raise serializers.ValidationError("The calorimeter cannot be auto-tuned during a run.")
+        return value
+
+    def validate_feed_forward(self, value):
+        if value and (self.instance is None or self.instance.plant_fitted_at is None):
+            raise serializers.ValidationError("Feed-forward needs a thermal model of the calorimeter, "
+                                              "fitted from its runs by the identify_plants command.")
+        return value
+
     def update(self, instance, validated_data):
+        # only the changed fields are written, keeping changes made meanwhile by the device or other requests
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
         instance.last_comm_time = timezone.now()
-        super(CalorimeterSerializer, self).update(instance, validated_data)
+        instance.save(update_fields=list(validated_data) + ['last_comm_time', 'last_changed_time'])
         return instance
 
 
@@ -62,22 +94,110 @@ class DataPointSerializer(serializers.ModelSerializer):
         fields = ('measured_at', 'received_at',
                   'temp_ref', 'temp_sample',
                   'heat_ref', 'heat_sample',
+                  'heat_diff', 'temp_average', 'elapsed_s',
                   'run',
                   )
+        read_only_fields = ('received_at', 'heat_diff', 'temp_average', 'elapsed_s', )
+
+
+class DataPointUploadSerializer(serializers.Serializer):
+    """
+    Validates a data point uploaded by the device, without querying the database.
+    The run is given once for the whole batch rather than with each data point.
+    """
+    measured_at = serializers.DateTimeField(input_formats=['iso-8601'])
+    temp_ref = serializers.FloatField()
+    temp_sample = serializers.FloatField()
+    heat_ref = serializers.FloatField()
+    heat_sample = serializers.FloatField()
+
+
+class DataPointRollupSerializer(serializers.ModelSerializer):
+    """JSON representation of aggregated measurements within one time bucket."""
+    temp_ref_mean = serializers.ReadOnlyField()
+    temp_sample_mean = serializers.ReadOnlyField()
+    heat_ref_mean = serializers.ReadOnlyField()
+    heat_sample_mean = serializers.ReadOnlyField()
+
+    class Meta:
+        model = DataPointRollup
+        fields = ('bucket_start', 'resolution', 'count',
+                  'temp_ref_min', 'temp_ref_max', 'temp_ref_mean',
+                  'temp_sample_min', 'temp_sample_max', 'temp_sample_mean',
+                  'heat_ref_min', 'heat_ref_max', 'heat_ref_mean',
+                  'heat_sample_min', 'heat_sample_max', 'heat_sample_mean',
+                  )
+
+
+COLUMNAR_DATA_POINT_FIELDS = ('measured_at', 'received_at', 'temp_ref', 'temp_sample', 'heat_ref', 'heat_sample',
+                              'heat_diff', 'temp_average', 'elapsed_s')
+"""Data point fields included as columns by :func:`serialize_data_points_columnar`."""
+
+
+def _format_datetime(value):
+    """Formats a datetime as ISO 8601, in the same way as :class:`rest_framework.serializers.DateTimeField`."""
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def serialize_data_points_columnar(queryset):
+    """
+    A fast alternative to :class:`DataPointSerializer` for large responses.
+    Raw value tuples are read from the database and encoded directly to JSON, without field objects or
+    a dict per data point, in a columnar shape: ``{"measured_at": [...], "temp_ref": [...], ...}``.
+
+    :param queryset: data points to serialize, or a list of :class:`controls.models.DataPoint` objects
+    :return: UTF-8 encoded JSON bytes
+    """
+    if isinstance(queryset, list):
+        rows = [tuple(getattr(data_point, field) for field in COLUMNAR_DATA_POINT_FIELDS) for data_point in queryset]
+    else:
+        rows = queryset.values_list(*COLUMNAR_DATA_POINT_FIELDS)
+    columns = list(zip(*rows)) or [()] * len(COLUMNAR_DATA_POINT_FIELDS)
+
+    data = dict(zip(COLUMNAR_DATA_POINT_FIELDS, columns))
+    data['measured_at'] = [_format_datetime(value) for value in data['measured_at']]
+    data['received_at'] = [_format_datetime(value) for value in data['received_at']]
+
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class RunSummarySerializer(serializers.ModelSerializer):
+    """JSON representation of the summary statistics of a run's data points."""
+    temp_ref_mean = serializers.ReadOnlyField()
+    temp_sample_mean = serializers.ReadOnlyField()
+    ramp_rate = serializers.ReadOnlyField()
+
+    class Meta:
+        model = RunSummary
+        fields = ('count', 'first_measured_at', 'last_measured_at',
+                  'temp_ref_min', 'temp_ref_max', 'temp_ref_mean',
+                  'temp_sample_min', 'temp_sample_max', 'temp_sample_mean',
+                  'heat_ref_total', 'heat_sample_total', 'ramp_rate',
+                  )
 
 
 class RunSerializer(serializers.ModelSerializer):
-    """JSON representation of a calorimetry job."""
-    calorimeter = serializers.PrimaryKeyRelatedField(queryset=Calorimeter.objects.all(), validators=[])
-    data_point_count = serializers.SerializerMethodField('count_data_points')
+    """JSON representation of a calorimetry job, with the summary statistics of its data points, if any."""
+    # runs belong to the calorimeter of the request that creates them, see controls.views.RunListAPI.post
+    calorimeter = serializers.PrimaryKeyRelatedField(read_only=True)
+    summary = serializers.SerializerMethodField()
 
     class Meta:
         model = Run
         fields = ('id', 'name', 'creation_time', 'start_time', 'finish_time',
                   'stabilized_at_start', 'is_ready', 'is_running', 'is_finished', 'email',
                   'start_temp', 'target_temp', 'ramp_rate',
-                  'calorimeter', 'data_point_count',
+                  'calorimeter', 'data_point_count', 'time_origin', 'summary',
                   )
+        read_only_fields = ('data_point_count', 'time_origin', )
 
-    def count_data_points(self, instance):
-        return instance.datapoint_set.count()
+    def get_summary(self, instance):
+        try:
+            return RunSummarySerializer(instance.summary).data
+        except RunSummary.DoesNotExist:
+            return None
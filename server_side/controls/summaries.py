@@ -0,0 +1,152 @@
+""" Summary statistics of runs, maintained at ingest time.
+
+Every batch of data points received from the device is folded into the run's :class:`controls.models.RunSummary`,
+reading and writing a single row, so listing runs with their statistics never reads raw data points.
+
+Cumulative heat is integrated over time by the trapezoidal rule, joining each batch to the last data point before it.
+A batch measured before the last data point, which only happens if uploads arrive out of order,
+changes the integral over the span of the data points around it,
+which is integrated again through the data points of the span, taking three more queries.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+
+from server_side.controls.archive import archived_data_points, get_archive
+from server_side.controls.models import DataPoint, RunSummary
+
+
+def _fold(summary, data_point, start_temp):
+    """Adds a single data point's temperatures and measurement time into a run summary."""
+    measured_at = data_point.measured_at
+    if summary.count == 0:
+        summary.first_measured_at = summary.last_measured_at = measured_at
+        summary.temp_ref_min = summary.temp_ref_max = data_point.temp_ref
+        summary.temp_sample_min = summary.temp_sample_max = data_point.temp_sample
+
+    summary.first_measured_at = min(summary.first_measured_at, measured_at)
+    if measured_at >= summary.last_measured_at:
+        summary.last_measured_at = measured_at
+        summary.last_temp_sample = data_point.temp_sample
+
+    summary.temp_ref_min = min(summary.temp_ref_min, data_point.temp_ref)
+    summary.temp_ref_max = max(summary.temp_ref_max, data_point.temp_ref)
+    summary.temp_ref_sum += data_point.temp_ref
+    summary.temp_sample_min = min(summary.temp_sample_min, data_point.temp_sample)
+    summary.temp_sample_max = max(summary.temp_sample_max, data_point.temp_sample)
+    summary.temp_sample_sum += data_point.temp_sample
+
+    if data_point.temp_sample >= start_temp and (
+            summary.ramp_started_at is None or measured_at < summary.ramp_started_at):
+        summary.ramp_started_at = measured_at
+        summary.ramp_start_temp = data_point.temp_sample
+    summary.count += 1
+
+
+def _trapezoid(first, second):
+    """Integrals of the reference and sample heat flows between two data points, in mJ."""
+    seconds = (second.measured_at - first.measured_at).total_seconds()
+    return (first.heat_ref + second.heat_ref) * seconds / 2, (first.heat_sample + second.heat_sample) * seconds / 2
+
+
+def _integral(data_points):
+    """Integrals of the reference and sample heat flows through a list of data points in order of time, in mJ."""
+    heat_ref = heat_sample = 0.
+    for first, second in zip(data_points, data_points[1:]):
+        segment_ref, segment_sample = _trapezoid(first, second)
+        heat_ref += segment_ref
+        heat_sample += segment_sample
+    return heat_ref, heat_sample
+
+
+def _reintegrate(summary, run, batch):
+    """
+    Integrates an out of order batch, which may fall between, overlap or extend past the data points saved before it.
+    The integral over the span from the last data point before the batch to the first one after it
+    is computed again through all data points in the span, replacing the integral through those saved before.
+    The batch must be saved already.
+    """
+    saved = DataPoint.objects.filter(run=run).order_by('measured_at', 'id')
+    before = saved.filter(measured_at__lt=batch[0].measured_at).last()
+    after = saved.filter(measured_at__gt=batch[-1].measured_at).first()
+    span = saved.only('measured_at', 'heat_ref', 'heat_sample')
+    if before is not None:
+        span = span.filter(measured_at__gte=before.measured_at)
+    if after is not None:
+        span = span.filter(measured_at__lte=after.measured_at)
+    data_points = list(span)
+
+    # the data points saved before the batch are those of the span less one match for each of the batch
+    unmatched = Counter((data_point.measured_at, data_point.heat_ref, data_point.heat_sample) for data_point in batch)
+    previous = []
+    for data_point in data_points:
+        key = (data_point.measured_at, data_point.heat_ref, data_point.heat_sample)
+        if unmatched[key]:
+            unmatched[key] -= 1
+        else:
+            previous.append(data_point)
+
+    for sign, span_points in ((1, data_points), (-1, previous)):
+        heat_ref, heat_sample = _integral(span_points)
+        summary.heat_ref_total += sign * heat_ref
+        summary.heat_sample_total += sign * heat_sample
+
+
+def update_summary(run, data_points):
+    """
+    Folds a batch of newly saved data points into the summary of their run, creating it if needed.
+
+    :param run: the :class:`controls.models.Run` the data points belong to
+    :param data_points: list of :class:`controls.models.DataPoint` objects
+    """
+    if not data_points:
+        return
+
+    with transaction.atomic():
+        summary, _ = RunSummary.objects.select_for_update().get_or_create(run=run)
+        batch = sorted(data_points, key=lambda data_point: data_point.measured_at)
+
+        if summary.count and batch[0].measured_at < summary.last_measured_at:
+            _reintegrate(summary, run, batch)
+        else:
+            if summary.count and summary.last_heat_ref is not None:
+                batch_ref, batch_sample = _integral([DataPoint(
+                    measured_at=summary.last_measured_at,
+                    heat_ref=summary.last_heat_ref, heat_sample=summary.last_heat_sample)] + batch)
+            else:
+                batch_ref, batch_sample = _integral(batch)
+            summary.heat_ref_total += batch_ref
+            summary.heat_sample_total += batch_sample
+
+        for data_point in batch:
+            _fold(summary, data_point, run.start_temp)
+
+        if summary.last_measured_at == batch[-1].measured_at:
+            summary.last_heat_ref, summary.last_heat_sample = batch[-1].heat_ref, batch[-1].heat_sample
+        summary.save()
+
+
+def rebuild_summary(run, chunk_size=2000):
+    """
+    Discards and recomputes the summary of a run from all its data points.
+    Used to backfill runs recorded before summaries were maintained at ingest time.
+
+    :param run: the :class:`controls.models.Run` to rebuild
+    :param chunk_size: number of data points folded per database round trip
+    """
+    RunSummary.objects.filter(run=run).delete()
+
+    archive = get_archive(run)
+    if archive is not None:
+        data_points = archived_data_points(archive)
+    else:
+        data_points = run.datapoint_set.order_by('measured_at').iterator()
+
+    chunk = []
+    for data_point in data_points:
+        chunk.append(data_point)
+        if len(chunk) >= chunk_size:
+            update_summary(run, chunk)
+            chunk = []
+    update_summary(run, chunk)
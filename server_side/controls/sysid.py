@@ -0,0 +1,224 @@
+""" Identification of the thermal behaviour of each cell of a calorimeter from its recorded runs.
+
+Each cell is modelled as a lumped thermal mass (:class:`controls.tuning.ThermalPlant`):
+its heater heats it, it loses heat to its surroundings in proportion to its temperature above ambient,
+and its sensor follows its temperature with a first order lag::
+
+    C dT/dt = P - k (T - ambient)
+    lag dS/dt = T - S
+
+with ``P`` the heat flow of the heater and ``S`` the sensed temperature, both recorded with every data point.
+Eliminating ``T`` gives ``P = (C + k lag) dS/dt + C lag d2S/dt2 + k S - k ambient``,
+which is linear in the recorded quantities, so all four parameters follow from one vectorised least squares fit
+over every data point of several runs.
+The heater gain, the heat flow per percent of duty cycle, is the heat flow at full duty cycle divided by 100.
+
+Parameters are stored in the calorimeter's fields, with the ramp calibration of the device, the set point increment
+per loop cycle that makes temperatures rise at a requested rate, fitted by simulating ramps with the fitted model.
+Like :mod:`controls.analysis`, this needs NumPy.
+"""
+
+import math
+
+from django.utils import timezone
+
+from server_side.controls.exports import load_run_columns
+from server_side.controls.models import Run
+from server_side.controls.tuning import TUNED_FIELDS, Scenario, ThermalPlant, simulate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CELLS = ('ref', 'sample')
+"""Cells of a calorimeter, as in the names of data point and calorimeter fields."""
+
+PLANT_FIELDS = ('heat_capacity', 'loss_coefficient', 'heater_gain', 'ambient_temp', 'sensor_lag')
+"""Parameters of a :class:`controls.tuning.ThermalPlant`, stored in calorimeter fields prefixed with the cell."""
+
+RECENT_RUNS = 5
+"""Number of a calorimeter's most recent finished runs that its cells are identified from by default."""
+
+FIT_STEP = 10.
+"""Seconds over which measurements are averaged before fitting, long enough to rise above sensor resolution."""
+
+HEATER_GAIN_PERCENTILE = 99
+"""Percentile of the heat flows of a cell taken as its heat flow at full duty cycle.
+Heaters run at full duty cycle while a run heats up to its start temperature."""
+
+RAMP_CALIBRATION_FRACTIONS = (0.25, 0.5, 0.75, 1.)
+"""Fractions of the maximum ramp rate at which ramps are simulated to fit the ramp calibration."""
+
+RAMP_FOLLOW_FRACTION = 0.8
+"""Smallest fraction of the rate stepped by the set point that simulated cells must reach for a ramp to count
+towards the ramp calibration. Faster ramps saturate the heaters, which no calibration can make up for."""
+
+RAMP_CALIBRATION_SPAN = (15., 55.)
+"""Start and target temperatures of the ramps simulated to fit the ramp calibration, in degrees above ambient."""
+
+
+def recent_runs(calorimeter, run_ids=None):
+    """
+    Runs to identify a calorimeter from, most recent first.
+
+    :param run_ids: IDs of the runs, by default the :const:`RECENT_RUNS` most recent finished runs
+    :return: list of :class:`controls.models.Run` objects
+    """
+    runs = Run.objects.filter(calorimeter=calorimeter).select_related('archive').order_by('-creation_time')
+    if run_ids:
+        return list(runs.filter(id__in=run_ids))
+    return list(runs.filter(is_finished=True)[:RECENT_RUNS])
+
+
+def _window_means(time, values, centres):
+    """Mean values over windows of :const:`FIT_STEP` around each centre, from the cumulative integral over time."""
+    integral = numpy.concatenate(([0.], numpy.cumsum((values[1:] + values[:-1]) / 2 * numpy.diff(time))))
+    return (numpy.interp(centres + FIT_STEP / 2, time, integral) -
+            numpy.interp(centres - FIT_STEP / 2, time, integral)) / FIT_STEP
+
+
+def _cell_rows(columns, cell):
+    """
+    Rows of the least squares problem of :func:`identify_cell` for one run:
+    the rate of change, its rate of change and the value of the sensed temperature and a constant,
+    and the heat flow of the heater, all averaged over windows of :const:`FIT_STEP`.
+    """
+    time = columns['time']
+    if len(time) < 2 or time[-1] - time[0] < 5 * FIT_STEP:
+        return numpy.empty((0, 4)), numpy.empty(0)
+    centres = numpy.arange(time[0] + FIT_STEP / 2, time[-1] - FIT_STEP / 2, FIT_STEP)
+    sensed = _window_means(time, columns['temp_' + cell], centres)
+    heat_flow = _window_means(time, columns['heat_' + cell], centres)
+
+    rate = numpy.gradient(sensed, FIT_STEP)
+    acceleration = numpy.gradient(rate, FIT_STEP)
+    rows = numpy.column_stack((rate, acceleration, sensed, numpy.ones(len(sensed))))
+    # one sided differences at the ends are left out
+    return rows[2:-2], heat_flow[2:-2]
+
+
+def identify_cell(runs, cell):
+    """
+    Fits a :class:`controls.tuning.ThermalPlant` to a cell of recorded runs.
+
+    :param runs: list of dicts of columns, as returned by :func:`controls.exports.load_run_columns`
+    :param cell: one of :const:`CELLS`
+    :return: the :class:`controls.tuning.ThermalPlant`
+    :exception ValueError: if the runs do not show the cell heating up
+    """
+    fitted = [_cell_rows(columns, cell) for columns in runs]
+    rows = numpy.concatenate([rows for rows, _ in fitted] + [numpy.empty((0, 4))])
+    heat_flows = numpy.concatenate([heat_flows for _, heat_flows in fitted] + [numpy.empty(0)])
+    if len(heat_flows) < 8:
+        raise ValueError("Too few measurements to identify the {0} cell.".format(cell))
+
+    (rate_term, acceleration_term, loss_coefficient, constant), *_ = numpy.linalg.lstsq(rows, heat_flows, rcond=None)
+    loss_coefficient = max(loss_coefficient, 0.)
+    discriminant = rate_term ** 2 - 4 * loss_coefficient * acceleration_term
+    if acceleration_term > 0 and discriminant >= 0:
+        # rate_term = C + k lag and acceleration_term = C lag; C is the larger root, as the lag is short
+        heat_capacity = (rate_term + math.sqrt(discriminant)) / 2
+        sensor_lag = acceleration_term / heat_capacity
+    else:
+        # no lag can be seen, so the model without one is fitted
+        (heat_capacity, loss_coefficient, constant), *_ = numpy.linalg.lstsq(
+            rows[:, (0, 2, 3)], heat_flows, rcond=None)
+        loss_coefficient, sensor_lag = max(loss_coefficient, 0.), 0.
+    if heat_capacity <= 0:
+        raise ValueError("The {0} cell does not heat up with its heater in these runs.".format(cell))
+
+    if loss_coefficient > 0:
+        ambient_temp = -constant / loss_coefficient
+    else:
+        ambient_temp = numpy.median([columns['temp_' + cell][0] for columns in runs if len(columns['time'])])
+
+    all_heat_flows = numpy.concatenate([columns['heat_' + cell] for columns in runs])
+    heater_gain = numpy.percentile(all_heat_flows, HEATER_GAIN_PERCENTILE) / 100
+    return ThermalPlant(float(heat_capacity), float(loss_coefficient), float(heater_gain), float(ambient_temp),
+                        float(sensor_lag))
+
+
+def estimate_cycle_overhead(runs, interval):
+    """
+    Seconds that each loop cycle of the device lasts beyond its loop interval, mostly spent reading its sensors.
+
+    :param runs: list of dicts of columns, as returned by :func:`controls.exports.load_run_columns`
+    :param interval: loop interval of the device during the runs
+    """
+    periods = numpy.concatenate([numpy.diff(columns['time']) for columns in runs] + [numpy.empty(0)])
+    if not len(periods):
+        return 0.
+    return max(float(numpy.median(periods)) - interval, 0.)
+
+
+def fit_ramp_calibration(plants, calorimeter):
+    """
+    Fits the ramp calibration of a calorimeter with its current PID gains and loop interval,
+    by simulating ramps with several set point increments per cycle and fitting the rates reached to a line,
+    over the ramps that the heaters can follow.
+    The device steps its set point by ``(ramp_rate + ramp_offset) * ramp_gain`` every cycle.
+
+    :param plants: tuple of the :class:`controls.tuning.ThermalPlant` of the reference and sample cells
+    :param calorimeter: the :class:`controls.models.Calorimeter`
+    :return: tuple of the ramp offset and ramp gain
+    :exception ValueError: if the simulated cells do not follow the ramps
+    """
+    settings = {field: getattr(calorimeter, field) for field in TUNED_FIELDS}
+    period = calorimeter.active_loop_interval + calorimeter.cycle_overhead
+    ambient_temp = sum(plant.ambient_temp for plant in plants) / len(plants)
+    start_temp, target_temp = (ambient_temp + degrees for degrees in RAMP_CALIBRATION_SPAN)
+
+    increments, rates = [], []
+    for fraction in RAMP_CALIBRATION_FRACTIONS:
+        increment = fraction * calorimeter.max_ramp_rate * period / 60
+        # with no offset and a gain of 1, the set point increment is given directly as the ramp rate
+        scenario = Scenario(start_temp, target_temp, increment, increment, calorimeter.temp_tolerance_range,
+                            calorimeter.temp_tolerance_duration, ambient_temp, ramp_offset=0., ramp_gain=1.,
+                            cycle_overhead=calorimeter.cycle_overhead, feed_forward=calorimeter.feed_forward)
+        rate = simulate(plants, settings, scenario)['ramp_rate']
+        if rate is not None and rate >= RAMP_FOLLOW_FRACTION * increment / period * 60:
+            increments.append(increment)
+            rates.append(rate)
+    if len(rates) < 2:
+        raise ValueError("The simulated cells do not follow a ramp with the current PID gains.")
+
+    slope, intercept = numpy.polyfit(increments, rates, 1)
+    if slope <= 0:
+        raise ValueError("The simulated cells do not follow a ramp with the current PID gains.")
+    return float(-intercept), float(1 / slope)
+
+
+def stored_plants(calorimeter):
+    """
+    The thermal models of the cells of a calorimeter, as last stored by :func:`identify_calorimeter`.
+
+    :return: tuple of the :class:`controls.tuning.ThermalPlant` of the reference and sample cells,
+        or None if the calorimeter has not been identified
+    """
+    if calorimeter.plant_fitted_at is None:
+        return None
+    return tuple(ThermalPlant(*(getattr(calorimeter, '{0}_{1}'.format(cell, field)) for field in PLANT_FIELDS))
+                 for cell in CELLS)
+
+
+def identify_calorimeter(calorimeter, runs):
+    """
+    Identifies both cells of a calorimeter from recorded runs, and fits its ramp calibration.
+    Saves all parameters to the calorimeter.
+
+    :param calorimeter: the :class:`controls.models.Calorimeter`
+    :param runs: list of its :class:`controls.models.Run` objects, see :func:`recent_runs`
+    :return: tuple of the :class:`controls.tuning.ThermalPlant` of the reference and sample cells
+    :exception ValueError: if the runs are not enough to identify the calorimeter
+    """
+    columns = [load_run_columns(run) for run in runs]
+    plants = tuple(identify_cell(columns, cell) for cell in CELLS)
+    for cell, plant in zip(CELLS, plants):
+        for field in PLANT_FIELDS:
+            setattr(calorimeter, '{0}_{1}'.format(cell, field), getattr(plant, field))
+    calorimeter.cycle_overhead = estimate_cycle_overhead(columns, calorimeter.active_loop_interval)
+    calorimeter.ramp_offset, calorimeter.ramp_gain = fit_ramp_calibration(plants, calorimeter)
+    calorimeter.plant_fitted_at = timezone.now()
+    calorimeter.save()
+    return plants
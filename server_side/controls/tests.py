@@ -0,0 +1,685 @@
+""" Tests of the controls app.
+"""
+
+import json
+import math
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import datetime, timedelta
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from server_side.controls import analysis, baselines, deltacodec, hub, overlay, sysid, tuning, wireformat
+from server_side.controls.archive import archive_run, archived_data_points
+from server_side.controls.exports import load_run_columns
+from server_side.controls.ingest import FAILED_DIR_NAME, INGEST_QUEUED, drain_queue, ingest_batch
+from server_side.controls.models import AnalysisResult, Calorimeter, DataPoint, DataPointRollup, Run, RunSummary, \
+    UploadBatch
+from server_side.controls.rollups import ROLLUP_FIELDS, ROLLUP_RESOLUTIONS, get_bucket_start, rebuild_rollups, \
+    select_resolution
+
+START = datetime(2017, 1, 22, 12, tzinfo=timezone.utc)
+"""Time at which runs made by tests start."""
+
+
+@mock.patch('server_side.controls.views.DEBUG', False)
+class ListQueryCountTests(TestCase):
+    """
+    The number of queries answering a list page must not grow with the number of runs on it.
+    Each request resolves its calorimeter from the access code with one query, as the cache starts empty.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.calorimeter = Calorimeter.objects.create(serial='test', access_code='code',
+                                                      last_comm_time=timezone.now())
+
+    def create_runs(self, count, **kwargs):
+        for i in range(count):
+            run = Run.objects.create(calorimeter=self.calorimeter, name='run {0}'.format(i),
+                                     start_temp=30, target_temp=80, ramp_rate=2, start_time=timezone.now(),
+                                     **kwargs)
+            RunSummary.objects.create(run=run)
+
+    def assert_run_list_queries(self, count):
+        self.create_runs(count, is_finished=True)
+        # calorimeter, page count, page of (id, revision) pairs, runs with their summaries
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/runs/', {'access_code': 'code'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['runs']), count)
+
+    def test_run_list_one_run(self):
+        self.assert_run_list_queries(1)
+
+    def test_run_list_full_page(self):
+        self.assert_run_list_queries(5)
+
+    def assert_status_queries(self, count):
+        self.create_runs(count)
+        # calorimeter, version of the active run for the ETag, active run with its summary
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/status/', {'access_code': 'code'})
+        self.assertEqual(response.status_code, 200)
+        # the run started last is the active one
+        self.assertEqual(response.data['has_active_runs']['name'], 'run {0}'.format(count - 1))
+
+    def test_status_one_active_run(self):
+        self.assert_status_queries(1)
+
+    def test_status_many_active_runs(self):
+        self.assert_status_queries(5)
+
+
+def create_data_points(run, count, received_at, offset=0):
+    """Saves data points of a run measured half a second apart, heating by a degree each."""
+    data_points = [DataPoint(run=run, measured_at=START + timedelta(seconds=(offset + i) / 2), received_at=received_at,
+                             temp_ref=20. + offset + i, temp_sample=20.5 + offset + i, heat_ref=100., heat_sample=101.)
+                   for i in range(count)]
+    DataPoint.objects.bulk_create(data_points)
+    return data_points
+
+
+@mock.patch('server_side.controls.views.DEBUG', False)
+class DataPointAPITests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        self.run = Run.objects.create(calorimeter=calorimeter, start_temp=20, target_temp=80, ramp_rate=2)
+
+    def test_archived_run_since_posix_time(self):
+        create_data_points(self.run, 4, START)
+        create_data_points(self.run, 4, START + timedelta(minutes=1), offset=4)
+        self.run.is_finished = True
+        self.run.save()
+        archive_run(self.run)
+
+        since = (START + timedelta(seconds=30)).timestamp()
+        response = self.client.get('/api/data/', {'access_code': 'code', 'run': self.run.pk, 'since': str(since)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([data_point['temp_ref'] for data_point in response.data], [24., 25., 26., 27.])
+
+    def test_archive_round_trip(self):
+        create_data_points(self.run, 4, START)
+        DataPoint.objects.filter(run=self.run, temp_ref=21.).update(temp_ref=21.01, heat_sample=101.005)
+        self.run.is_finished = True
+        self.run.save()
+        expected = list(DataPoint.objects.filter(run=self.run).order_by('measured_at').values_list(
+            'measured_at', 'received_at', 'temp_ref', 'temp_sample', 'heat_ref', 'heat_sample'))
+
+        archive = archive_run(self.run)
+        self.assertFalse(DataPoint.objects.filter(run=self.run).exists())
+        self.assertEqual(archive.data_point_count, 4)
+        data_points = archived_data_points(archive)
+        self.assertEqual([(data_point.measured_at, data_point.received_at) for data_point in data_points],
+                         [row[:2] for row in expected])
+        for data_point, row in zip(data_points, expected):
+            for field, quantum, value in zip(('temp_ref', 'temp_sample', 'heat_ref', 'heat_sample'),
+                                             (deltacodec.TEMP_QUANTUM, deltacodec.TEMP_QUANTUM,
+                                              deltacodec.HEAT_QUANTUM, deltacodec.HEAT_QUANTUM), row[2:]):
+                self.assertLessEqual(abs(getattr(data_point, field) - value), quantum / 2)
+
+
+    def upload(self, sequence):
+        data = [{'measured_at': (START + timedelta(seconds=i)).isoformat(), 'temp_ref': 20., 'temp_sample': 21.,
+                 'heat_ref': 1., 'heat_sample': 3.} for i in range(3)]
+        return self.client.post('/api/data/', {'access_code': 'code', 'run': self.run.pk, 'data': data,
+                                               'stabilized_at_start': False, 'is_finished': False,
+                                               'sequence': sequence}, format='json')
+
+    def test_repeated_upload_recorded_once(self):
+        self.assertFalse(self.upload(1).data['duplicate'])
+        self.assertTrue(self.upload(1).data['duplicate'])
+        self.assertFalse(self.upload(2).data['duplicate'])
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.data_point_count, 6)
+        self.assertEqual(DataPoint.objects.filter(run=self.run).count(), 6)
+        self.assertEqual(UploadBatch.objects.filter(run=self.run).count(), 2)
+
+    def test_repeated_batch_ingested_once(self):
+        # as when two copies of a batch pass the check in the view concurrently
+        results = [ingest_batch(self.run.pk, [DataPoint(run=self.run, measured_at=START, received_at=START,
+                                                         temp_ref=20., temp_sample=21., heat_ref=1., heat_sample=3.)],
+                                stabilized=False, is_finished=False, sequence=1)
+                   for _ in range(2)]
+        self.assertIsNotNone(results[0])
+        self.assertIsNone(results[1])
+        self.assertEqual(DataPoint.objects.filter(run=self.run).count(), 1)
+        self.assertEqual(UploadBatch.objects.filter(run=self.run).count(), 1)
+
+@mock.patch('server_side.controls.views.DEBUG', False)
+class QueuedIngestTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.queue_dir)
+        self.calorimeter = Calorimeter.objects.create(serial='test', access_code='code',
+                                                      last_comm_time=timezone.now())
+        self.run = Run.objects.create(calorimeter=self.calorimeter, start_temp=20, target_temp=80, ramp_rate=2)
+
+    def upload(self, offset, sequence):
+        data = [{'measured_at': (START + timedelta(seconds=offset + i)).isoformat(), 'temp_ref': 20., 'temp_sample': 21.,
+                 'heat_ref': 1., 'heat_sample': 3.} for i in range(3)]
+        with self.settings(INGEST_MODE=INGEST_QUEUED, INGEST_QUEUE_DIR=self.queue_dir):
+            return self.client.post('/api/data/', {'access_code': 'code', 'run': self.run.pk, 'data': data,
+                                                   'stabilized_at_start': False, 'is_finished': False,
+                                                   'sequence': sequence}, format='json')
+
+    def test_upload_only_reads(self):
+        self.calorimeter.stop_flag = True
+        self.calorimeter.save()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.upload(0, 1)
+        self.assertTrue(response.data['stop_flag'])
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+
+        with self.settings(INGEST_QUEUE_DIR=self.queue_dir):
+            self.assertEqual([error for _, error in drain_queue()], [None])
+        self.calorimeter.refresh_from_db()
+        self.run.refresh_from_db()
+        self.assertFalse(self.calorimeter.stop_flag)
+        self.assertTrue(self.run.is_finished)
+        self.assertEqual(self.run.time_origin, START)
+
+    def test_time_origin_set_when_recorded(self):
+        # the later batch is queued first, and measured from its own first point until recorded
+        self.assertEqual(self.upload(10, 2).data['data_point'][0]['elapsed_s'], 0.)
+        self.upload(0, 1)
+        with self.settings(INGEST_QUEUE_DIR=self.queue_dir):
+            drain_queue()
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.time_origin, START + timedelta(seconds=10))
+        elapsed = list(DataPoint.objects.order_by('measured_at').values_list('elapsed_s', flat=True))
+        self.assertEqual(elapsed, [-10., -9., -8., 0., 1., 2.])
+
+    def test_batch_written_whole(self):
+        self.upload(0, 1)
+        names = os.listdir(self.queue_dir)
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith('.json') and not names[0].startswith('.'))
+        with open(os.path.join(self.queue_dir, names[0])) as f:
+            self.assertEqual(len(json.load(f)['data']), 3)
+
+    def test_unrecordable_batches_quarantined(self):
+        self.upload(0, 1)
+        self.upload(3, 2)
+        with open(os.path.join(self.queue_dir, '00000000000000000000-malformed.json'), 'w') as f:
+            f.write('{"run": ')
+        # hidden while still being written
+        open(os.path.join(self.queue_dir, '.00000000000000000000-partial.json'), 'w').close()
+        self.run.delete()
+
+        with self.settings(INGEST_QUEUE_DIR=self.queue_dir):
+            results = drain_queue()
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(error is not None for _, error in results))
+        self.assertEqual(len(os.listdir(os.path.join(self.queue_dir, FAILED_DIR_NAME))), 3)
+        self.assertEqual(sorted(os.listdir(self.queue_dir)), ['.00000000000000000000-partial.json', FAILED_DIR_NAME])
+
+    def test_drainer_needs_shared_broker(self):
+        with self.assertRaisesMessage(CommandError, 'RedisBroker'):
+            call_command('drain_ingest_queue', once=True)
+
+
+class RollupTests(TestCase):
+    """Rollups folded batch by batch must match those computed from all data points at once."""
+
+    def setUp(self):
+        calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        self.run = Run.objects.create(calorimeter=calorimeter, start_temp=20, target_temp=80, ramp_rate=2)
+
+    def rollups(self):
+        return {(rollup.resolution, rollup.bucket_start): tuple(
+            [rollup.count] + [getattr(rollup, field + suffix) for field in ROLLUP_FIELDS
+                              for suffix in ('_min', '_max', '_sum')])
+            for rollup in DataPointRollup.objects.filter(run=self.run)}
+
+    def test_bucket_start(self):
+        measured_at = START + timedelta(minutes=12, seconds=34, microseconds=5)
+        self.assertEqual(get_bucket_start(measured_at, 10), START + timedelta(minutes=12, seconds=30))
+        self.assertEqual(get_bucket_start(measured_at, 600), START + timedelta(minutes=10))
+
+    def test_select_resolution(self):
+        self.assertIsNone(select_resolution(5))
+        self.assertEqual(select_resolution(10), 10)
+        self.assertEqual(select_resolution(599), 60)
+        self.assertEqual(select_resolution(86400), 600)
+
+    def test_batches_match_rebuild(self):
+        # two batches sharing buckets at every level, the second measured partly before the first
+        for seconds in (range(0, 1200, 7), range(-300, 300, 11)):
+            ingest_batch(self.run.pk, [DataPoint(run=self.run, measured_at=START + timedelta(seconds=second),
+                                                 received_at=START, temp_ref=20. + second / 60,
+                                                 temp_sample=21. + second / 60, heat_ref=100. + second % 13,
+                                                 heat_sample=200. - second % 17)
+                                       for second in seconds], stabilized=False, is_finished=False)
+        folded = self.rollups()
+        rebuild_rollups(self.run)
+        rebuilt = self.rollups()
+
+        self.assertEqual(folded.keys(), rebuilt.keys())
+        for key, values in folded.items():
+            for value, expected in zip(values, rebuilt[key]):
+                self.assertAlmostEqual(value, expected)
+        for resolution in ROLLUP_RESOLUTIONS:
+            self.assertEqual(sum(values[0] for (level, _), values in folded.items() if level == resolution),
+                             DataPoint.objects.filter(run=self.run).count())
+
+        # measured at 0 and 7 seconds in the first batch and 8 seconds in the second
+        count, temp_ref_min, temp_ref_max, temp_ref_sum = folded[(10, START)][:4]
+        self.assertEqual((count, temp_ref_min), (3, 20.))
+        self.assertAlmostEqual(temp_ref_max, 20. + 8 / 60)
+        self.assertAlmostEqual(temp_ref_sum, 60. + 15 / 60)
+
+
+class RunSummaryTests(TestCase):
+    """The heat integrals of a run must not depend on the order in which its batches arrive."""
+
+    def setUp(self):
+        calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        self.run = Run.objects.create(calorimeter=calorimeter, start_temp=20, target_temp=80, ramp_rate=2)
+
+    def batch(self, seconds):
+        # heat flows that are not linear in time, so that a wrongly joined span changes the integral
+        return [DataPoint(run=self.run, measured_at=START + timedelta(seconds=second), received_at=START,
+                          temp_ref=20. + second, temp_sample=21. + second,
+                          heat_ref=100. + second ** 2, heat_sample=200. - second ** 2)
+                for second in seconds]
+
+    def assert_integrals(self, *batches):
+        for seconds in batches:
+            ingest_batch(self.run.pk, self.batch(seconds), stabilized=False, is_finished=False)
+        seconds = sorted(second for batch in batches for second in batch)
+        expected_ref = sum((100. + a ** 2 + 100. + b ** 2) * (b - a) / 2 for a, b in zip(seconds, seconds[1:]))
+        expected_sample = sum((200. - a ** 2 + 200. - b ** 2) * (b - a) / 2 for a, b in zip(seconds, seconds[1:]))
+
+        summary = RunSummary.objects.get(run=self.run)
+        self.assertEqual(summary.count, len(seconds))
+        self.assertAlmostEqual(summary.heat_ref_total, expected_ref)
+        self.assertAlmostEqual(summary.heat_sample_total, expected_sample)
+        self.assertEqual(summary.last_measured_at, START + timedelta(seconds=seconds[-1]))
+
+    def test_in_order(self):
+        self.assert_integrals(range(0, 10), range(10, 20))
+
+    def test_batch_in_gap(self):
+        self.assert_integrals(range(0, 5), range(10, 15), range(5, 10))
+
+    def test_batch_straddling_last_data_point(self):
+        self.assert_integrals(range(0, 10), [7.5, 8.5, 9.5, 10.5, 11.5, 12.5])
+
+    def test_batch_overlapping_gap(self):
+        self.assert_integrals(range(0, 4), range(10, 14), [2.5, 3.5, 4.5, 9.5, 10.5], range(14, 16))
+
+    def test_batch_before_first_data_point(self):
+        self.assert_integrals(range(5, 10), [0.5, 1.5, 5.5])
+
+
+@skipIf(not analysis.is_available(), "NumPy is not installed.")
+class CachedAnalysisTests(TestCase):
+    """Analyses are stored and reused until the run receives more data points."""
+
+    def setUp(self):
+        cache.clear()
+        calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        self.run = Run.objects.create(calorimeter=calorimeter, start_temp=20, target_temp=80, ramp_rate=2)
+        self.parameters = analysis.parse_parameters({'blank': '0'})
+
+    def ingest(self, count, offset=0):
+        data_points = [DataPoint(run=self.run, measured_at=START + timedelta(seconds=offset + i), received_at=START,
+                                 temp_ref=20. + (offset + i) / 10, temp_sample=20. + (offset + i) / 10,
+                                 heat_ref=100., heat_sample=100.)
+                       for i in range(count)]
+        ingest_batch(self.run.pk, data_points, stabilized=False, is_finished=False)
+        self.run.refresh_from_db()
+
+    def test_result_reused_until_more_data_points(self):
+        self.ingest(50)
+        with mock.patch.object(analysis, 'load_run_columns', wraps=analysis.load_run_columns) as load_run_columns:
+            first = analysis.cached_analysis(self.run, self.parameters)
+            self.assertEqual(analysis.cached_analysis(self.run, self.parameters), first)
+            self.assertEqual(load_run_columns.call_count, 1)
+
+            self.ingest(50, offset=50)
+            self.assertEqual(analysis.cached_analysis(self.run, self.parameters)['count'], 100)
+            self.assertEqual(load_run_columns.call_count, 2)
+        self.assertEqual(AnalysisResult.objects.get(run=self.run).watermark, 100)
+
+
+def create_ramp(calorimeter, ramp_rate, temperatures, heat_diff, start_temp=30):
+    """Saves a finished run measured a second apart at the given sample temperatures."""
+    run = Run.objects.create(calorimeter=calorimeter, start_temp=start_temp, target_temp=80, ramp_rate=ramp_rate,
+                             is_finished=True)
+    data_points = [DataPoint(run=run, measured_at=START + timedelta(seconds=i), received_at=START,
+                             temp_ref=temperature, temp_sample=temperature,
+                             heat_ref=100., heat_sample=100. + heat_diff(temperature))
+                   for i, temperature in enumerate(temperatures)]
+    for data_point in data_points:
+        data_point.derive(START)
+    DataPoint.objects.bulk_create(data_points)
+    return run
+
+
+@skipIf(not analysis.is_available(), "NumPy is not installed.")
+class OverlayTests(TestCase):
+
+    def setUp(self):
+        calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        # the data points below the start temperature are left out, and the two at 30 °C averaged
+        self.first = create_ramp(calorimeter, 2, [25, 30, 30, 31, 32, 33, 34], lambda temperature: 2 * temperature)
+        self.first.datapoint_set.filter(measured_at=START + timedelta(seconds=1)).update(heat_sample=158.)
+        self.first.datapoint_set.filter(measured_at=START + timedelta(seconds=2)).update(heat_sample=162.)
+        self.second = create_ramp(calorimeter, 5, [31, 32, 33, 34, 35, 36], lambda temperature: temperature)
+
+    def test_common_grid(self):
+        result = overlay.overlay_runs([self.first, self.second], step=1)
+        self.assertEqual(result['temperature'], [30., 31., 32., 33., 34., 35., 36.])
+        self.assertEqual([run['heat_diff'] for run in result['runs']],
+                         [[60., 62., 64., 66., 68., None, None], [None, 31., 32., 33., 34., 35., 36.]])
+
+    def test_baseline_subtracted(self):
+        result = overlay.overlay_runs([self.first], baseline=self.second, step=1, low=31, high=34)
+        self.assertEqual(result['baseline'], self.second.id)
+        self.assertEqual(result['runs'][0]['heat_diff'], [31., 32., 33., 34.])
+
+    def test_grid_points(self):
+        self.assertEqual(len(overlay.make_grid(30, 40, points=11)), 11)
+        # a step needing more points than allowed is widened
+        self.assertEqual(len(overlay.make_grid(30, 40, step=0.001, points=100)), 100)
+        self.assertEqual(overlay.make_grid(30, 30).tolist(), [30.])
+
+
+@skipIf(not analysis.is_available(), "NumPy is not installed.")
+class BlankTests(TestCase):
+
+    def setUp(self):
+        self.calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        self.blank_run = create_ramp(self.calorimeter, 2, range(30, 41), lambda temperature: temperature - 30)
+
+    def test_heat_flow_interpolated_and_held_at_ends(self):
+        blank = baselines.build_blank(self.blank_run)
+        self.assertEqual((blank.temp_min, blank.temp_max, blank.point_count), (30., 40., 201))
+        heat_flow = baselines.blank_heat_flow(blank, [25., 35.025, 45.])
+        self.assertEqual(len(heat_flow), 3)
+        for value, expected in zip(heat_flow, (0., 5.025, 10.)):
+            self.assertAlmostEqual(value, expected)
+
+    def test_nearest_ramp_rate_within_tolerance(self):
+        blank = baselines.build_blank(self.blank_run)
+        other = baselines.build_blank(
+            create_ramp(self.calorimeter, 2.1, range(30, 41), lambda temperature: 0.))
+        run = create_ramp(self.calorimeter, 2.05, [30], lambda temperature: 0.)
+        self.assertEqual(baselines.find_blank(run), blank)
+        run.ramp_rate = 2.15
+        self.assertEqual(baselines.find_blank(run), other)
+        run.ramp_rate = 3
+        self.assertIsNone(baselines.find_blank(run))
+        # a blank run is not subtracted from itself
+        self.assertEqual(baselines.find_blank(self.blank_run), other)
+
+    def test_needs_a_ramp(self):
+        with self.assertRaises(ValueError):
+            baselines.build_blank(create_ramp(self.calorimeter, 2, [25, 30], lambda temperature: 0.))
+
+
+class TuningTests(TestCase):
+    plant = tuning.ThermalPlant(heat_capacity=2000., loss_coefficient=10., heater_gain=10., ambient_temp=22.,
+                                sensor_lag=2.)
+    scenario = tuning.Scenario(start_temp=30, target_temp=40, ramp_rate=2, max_ramp_rate=20, temp_tolerance=1,
+                               stabilization_duration=15, initial_temp=22)
+    candidate = {'K_p': 3., 'K_i': 0.6, 'K_d': 0., 'active_loop_interval': 0.5}
+
+    def test_plant_step(self):
+        # a step much longer than the time constant reaches the steady state, and the sensor nearly catches up
+        temperature, sensed = self.plant.step(22., 22., 50., 10000.)
+        self.assertAlmostEqual(temperature, 22. + 10. * 50. / 10.)
+        self.assertAlmostEqual(sensed, temperature, delta=0.1)
+        temperature, sensed = self.plant.step(22., 22., 100., 1.)
+        self.assertGreater(temperature, sensed)
+        self.assertGreater(sensed, 22.)
+
+    def test_candidates(self):
+        grid = {'K_p': (1., 2.), 'K_i': (0.1, ), 'K_d': (0., 1., 2.), 'active_loop_interval': (0.5, 1.)}
+        candidates = tuning.grid_candidates(grid)
+        self.assertEqual(len(candidates), 12)
+        self.assertEqual(len({tuple(sorted(candidate.items())) for candidate in candidates}), 12)
+
+        candidates = tuning.random_candidates(50, seed=1)
+        self.assertEqual(candidates, tuning.random_candidates(50, seed=1))
+        for candidate in candidates:
+            for field, (low, high) in tuning.DEFAULT_BOUNDS.items():
+                self.assertTrue(low <= candidate[field] <= high)
+
+    def test_simulated_run(self):
+        metrics = tuning.simulate((self.plant, self.plant), self.candidate, self.scenario)
+        self.assertIsNotNone(metrics['settling_time'])
+        self.assertIsNotNone(metrics['ramp_error'])
+        self.assertGreater(metrics['ramp_rate'], 0)
+
+    def test_underpowered_heater_never_settles(self):
+        # the heater at full duty cycle only warms the cell 5 degrees above ambient, short of the start temperature
+        plant = tuning.ThermalPlant(2000., 10., 0.5, 22.)
+        result = tuning.evaluate(self.candidate, (plant, plant), self.scenario)
+        self.assertIsNone(result['settling_time'])
+        self.assertEqual(result['cost'], math.inf)
+
+    def test_search_best_first(self):
+        candidates = [dict(self.candidate, K_p=K_p) for K_p in (1., 3., 8.)]
+        results = tuning.search((self.plant, self.plant), self.scenario, candidates, workers=1)
+        expected = sorted((tuning.evaluate(candidate, (self.plant, self.plant), self.scenario)
+                           for candidate in candidates), key=lambda result: result['cost'])
+        self.assertEqual(results, expected)
+
+
+@skipIf(not analysis.is_available(), "NumPy is not installed.")
+class SystemIdentificationTests(TestCase):
+    plant = TuningTests.plant
+
+    def setUp(self):
+        self.calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now(),
+                                                      active_loop_interval=0.5)
+
+    def record(self, interval=0.5, count=4000):
+        """
+        Saves a simulated run heating both cells alternately at full and a fifth of full duty cycle.
+
+        :return: tuple of the run and the duty cycle of each data point
+        """
+        run = Run.objects.create(calorimeter=self.calorimeter, start_temp=30, target_temp=80, ramp_rate=2,
+                                 is_finished=True)
+        temperature = sensed = self.plant.ambient_temp
+        data_points, duty_cycles = [], []
+        for i in range(count):
+            duty_cycle = 100. if i // 400 % 2 == 0 else 20.
+            heat_flow = self.plant.heater_gain * duty_cycle
+            data_point = DataPoint(run=run, measured_at=START + timedelta(seconds=i * interval), received_at=START,
+                                   temp_ref=sensed, temp_sample=sensed, heat_ref=heat_flow, heat_sample=heat_flow)
+            data_point.derive(START)
+            data_points.append(data_point)
+            duty_cycles.append(duty_cycle)
+            temperature, sensed = self.plant.step(temperature, sensed, duty_cycle, interval)
+        DataPoint.objects.bulk_create(data_points)
+        return run, duty_cycles
+
+    def test_fitted_plant_reproduces_run(self):
+        run, duty_cycles = self.record()
+        columns = load_run_columns(run)
+        fitted = sysid.identify_cell([columns], 'ref')
+        self.assertAlmostEqual(fitted.heater_gain, self.plant.heater_gain)
+        self.assertAlmostEqual(fitted.heat_capacity, self.plant.heat_capacity, delta=0.05 * self.plant.heat_capacity)
+
+        temperature = sensed = columns['temp_ref'][0]
+        for recorded, duty_cycle in zip(columns['temp_ref'], duty_cycles):
+            self.assertAlmostEqual(sensed, recorded, delta=1.5)
+            temperature, sensed = fitted.step(temperature, sensed, duty_cycle, 0.5)
+
+    def test_too_short(self):
+        run, _ = self.record(count=20)
+        with self.assertRaises(ValueError):
+            sysid.identify_calorimeter(self.calorimeter, [run])
+        self.assertIsNone(sysid.stored_plants(self.calorimeter))
+
+    def test_identify_calorimeter(self):
+        self.record(interval=0.6)
+        plants = sysid.identify_calorimeter(self.calorimeter, sysid.recent_runs(self.calorimeter))
+        self.calorimeter.refresh_from_db()
+        self.assertAlmostEqual(self.calorimeter.cycle_overhead, 0.1)
+        self.assertGreater(self.calorimeter.ramp_gain, 0)
+        for stored, plant in zip(sysid.stored_plants(self.calorimeter), plants):
+            self.assertEqual(repr(stored), repr(plant))
+
+
+class DeltaCodecTests(TestCase):
+    """Both implementations of the codec must write and read the same bytes."""
+
+    series = [
+        ('count', 1, [0, 1, -1, 63, -64, 64, 2 ** 40, -2 ** 40, 0]),
+        ('temp', deltacodec.TEMP_QUANTUM, [20., 20.03, 19.97, 150.5, -40., 20., 20., 21.2, 0.]),
+        ('heat', deltacodec.HEAT_QUANTUM, [0., 500., 499.99, 0.02, 1e4, -1e4, 0., 3., 3.]),
+    ]
+
+    def assert_round_trip(self, decoded):
+        self.assertEqual(list(decoded['count']), self.series[0][2])
+        for name, quantum, values in self.series[1:]:
+            for value, expected in zip(decoded[name], values):
+                self.assertLessEqual(abs(value - expected), quantum / 2 + 1e-9)
+
+    def test_pure_python(self):
+        with mock.patch.object(deltacodec, 'numpy', None):
+            encoded = deltacodec.encode(self.series)
+            self.assert_round_trip(deltacodec.decode(encoded))
+
+    @skipIf(deltacodec.numpy is None, "NumPy is not installed.")
+    def test_vectorized_matches_pure_python(self):
+        encoded = deltacodec.encode(self.series)
+        with mock.patch.object(deltacodec, 'numpy', None):
+            self.assertEqual(deltacodec.encode(self.series), encoded)
+            self.assert_round_trip(deltacodec.decode(encoded))
+        self.assert_round_trip(deltacodec.decode(encoded))
+
+    def test_empty(self):
+        decoded = deltacodec.decode(deltacodec.encode([('count', 1, [])]))
+        self.assertEqual(len(decoded['count']), 0)
+
+    def test_malformed(self):
+        encoded = deltacodec.encode(self.series)
+        for malformed in (b'', b'DLT0' + encoded[4:], encoded[:-1], encoded + b'\0'):
+            for numpy in (deltacodec.numpy, None):
+                with mock.patch.object(deltacodec, 'numpy', numpy), self.assertRaises(ValueError):
+                    deltacodec.decode(malformed)
+
+
+def encode_upload(payload, offsets, columns, codec='float'):
+    """Encodes an upload as the device's ``wireformat.py`` does, from measurement offsets and columns."""
+    header = dict(payload, count=len(offsets), base_time=START.isoformat())
+    if codec == 'delta':
+        header['codec'] = codec
+        quanta = (deltacodec.TEMP_QUANTUM, deltacodec.TEMP_QUANTUM, deltacodec.HEAT_QUANTUM, deltacodec.HEAT_QUANTUM)
+        series = [('offset', 1, [round(offset * 1000) for offset in offsets])]
+        series += list(zip(wireformat.COLUMNS, quanta, columns))
+        measurements = deltacodec.encode(series, len(offsets))
+    else:
+        measurements = struct.pack('<{0}d'.format(len(offsets)), *offsets) + b''.join(
+            struct.pack('<{0}f'.format(len(offsets)), *values) for values in columns)
+    header = json.dumps(header).encode('utf-8')
+    return wireformat.MAGIC + struct.pack('<I', len(header)) + header + measurements
+
+
+class WireFormatTests(TestCase):
+    offsets = [0., 0.5, 1.001, 1.5]
+    columns = [[20., 20.0625, 20.125, 20.5], [21., 21.125, 21.25, 21.5],
+               [100.25, 101.5, 99.75, 100.], [200.5, 201.25, 199.5, 198.75]]
+
+    def assert_decoded(self, payload, quanta):
+        self.assertEqual(payload['run'], 1)
+        self.assertEqual([point['measured_at'] for point in payload['data']],
+                         [START + timedelta(seconds=offset) for offset in self.offsets])
+        for column, quantum, values in zip(wireformat.COLUMNS, quanta, self.columns):
+            for point, value in zip(payload['data'], values):
+                self.assertLessEqual(abs(point[column] - value), quantum / 2)
+
+    def test_float_round_trip(self):
+        body = encode_upload({'run': 1}, self.offsets, self.columns)
+        self.assert_decoded(wireformat.decode_batch(body), (1e-5, ) * 4)
+
+    def test_delta_round_trip_within_quanta(self):
+        body = encode_upload({'run': 1}, self.offsets, self.columns, codec='delta')
+        self.assert_decoded(wireformat.decode_batch(body), (deltacodec.TEMP_QUANTUM, deltacodec.TEMP_QUANTUM,
+                                                            deltacodec.HEAT_QUANTUM, deltacodec.HEAT_QUANTUM))
+
+    def test_deflate(self):
+        body = zlib.compress(encode_upload({'run': 1}, self.offsets, self.columns, codec='delta'))
+        self.assertEqual(len(wireformat.decode_batch(body, 'deflate')['data']), 4)
+        with self.assertRaises(ValueError):
+            wireformat.decode_batch(body[:-4], 'deflate')
+
+    def test_empty_batch(self):
+        self.assertEqual(wireformat.decode_batch(encode_upload({'run': 1}, [], [[]] * 4))['data'], [])
+
+    def test_malformed(self):
+        body = encode_upload({'run': 1}, self.offsets, self.columns)
+        for malformed in (b'', b'JSON' + body[4:], body[:-1], body + b'\0'):
+            with self.assertRaises(ValueError):
+                wireformat.decode_batch(malformed)
+
+    def test_decompression_bomb(self):
+        body = zlib.compress(b'\0' * (wireformat.MAX_DECODED_BYTES + 1))
+        with self.assertRaisesMessage(ValueError, 'larger than'):
+            wireformat.decode_batch(body, 'deflate')
+
+    @mock.patch('server_side.controls.views.DEBUG', False)
+    def test_decompression_bomb_upload(self):
+        calorimeter = Calorimeter.objects.create(serial='test', access_code='code', last_comm_time=timezone.now())
+        run = Run.objects.create(calorimeter=calorimeter, start_temp=20, target_temp=80, ramp_rate=2)
+        body = zlib.compress(encode_upload({'access_code': 'code', 'run': run.pk}, [0.], [[0.]] * 4) +
+                             b'\0' * wireformat.MAX_DECODED_BYTES)
+        response = APIClient().post('/api/data/', body, content_type=wireformat.CONTENT_TYPE,
+                                    HTTP_CONTENT_ENCODING='deflate')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(DataPoint.objects.exists())
+
+
+class RacingQueue(queue.Queue):
+    """A subscriber queue into which another publisher puts a message whenever one is taken out."""
+
+    def get_nowait(self):
+        message = super(RacingQueue, self).get_nowait()
+        if message != 'other':
+            self.put_nowait('other')
+        return message
+
+
+class InProcessBrokerTests(TestCase):
+
+    def test_full_subscriber_drops_oldest(self):
+        broker = hub.InProcessBroker()
+        subscription = broker.subscribe('channel')
+        for i in range(broker.max_backlog + 2):
+            broker.publish('channel', str(i))
+        messages = [subscription.get(timeout=0) for _ in range(broker.max_backlog)]
+        self.assertEqual(messages, [str(i) for i in range(2, broker.max_backlog + 2)])
+
+    def test_publisher_racing_for_freed_slot(self):
+        broker = hub.InProcessBroker()
+        subscriber = RacingQueue(maxsize=2)
+        broker._subscribers['channel'].add(subscriber)
+        broker.publish('channel', 'first')
+        broker.publish('channel', 'second')
+        broker.publish('channel', 'third')
+        self.assertEqual([subscriber.get_nowait(), subscriber.get_nowait()], ['other', 'third'])
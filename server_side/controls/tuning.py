@@ -0,0 +1,313 @@
+""" Offline tuning of the PID gains and loop interval of a calorimeter.
+
+Each cell of a calorimeter is modelled as a lumped thermal mass heated by its heater and losing heat to its
+surroundings, read by a lagging sensor (:class:`ThermalPlant`), as identified from recorded runs by :mod:`controls.sysid`.
+Candidate gains are evaluated by simulating a run on the device with these models: its get ready loop,
+holding the start temperature until both cells have stabilised, and its linear ramp loop,
+stepping the set point by the same increment every cycle.
+A cycle lasts the loop interval plus the time the device takes to read its sensors.
+The controller simulated is the device's own :class:`controller.PID`, driven by a simulated clock,
+with the feed-forward term of the cell models if the calorimeter uses it.
+
+Every candidate is scored by its settling time at the start temperature, its overshoot of the start temperature,
+and its ramp tracking error, the RMS deviation of the measured temperatures from a linear ramp at the run's rate.
+Simulations are independent, so :func:`search` spreads them over a :class:`concurrent.futures.ProcessPoolExecutor`.
+
+Candidates are dicts of :class:`controls.models.Calorimeter` field names (:const:`TUNED_FIELDS`) to values,
+so that the best can be saved to the calorimeter as they are. See the ``tune_pid`` management command.
+"""
+
+import functools
+import itertools
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from controller import PID, CellModel
+
+TUNED_FIELDS = ('K_p', 'K_i', 'K_d', 'active_loop_interval')
+"""Calorimeter fields set by a candidate."""
+
+DEFAULT_GRID = {
+    'K_p': (1., 2., 3., 5., 8., 12.),
+    'K_i': (0.02, 0.05, 0.1, 0.3, 0.6, 1.),
+    'K_d': (0., 0.0003, 0.1, 1.),
+    'active_loop_interval': (0.5, 1., 2., 5.),
+}
+"""Values of each field combined by :func:`grid_candidates` by default.
+Proportional and integral gains of zero are left out, as the device replaces them with its default gains.
+A derivative gain of zero is kept, as the device's default derivative gain is zero too."""
+
+DEFAULT_BOUNDS = {
+    'K_p': (0.5, 20.),
+    'K_i': (0.01, 2.),
+    'K_d': (0., 2.),
+    'active_loop_interval': (0.5, 5.),
+}
+"""Ranges of each field sampled by :func:`random_candidates` by default."""
+
+OVERSHOOT_WEIGHT = 60.
+"""Seconds of settling time that one degree Celsius of overshoot costs a candidate."""
+
+RAMP_ERROR_WEIGHT = 300.
+"""Seconds of settling time that one degree Celsius of RMS ramp tracking error costs a candidate."""
+
+GET_READY_TIMEOUT = 3600.
+"""Seconds after which a candidate that has not stabilised at the start temperature is given up."""
+
+FINISH_DURATION = 50.
+"""Seconds that the temperatures must stay at the target temperature to finish a run, as on the device."""
+
+TEMP_RESOLUTION = 1 / 16
+"""Resolution of the temperature sensors, in degrees Celsius, to which simulated readings are rounded."""
+
+DEFAULT_RAMP_OFFSET = 0.434
+DEFAULT_RAMP_GAIN = 0.02
+"""Ramp calibration of the device, as :const:`settings.RAMP_OFFSET` and :const:`settings.RAMP_GAIN`,
+until one is fitted for a calorimeter."""
+
+
+class ThermalPlant(object):
+    """A lumped thermal model of a calorimeter cell."""
+
+    def __init__(self, heat_capacity, loss_coefficient, heater_gain, ambient_temp, sensor_lag=0.):
+        """
+        :param heat_capacity: heat needed to warm the cell by one degree, in mJ per degree Celsius
+        :param loss_coefficient: heat flow lost to the surroundings per degree above ambient, in mW per degree Celsius
+        :param heater_gain: heat flow of the heater per percent of duty cycle, in mW
+        :param ambient_temp: temperature of the surroundings, in degrees Celsius
+        :param sensor_lag: time constant of the temperature sensor, in seconds
+        """
+        self.heat_capacity = heat_capacity
+        self.loss_coefficient = loss_coefficient
+        self.heater_gain = heater_gain
+        self.ambient_temp = ambient_temp
+        self.sensor_lag = sensor_lag
+
+    def step(self, temperature, sensed, duty_cycle, duration):
+        """
+        Advances the cell by some time with the heater at a constant duty cycle.
+
+        :param temperature: temperature of the cell
+        :param sensed: temperature sensed by the sensor, which lags behind that of the cell
+        :param duty_cycle: duty cycle of the heater, in percent
+        :param duration: seconds to advance by
+        :return: tuple of the new temperature of the cell and the new sensed temperature
+        """
+        heat_flow = self.heater_gain * duty_cycle
+        if self.loss_coefficient > 0:
+            steady = self.ambient_temp + heat_flow / self.loss_coefficient
+            decay = math.exp(-duration * self.loss_coefficient / self.heat_capacity)
+            new_temperature = steady + (temperature - steady) * decay
+        else:
+            new_temperature = temperature + heat_flow * duration / self.heat_capacity
+
+        if self.sensor_lag <= 0:
+            return new_temperature, new_temperature
+        # exact response of a first order lag to the cell temperature, taken as linear over the step
+        rate = (new_temperature - temperature) / duration
+        lag_decay = math.exp(-duration / self.sensor_lag)
+        new_sensed = new_temperature - rate * self.sensor_lag + \
+            (sensed - temperature + rate * self.sensor_lag) * lag_decay
+        return new_temperature, new_sensed
+
+    def __repr__(self):
+        return "<ThermalPlant C={0:.4g} mJ/C, k={1:.4g} mW/C, gain={2:.4g} mW/%, ambient={3:.4g} C, " \
+               "lag={4:.4g} s>".format(self.heat_capacity, self.loss_coefficient, self.heater_gain,
+                                       self.ambient_temp, self.sensor_lag)
+
+
+class Scenario(object):
+    """The settings of a simulated run."""
+
+    def __init__(self, start_temp, target_temp, ramp_rate, max_ramp_rate, temp_tolerance, stabilization_duration,
+                 initial_temp, ramp_offset=DEFAULT_RAMP_OFFSET, ramp_gain=DEFAULT_RAMP_GAIN, cycle_overhead=0.,
+                 feed_forward=False):
+        """
+        :param start_temp: start temperature of the run, in degrees Celsius
+        :param target_temp: target temperature of the run, in degrees Celsius
+        :param ramp_rate: ramp rate of the run, in degrees Celsius per minute
+        :param max_ramp_rate: maximum ramp rate of the calorimeter, in degrees Celsius per minute
+        :param temp_tolerance: tolerance of the calorimeter's stabilisation checks, in degrees Celsius
+        :param stabilization_duration: seconds that temperatures must stay within tolerance to have stabilised
+        :param initial_temp: temperature of both cells when the run starts, in degrees Celsius
+        :param ramp_offset: ramp calibration of the device, see :attr:`setpoint_increment`
+        :param ramp_gain: ramp calibration of the device, see :attr:`setpoint_increment`
+        :param cycle_overhead: seconds that each loop cycle lasts beyond the loop interval
+        :param feed_forward: whether the controllers add the duty cycle predicted by the cell models
+        """
+        self.start_temp = start_temp
+        self.target_temp = target_temp
+        self.ramp_rate = ramp_rate
+        self.max_ramp_rate = max_ramp_rate
+        self.temp_tolerance = temp_tolerance
+        self.stabilization_duration = stabilization_duration
+        self.initial_temp = initial_temp
+        self.ramp_offset = ramp_offset
+        self.ramp_gain = ramp_gain
+        self.cycle_overhead = cycle_overhead
+        self.feed_forward = feed_forward
+
+    @property
+    def setpoint_increment(self):
+        """Increase of the set point per loop cycle during the ramp, as in :attr:`classes.Run.real_ramp_rate`."""
+        max_increment = (self.max_ramp_rate + self.ramp_offset) * self.ramp_gain
+        return min(max((self.ramp_rate + self.ramp_offset) * self.ramp_gain, 0), max_increment)
+
+
+def _quantize(temperature):
+    return round(temperature / TEMP_RESOLUTION) * TEMP_RESOLUTION
+
+
+def simulate(plants, candidate, scenario):
+    """
+    Simulates a run on the device with both cells controlled by PID controllers with the candidate's settings.
+
+    :param plants: tuple of the :class:`ThermalPlant` of the reference and sample cells
+    :param candidate: dict of :const:`TUNED_FIELDS` to values
+    :param scenario: the :class:`Scenario` to simulate
+    :return: dict of `settling_time` (seconds, None if the cells never stabilised), `overshoot` and
+        `ramp_error` (degrees Celsius, None without a ramp),
+        and `ramp_rate`, the rate at which temperatures rose after the start of the ramp (degrees Celsius per minute)
+    """
+    interval = candidate['active_loop_interval'] + scenario.cycle_overhead
+    clock_time = [0.]
+    pids = [PID(scenario.initial_temp, candidate['K_p'], candidate['K_i'], candidate['K_d'],
+                set_point=scenario.start_temp, clock=lambda: clock_time[0],
+                model=CellModel(plant.heat_capacity, plant.loss_coefficient, plant.heater_gain, plant.ambient_temp,
+                                plant.sensor_lag) if scenario.feed_forward else None)
+            for plant in plants]
+    temperatures = [scenario.initial_temp for _ in plants]
+    sensed = list(temperatures)
+    duty_cycles = [0. for _ in plants]
+
+    def cycle():
+        """Waits one cycle with the heaters as they are, then reads the sensors and updates the heaters."""
+        clock_time[0] += interval
+        for index, plant in enumerate(plants):
+            temperatures[index], sensed[index] = plant.step(temperatures[index], sensed[index],
+                                                            duty_cycles[index], interval)
+        readings = [_quantize(value) for value in sensed]
+        for index, pid in enumerate(pids):
+            duty_cycles[index] = min(max(pid.update(readings[index]), 0), 100)
+        return readings
+
+    def within_tolerance(readings, value, tolerance):
+        # as :func:`utils.roughly_equal`, which also compares the cells with each other
+        values = readings + [value]
+        return max(values) - min(values) < tolerance
+
+    # get ready: hold the start temperature until both cells have stayed within tolerance long enough
+    overshoot, settling_time, last_unstable = 0., None, 0.
+    while clock_time[0] < GET_READY_TIMEOUT:
+        readings = cycle()
+        overshoot = max(overshoot, max(readings) - scenario.start_temp)
+        if not within_tolerance(readings, scenario.start_temp, scenario.temp_tolerance):
+            last_unstable = clock_time[0]
+        elif clock_time[0] - last_unstable > scenario.stabilization_duration:
+            settling_time = clock_time[0]
+            break
+    if settling_time is None:
+        return {'settling_time': None, 'overshoot': overshoot, 'ramp_error': None, 'ramp_rate': None}
+
+    # ramp: step the set point every cycle until both cells have stayed at the target temperature long enough
+    ramp_start, set_point, last_unfinished = clock_time[0], scenario.start_temp, clock_time[0]
+    ramp_duration = abs(scenario.target_temp - scenario.start_temp) / max(scenario.ramp_rate, 1e-3) * 60
+    squared_error, count = 0., 0
+    ramp = []
+    while clock_time[0] - ramp_start < 2 * ramp_duration + GET_READY_TIMEOUT:
+        set_point += scenario.setpoint_increment
+        for pid in pids:
+            pid.set_setpoint(min(max(set_point, 0), scenario.target_temp))
+        readings = cycle()
+
+        ideal = min(scenario.start_temp + scenario.ramp_rate * (clock_time[0] - ramp_start) / 60,
+                    scenario.target_temp)
+        squared_error += sum((reading - ideal) ** 2 for reading in readings)
+        count += len(readings)
+        if set_point < scenario.target_temp:
+            ramp.append((clock_time[0] - ramp_start, sum(readings) / len(readings)))
+
+        if not within_tolerance(readings, scenario.target_temp, scenario.temp_tolerance):
+            last_unfinished = clock_time[0]
+        elif clock_time[0] - last_unfinished > FINISH_DURATION:
+            break
+    return {'settling_time': settling_time, 'overshoot': overshoot,
+            'ramp_error': math.sqrt(squared_error / count) if count else None,
+            'ramp_rate': _slope(ramp[len(ramp) // 4:]) * 60 if len(ramp) >= 8 else None}
+
+
+def _slope(points):
+    """Least squares slope of a line through (x, y) points."""
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / sum((x - mean_x) ** 2 for x, _ in points)
+
+
+def cost(metrics):
+    """
+    Single figure of merit of simulated metrics, in seconds; lower is better.
+    Candidates that never stabilise cost infinity.
+    """
+    if metrics['settling_time'] is None:
+        return math.inf
+    return metrics['settling_time'] + OVERSHOOT_WEIGHT * metrics['overshoot'] + \
+        RAMP_ERROR_WEIGHT * (metrics['ramp_error'] or 0.)
+
+
+def evaluate(candidate, plants, scenario):
+    """
+    Simulates a candidate, see :func:`simulate`.
+
+    :return: dict of the candidate's fields, the simulated metrics and their `cost`
+    """
+    metrics = simulate(plants, candidate, scenario)
+    return dict(candidate, cost=cost(metrics), **metrics)
+
+
+def grid_candidates(grid=None):
+    """
+    Every combination of the values of each field.
+
+    :param grid: dict of each of :const:`TUNED_FIELDS` to a sequence of values, :const:`DEFAULT_GRID` by default
+    :return: list of candidate dicts
+    """
+    grid = grid or DEFAULT_GRID
+    return [dict(zip(TUNED_FIELDS, values)) for values in itertools.product(*(grid[field] for field in TUNED_FIELDS))]
+
+
+def random_candidates(count, bounds=None, seed=None):
+    """
+    Candidates with random values of each field, log-uniformly distributed within bounds above zero,
+    and uniformly distributed within bounds from zero.
+
+    :param count: number of candidates
+    :param bounds: dict of each of :const:`TUNED_FIELDS` to a (low, high) tuple, :const:`DEFAULT_BOUNDS` by default
+    :param seed: seed of the random number generator, for repeatable searches
+    :return: list of candidate dicts
+    """
+    bounds = bounds or DEFAULT_BOUNDS
+    generator = random.Random(seed)
+
+    def sample(low, high):
+        if low > 0:
+            return math.exp(generator.uniform(math.log(low), math.log(high)))
+        return generator.uniform(low, high)
+    return [{field: sample(*bounds[field]) for field in TUNED_FIELDS} for _ in range(count)]
+
+
+def search(plants, scenario, candidates, workers=None):
+    """
+    Evaluates candidates in parallel processes.
+
+    :param plants: tuple of the :class:`ThermalPlant` of the reference and sample cells
+    :param scenario: the :class:`Scenario` to simulate
+    :param candidates: list of candidate dicts, see :func:`grid_candidates` and :func:`random_candidates`
+    :param workers: number of processes, by default the number of processors
+    :return: list of the results of :func:`evaluate`, best first
+    """
+    evaluate_candidate = functools.partial(evaluate, plants=plants, scenario=scenario)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(evaluate_candidate, candidates, chunksize=max(len(candidates) // 64, 1)))
+    return sorted(results, key=lambda result: result['cost'])
+
@@ -0,0 +1,86 @@
+""" Cheap version tokens and conditional GET support for frequently polled APIs.
+
+Each response is tagged with an ETag built from a few version fields
+(:attr:`controls.models.Calorimeter.last_changed_time` and :attr:`controls.models.Run.revision`),
+which are far cheaper to read than the full serialized response.
+Clients that send the tag back in an ``If-None-Match`` header get an empty ``304 Not Modified`` response
+if nothing has changed, without any serializer being run.
+"""
+
+import hashlib
+
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+
+from server_side.controls.models import Run
+
+
+def make_etag(*parts):
+    """
+    Builds a quoted ETag from any number of version values.
+
+    :param parts: values that together identify a version of a resource
+    :return: ETag string
+    """
+    return quote_etag(hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+
+def etag_matches(request, etag):
+    """
+    Whether the client already holds the version of a resource identified by an ETag.
+
+    :param request: Django or REST framework request object
+    :param etag: the current ETag of the requested resource
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = [_opaque_tag(tag) for tag in parse_etags(header)]
+    return '*' in etags or _opaque_tag(etag) in etags
+
+
+def _opaque_tag(etag):
+    """Strips the weak indicator and quotes off an ETag."""
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def not_modified(etag):
+    """An empty ``304 Not Modified`` response carrying the ETag."""
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+def tag_response(response, etag):
+    """
+    Attaches an ETag to a response.
+    ``Cache-Control: no-cache`` makes browsers revalidate their cached copy with the ETag on every request.
+    """
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def active_run_version(calorimeter):
+    """ID and revision of the calorimeter's active run, read without loading the run. None if it has none."""
+    return Run.objects.filter(calorimeter=calorimeter, is_finished=False) \
+        .order_by('-start_time').values_list('id', 'revision').first()
+
+
+def calorimeter_etag(calorimeter, include_readings=True):
+    """
+    ETag of a calorimeter's status, as given by :class:`controls.views.CalorimeterStatusAPI`.
+
+    :param calorimeter: the :class:`controls.models.Calorimeter`
+    :param include_readings: whether the tag should also change with the latest temperatures and
+        connection status. The device does not need its own readings back, so it omits them.
+    """
+    parts = [calorimeter.pk, calorimeter.last_changed_time, active_run_version(calorimeter)]
+    if include_readings:
+        is_active = abs((timezone.now() - calorimeter.last_comm_time).total_seconds()) < 60
+        parts += [calorimeter.last_comm_time, calorimeter.current_ref_temp, calorimeter.current_sample_temp,
+                  is_active]
+    return make_etag(*parts)
@@ -3,26 +3,53 @@
 Jin Cheng, 02/12/16
 """
 
-import csv
+import json
+import queue
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import dateutil.parser
-from django.core.mail import send_mail
+from django.core.cache import cache
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from django.db.models import F, Min, Max
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, \
+    StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.template.loader import render_to_string
 from django.utils import timezone
 from rest_framework import status, permissions
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.generics import RetrieveUpdateDestroyAPIView
 
 from server_side.rfsite.settings import DEBUG
-from server_side.controls.models import Calorimeter, Run, DataPoint
-from server_side.controls.serializers import CalorimeterSerializer, RunSerializer, DataPointSerializer
+from server_side.controls import analysis, baselines, overlay
+from server_side.controls.archive import archived_data_points
+from server_side.controls.authentication import forget_device, get_access_code, get_device, get_serial, \
+    remember_device
+from server_side.controls.exports import BINARY_EXPORT_FORMATS, is_format_available, stream_csv
+from server_side.controls.hub import get_broker, publish_run_event, run_channel
+from server_side.controls.ingest import INGEST_QUEUED, enqueue_batch, get_ingest_mode, ingest_batch
+from server_side.controls.models import BlankBaseline, Calorimeter, Run, DataPoint, DataPointRollup, RunArchive, \
+    UploadBatch
+from server_side.controls.rollups import ROLLUP_RESOLUTIONS, select_resolution
+from server_side.controls.serializers import CalorimeterSerializer, RunSerializer, DataPointSerializer, \
+    DataPointRollupSerializer, DataPointUploadSerializer, serialize_data_points_columnar
+from server_side.controls.versioning import calorimeter_etag, etag_matches, make_etag, not_modified, \
+    tag_response
+from server_side.controls import wireformat
+
+
+BATCHING_CACHE_TIMEOUT = 300
+"""Seconds for which the upload batching decisions last reported by a device are shown in the fleet overview."""
+
+
+def _batching_cache_key(calorimeter_id):
+    return 'batching:{0}'.format(calorimeter_id)
 
 
 def IndexView(request, *args, **kwargs):
@@ -37,6 +64,9 @@ def IndexView(request, *args, **kwargs):
 class DeviceAccessPermission(permissions.BasePermission):
     """
     Permission check done with every HTTP request.
+    The calorimeter is resolved from the access code in the request through a short-lived cache
+    (see :mod:`controls.authentication`) and attached to the request as ``request.calorimeter``,
+    so that views never need to fetch it again.
 
     Should be implemented with all API points to prevent abuse.
     """
@@ -44,61 +74,139 @@ class DeviceAccessPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if DEBUG:
             return True
-
-        if request.method in ('GET', 'DELETE',):
-            try:
-                access_code = request.GET['access_code']
-            except KeyError:
-                return False
-        else:
-            try:
-                access_code = request.data['access_code']
-            except KeyError:
-                return False
-        return access_code == obj.access_code
+        # objects are either the calorimeter itself or belong to one, like runs
+        calorimeter_id = obj.pk if isinstance(obj, Calorimeter) else obj.calorimeter_id
+        return request.calorimeter is not None and request.calorimeter.pk == calorimeter_id
 
     def has_permission(self, request, view):
-        return self.has_object_permission(request, view, obj=Calorimeter.objects.get(pk=1))
+        request.calorimeter = get_device(get_access_code(request), get_serial(request))
+        if DEBUG:
+            if request.calorimeter is None:
+                request.calorimeter = Calorimeter.objects.order_by('pk').first()
+            return True
+        return request.calorimeter is not None
+
+
+def device_runs(request):
+    """Runs of the calorimeter resolved by :class:`DeviceAccessPermission`, which are all a request may access."""
+    return Run.objects.filter(calorimeter=request.calorimeter)
 
 
 class CalorimeterStatusAPI(APIView):
     """
-    Gives or updates JSONified data about the status of a single calorimeter.
+    Gives or updates JSONified data about the status of the calorimeter identified by the request's credentials.
     """
     permission_classes = (DeviceAccessPermission, )
 
     def get_object(self):
-        # for now, fix this to always return one single calorimeter.
-        calorimeter = Calorimeter.objects.get(id=1)
+        calorimeter = self.request.calorimeter
         self.check_object_permissions(self.request, calorimeter)
         return calorimeter
 
+    heartbeat_fields = {'current_ref_temp', 'current_sample_temp', 'access_code', 'serial'}
+    """Fields of the periodical PUT request from the device when a job isn't running."""
+
     def get(self, request, format=None):
         """Get serialized JSON response containing calorimeter status."""
         calorimeter = self.get_object()
+        etag = calorimeter_etag(calorimeter)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
         serializer = CalorimeterSerializer(calorimeter)
-        return Response(serializer.data)
+        return tag_response(Response(serializer.data), etag)
 
     def put(self, request, format=None):
-        """Periodical updates from the device about its current temperatures when a job isn't running."""
+        """Periodical updates from the device about its current temperatures when a job isn't running,
+        or changes to calorimeter settings from the Calibrate page."""
         calorimeter = self.get_object()
+        if set(request.data.keys()) <= self.heartbeat_fields:
+            return self.heartbeat(request, calorimeter)
+
+        # settings are validated against and written to the stored row, as the cached calorimeter may be stale
+        calorimeter = Calorimeter.objects.get(pk=calorimeter.pk)
         serializer = CalorimeterSerializer(calorimeter, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def heartbeat(self, request, calorimeter):
+        """
+        Records the temperatures reported by the device with a single UPDATE query.
+        This leaves `last_changed_time` untouched, so that it only changes with settings the device acts upon.
+        If the device already holds the current status (by `If-None-Match`), an empty 304 response is returned.
+        """
+        if 'serial' in request.data and request.data['serial'] != calorimeter.serial:
+            return Response({'serial': ["Does not match the calorimeter's serial number."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        readings = {'last_comm_time': timezone.now()}
+        try:
+            for field in ('current_ref_temp', 'current_sample_temp'):
+                if field in request.data:
+                    readings[field] = float(request.data[field])
+        except (TypeError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        Calorimeter.objects.filter(pk=calorimeter.pk).update(**readings)
+        for field, value in readings.items():
+            setattr(calorimeter, field, value)
+        remember_device(calorimeter)
+
+        etag = calorimeter_etag(calorimeter, include_readings=False)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        return tag_response(Response(CalorimeterSerializer(calorimeter).data), etag)
+
     def delete(self, request, format=None):
         """A non-standard implementation of the DELETE HTTP request,
-        instructing the device to stop heating immediately."""
+        instructing the device to stop heating immediately, including any auto-tuning."""
         calorimeter = self.get_object()
         calorimeter.stop_flag = True
-        calorimeter.save()
-        Run.objects.filter(is_finished=False).update(finish_time=timezone.now())
-        Run.objects.filter(calorimeter=calorimeter).update(is_finished=True, is_running=False)
+        calorimeter.autotune_requested = False
+        # only these fields are written, as the cached calorimeter may be stale
+        calorimeter.save(update_fields=('stop_flag', 'autotune_requested', 'last_changed_time'))
+        Run.objects.filter(calorimeter=calorimeter, is_finished=False).update(
+            finish_time=timezone.now(), is_finished=True, is_running=False, revision=F('revision') + 1)
         return Response(status=status.HTTP_202_ACCEPTED)
 
 
+class FleetAPI(APIView):
+    """
+    Gives the latest readings and active run of every calorimeter, in two database queries.
+    Each calorimeter also has the upload batching decisions it last reported, or None.
+    Only available to staff users.
+    """
+    permission_classes = (permissions.IsAdminUser, )
+
+    active_run_fields = ('id', 'name', 'start_time', 'target_temp', 'data_point_count')
+    """Fields of the active run of each calorimeter."""
+
+    def get(self, request, format=None):
+        calorimeters = list(Calorimeter.objects.order_by('pk').values(
+            'id', 'serial', 'name', 'current_ref_temp', 'current_sample_temp', 'last_comm_time'))
+
+        # the active run of a calorimeter with several unfinished runs is the one started last,
+        # as in CalorimeterSerializer.check_active_runs
+        active_runs = {}
+        unfinished = Run.objects.filter(is_finished=False).order_by('calorimeter_id', '-start_time') \
+            .values('calorimeter_id', *self.active_run_fields)
+        for run in unfinished:
+            active_runs.setdefault(run.pop('calorimeter_id'), run)
+
+        batching = cache.get_many([_batching_cache_key(calorimeter['id']) for calorimeter in calorimeters])
+
+        now = timezone.now()
+        devices = []
+        for calorimeter in calorimeters:
+            calorimeter['is_active'] = abs((now - calorimeter['last_comm_time']).total_seconds()) < 60
+            calorimeter['active_run'] = active_runs.get(calorimeter['id'])
+            calorimeter['batching'] = batching.get(_batching_cache_key(calorimeter['id']))
+            devices.append(calorimeter)
+        return Response(devices)
+
+
 class RunListAPI(APIView):
     """
     Gives a list of all runs conducted by a calorimeter, or create a new run to be started immediately.
@@ -106,29 +214,40 @@ class RunListAPI(APIView):
     permission_classes = (DeviceAccessPermission, )
 
     def get(self, request, format=None, **kwargs):
-        runs = Run.objects.filter(creation_time__gte="2017-01-21", **kwargs).order_by('-creation_time')
-        paginator = Paginator(runs, 5)
+        runs = device_runs(request).filter(creation_time__gte="2017-01-21", **kwargs).order_by('-creation_time')
+
+        # paginate over (id, revision) pairs only, which is all that is needed to tag the page
+        paginator = Paginator(runs.values_list('id', 'revision'), 5)
         page = request.GET.get('page')
 
         try:
-            runs = paginator.page(page)
+            versions = paginator.page(page)
         except PageNotAnInteger:
-            runs = paginator.page(1)
+            versions = paginator.page(1)
         except EmptyPage:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+        versions = list(versions)
+        etag = make_etag('runs', page, paginator.num_pages, versions)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        runs = runs.filter(id__in=[run_id for run_id, _ in versions]).select_related('summary')
         serializer = RunSerializer(runs, many=True)
         data = {
             'page': page,
             'num_pages': paginator.num_pages,
             'runs': serializer.data,
         }
-        return Response(data)
+        return tag_response(Response(data), etag)
 
     def post(self, request, format=None):
+        if Calorimeter.objects.filter(pk=request.calorimeter.pk, autotune_requested=True).exists():
+            return Response({'non_field_errors': ["The calorimeter is being auto-tuned."]},
+                            status=status.HTTP_400_BAD_REQUEST)
         serializer = RunSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            serializer.save(calorimeter=request.calorimeter)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -137,10 +256,19 @@ class RunDetailsAPI(RetrieveUpdateDestroyAPIView):
     """
     Gives details about a Run, or changes the Run parameters, or delete the Run completely.
     """
-    authentication_classes = (DeviceAccessPermission, )
-    queryset = Run.objects.all()
+    permission_classes = (DeviceAccessPermission, )
     serializer_class = RunSerializer
 
+    def get_queryset(self):
+        return device_runs(self.request).select_related('summary')
+
+    def retrieve(self, request, *args, **kwargs):
+        run = self.get_object()
+        etag = make_etag('run', run.pk, run.revision)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        return tag_response(Response(self.get_serializer(run).data), etag)
+
 
 class CsrfExemptSessionAuthentication(SessionAuthentication):
     """
@@ -155,6 +283,40 @@ class CsrfExemptSessionAuthentication(SessionAuthentication):
         return
 
 
+class DataPointColumnsParser(BaseParser):
+    """Parses data uploads in the compact binary encoding of :mod:`controls.wireformat`."""
+    media_type = wireformat.CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        try:
+            return wireformat.decode_batch(stream.read() if stream else b'',
+                                           request.META.get('HTTP_CONTENT_ENCODING'))
+        except ValueError as e:
+            raise ParseError(str(e))
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    Makes the columnar data point media type acceptable to content negotiation.
+    Views answer columnar requests with pre-encoded content, so this renderer is only used for error responses.
+    """
+    media_type = 'application/vnd.robotchem.columnar+json'
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Makes the Server-Sent Events media type acceptable to content negotiation.
+    Event streams are written directly by the view, so this renderer is only used for error responses.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+
 def datetime_parser(raw_input):
     """
     Parses a raw string input using tools. Tests its format by regex and initiates appropriate datetime constructor.
@@ -173,6 +335,123 @@ def datetime_parser(raw_input):
     return since
 
 
+def aware_datetime_parser(raw_input):
+    """
+    Parses a raw string input like :func:`datetime_parser`,
+    then assumes the current time zone if the result is naive so that it can be compared with database values.
+
+    :param raw_input: any string representation of datetime, in either POSIX or ISO format
+    :return: a timezone-aware Python datetime object
+    """
+    parsed = datetime_parser(raw_input)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class RunAnalysisAPI(APIView):
+    """
+    Gives the thermogram analysis of a run: its baseline-corrected differential heat flow against temperature,
+    and the onset, peak and end temperatures and enthalpy of every thermal event.
+    See :mod:`controls.analysis` for the method.
+    """
+    permission_classes = (DeviceAccessPermission, )
+
+    def get(self, request, pk, format=None):
+        """
+        Analysis parameters are given as GET parameters, see :const:`controls.analysis.DEFAULT_PARAMETERS`.
+        Results are reused until the run receives more data points.
+        :return: JSON Response of the analysis, or 501 if the server cannot analyse runs
+        """
+        if not analysis.is_available():
+            return Response({'detail': 'Analysis is not supported on this server.'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            parameters = analysis.parse_parameters(request.GET)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        run = get_object_or_404(device_runs(request), pk=pk)
+        return Response(analysis.cached_analysis(run, parameters))
+
+
+class RunBlankAPI(APIView):
+    """
+    Gives, marks or unmarks a run as a blank run, whose heat flow is subtracted from that of other runs
+    of the calorimeter at about the same ramp rate. See :mod:`controls.baselines`.
+    """
+    permission_classes = (DeviceAccessPermission, )
+
+    def get(self, request, pk, format=None):
+        """:return: JSON Response of the stored heat flow of the blank run, or 404 if the run is not a blank run"""
+        blank = get_object_or_404(BlankBaseline, run__in=device_runs(request), run_id=pk)
+        return Response(baselines.describe_blank(blank, curve=True))
+
+    def put(self, request, pk, format=None):
+        """
+        Marks a finished run as a blank run, or recomputes its stored heat flow.
+        :return: JSON Response describing the blank run, 400 if the run is unfinished or has no temperature ramp,
+            or 501 if the server cannot compute blank runs
+        """
+        if baselines.numpy is None:
+            return Response({'detail': 'Blank runs are not supported on this server.'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        run = get_object_or_404(device_runs(request).select_related('archive'), pk=pk)
+        if not run.is_finished:
+            return Response({'detail': 'Only finished runs can be blank runs.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            blank = baselines.build_blank(run)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(baselines.describe_blank(blank))
+
+    def delete(self, request, pk, format=None):
+        """Stops subtracting the heat flow of a run from other runs."""
+        run = get_object_or_404(device_runs(request), pk=pk)
+        BlankBaseline.objects.filter(run=run).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RunOverlayAPI(APIView):
+    """
+    Gives the differential heat flow of several runs resampled onto a common temperature grid, for comparison.
+    See :mod:`controls.overlay` for the method.
+    """
+    permission_classes = (DeviceAccessPermission, )
+
+    def get(self, request, format=None):
+        """
+        Runs are given as comma separated IDs in GET parameter `runs`,
+        and a run whose heat flow is subtracted from all of them, such as a blank run, in GET parameter `baseline`.
+        The grid is set by GET parameters `step` (degrees Celsius) or `points`, and optionally `min_temp` and `max_temp`.
+        :return: JSON Response, see :func:`controls.overlay.overlay_runs`, or 501 if the server cannot resample runs
+        """
+        if overlay.numpy is None:
+            return Response({'detail': 'Comparing runs is not supported on this server.'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            run_ids = [int(run_id) for run_id in request.GET['runs'].split(',')]
+            baseline_id = int(request.GET['baseline']) if request.GET.get('baseline') else None
+            step = float(request.GET['step']) if 'step' in request.GET else None
+            points = int(request.GET.get('points', overlay.DEFAULT_POINTS))
+            low = float(request.GET['min_temp']) if 'min_temp' in request.GET else None
+            high = float(request.GET['max_temp']) if 'max_temp' in request.GET else None
+        except (KeyError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if len(set(run_ids)) + (baseline_id is not None) > overlay.MAX_RUNS:
+            return Response({'detail': 'At most {0} runs can be compared.'.format(overlay.MAX_RUNS)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # archives are fetched along, so that each run's data points take one query at most
+        runs = device_runs(request).select_related('archive').in_bulk(run_ids + ([baseline_id] if baseline_id is not None else []))
+        if any(run_id not in runs for run_id in run_ids) or (baseline_id is not None and baseline_id not in runs):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        ordered = [runs[run_id] for run_id in sorted(set(run_ids), key=run_ids.index)]
+        baseline = runs[baseline_id] if baseline_id is not None else None
+        return Response(overlay.overlay_runs(ordered, baseline, step=step, points=points, low=low, high=high))
+
+
 class DataPointListAPI(APIView):
     """
     Gives a list of all data points for a specific run measured after a specified time.
@@ -180,24 +459,44 @@ class DataPointListAPI(APIView):
 
     permission_classes = (DeviceAccessPermission, )
     authentication_classes = (CsrfExemptSessionAuthentication, BasicAuthentication,)
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (ColumnarJSONRenderer, )
+    parser_classes = tuple(api_settings.DEFAULT_PARSER_CLASSES) + (DataPointColumnsParser, )
+
+    def wants_columnar(self, request):
+        """Whether the client asked for columnar data, by GET parameter `layout=columnar` or the Accept header."""
+        return request.GET.get('layout') == 'columnar' or \
+            isinstance(request.accepted_renderer, ColumnarJSONRenderer)
 
     def get(self, request, format=None):
         """
         Get data points for a run (with its ID specified in GET parameter `run`),
         and after a certain time (with POSIX timestamp or ISO formatted string, optional).
+
+        By default each data point is a JSON object.
+        Clients that negotiate the columnar layout (see :meth:`wants_columnar`) receive one array per field instead,
+        which is encoded without going through :class:`DataPointSerializer` and is much cheaper for large responses.
         :return: JSON Response
         """
         try:
             kwargs = {
                 'run_id': request.GET['run'],
+                'run__calorimeter': request.calorimeter,
             }
         except KeyError:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        if 'since' in request.GET:
-            kwargs['received_at__gt'] = datetime_parser(request.GET['since'])
+        since = aware_datetime_parser(request.GET['since']) if 'since' in request.GET else None
+        if since is not None:
+            kwargs['received_at__gt'] = since
 
         data_points = DataPoint.objects.filter(**kwargs)
+        archive = RunArchive.objects.filter(run_id=kwargs['run_id'], run__calorimeter=request.calorimeter).first()
+        if archive is not None:
+            data_points = [data_point for data_point in archived_data_points(archive)
+                           if since is None or data_point.received_at > since]
+        if self.wants_columnar(request):
+            return HttpResponse(serialize_data_points_columnar(data_points), content_type='application/json')
+
         serializer = DataPointSerializer(data_points, many=True)
         return Response(serializer.data)
 
@@ -206,7 +505,7 @@ class DataPointListAPI(APIView):
         which indicates whether it has an inserted sample and should heat beyond the start temp."""
         try:
             run_id = request.data['run']
-            run = Run.objects.get(id=run_id)
+            run = device_runs(request).get(id=run_id)
         except KeyError:
             return Response(status=status.HTTP_400_BAD_REQUEST)
         except Run.DoesNotExist:
@@ -228,9 +527,15 @@ class DataPointListAPI(APIView):
         Time measured: should be either POSIX time or ISO formatted string
         Temperatures, heat outputss: floats
 
+        A batch may carry a sequence number, unique within its run.
+        A batch with the number of a batch already received is not recorded again,
+        so that the device can safely repeat uploads whose response it did not get.
+
         :return: JSON Response, containing the Calorimeter stop flag (Bool), errors (List), data points (List).
             The stop flag, if true, should instruct the device to immediately stop heating or cooling.
             The error list will be empty if no error is found.
+            `duplicate` is true if the batch had been received before.
+            A `batching` dict sent by the device, describing how it batches uploads, is kept for the fleet overview.
         """
         try:
             data_points = request.data['data']
@@ -244,75 +549,237 @@ class DataPointListAPI(APIView):
         if not isinstance(data_points, list):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
+        sequence = request.data.get('sequence')
+        if sequence is not None and (not isinstance(sequence, int) or sequence < 0):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        # Devices may only upload to their own runs.
+        # The stop flag is set in the database when instructed by a user on the browser page,
+        # so it is read along with the run, as the cached calorimeter may not have it yet.
+        run_state = device_runs(request).filter(id=run_id) \
+            .values_list('is_ready', 'is_finished', 'time_origin', 'calorimeter__stop_flag').first()
+        if run_state is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        is_ready, run_is_finished, time_origin, stop_flag = run_state
+
+        # Repeats of a batch already received only get the device's control flags
+        duplicate = sequence is not None and UploadBatch.objects.filter(run_id=run_id, sequence=sequence).exists()
+        if duplicate:
+            data_points = []
+
         response = {
             'errors': [],
             'data_point': [],
         }
-        # Batch create new data points
+        # Validate new data points without touching the database
+        received_at = timezone.now()
+        new_data_points = []
         for data_point in data_points:
-            serializer = DataPointSerializer(data=data_point)
+            serializer = DataPointUploadSerializer(data=data_point)
             if serializer.is_valid():
-                serializer.save()
-                response['data_point'].append(serializer.data)
+                new_data_points.append(DataPoint(run_id=run_id, received_at=received_at,
+                                                 **serializer.validated_data))
             else:
                 response['errors'].append(serializer.errors)
 
-        # Calorimeter + Run related operations also go here,
-        # so that the device does not need to send multiple HTTP requests
-        last_data_point = data_points[-1]
-        last_sample_temp = last_data_point['temp_sample']
-
-        run = Run.objects.get(id=run_id)
-        run.stabilized_at_start = stabilized
-        response['is_ready'] = run.is_ready
-
-        if not run.is_running and not run.is_finished and last_sample_temp >= run.start_temp:
-            run.is_running = True
-            run.start_time = timezone.now()
-        if not run.is_finished and run.is_running and is_finished:
-            run.is_running = False
-            run.is_finished = True
-            run.finish_time = timezone.now()
-
-            if run.email:
-                context = {
-                    'run_name': run.name or "Run #{0}".format(run.id),
-                    'run_url': 'http://robotchem.chengj.in/history/{0}/'.format(run_id),
-                    'access_code': run.calorimeter.access_code,
-                }
-                body = render_to_string('run_completion_email_body.txt', context)
-                subject = render_to_string('run_completion_email_title.txt', context)
-                send_mail(subject, body, 'jinscheng@gmail.com', [run.email], fail_silently=True)
-
-        # If a stop flag is set in the database (instructed by user on browser page),
-        # send stop flag to device and reset this flag
-        calorimeter = run.calorimeter
-        stop_flag = calorimeter.stop_flag
-        response['stop_flag'] = stop_flag
+        # Compute the derived columns once, counting elapsed time from the run's time origin.
+        # A run without one gets it when its first batch is recorded, which derives the columns again;
+        # until then it is taken to be the earliest measurement of this batch.
+        if new_data_points:
+            estimated_origin = time_origin or min(data_point.measured_at for data_point in new_data_points)
+            for data_point in new_data_points:
+                data_point.derive(estimated_origin)
+
+        # In queued mode the request only reads from the database, and batches are recorded by another process.
+        # Batches that stop the device are recorded even if repeated, so that the stop flag is cleared.
+        batch = {
+            'run_id': run_id,
+            'data_points': new_data_points,
+            'stabilized': stabilized,
+            'is_finished': is_finished,
+            'stop_flag': stop_flag,
+            'received_at': received_at,
+            'sequence': sequence,
+            'time_origin': time_origin,
+        }
+        queued = get_ingest_mode() == INGEST_QUEUED
+        if queued and (stop_flag or not duplicate):
+            enqueue_batch(**batch)
+        elif stop_flag or not duplicate:
+            # None if a concurrent repeat of this batch was recorded first
+            duplicate = ingest_batch(**batch) is None
+        response['data_point'] = DataPointSerializer(new_data_points, many=True).data
+        response['is_ready'] = is_ready
+        response['duplicate'] = duplicate
+        # A run finished on the server, e.g. by a stop flag delivered in a lost response, also stops the device
+        response['stop_flag'] = stop_flag or run_is_finished
+
+        calorimeter = request.calorimeter
+        if isinstance(request.data.get('batching'), dict):
+            cache.set(_batching_cache_key(calorimeter.pk), request.data['batching'], BATCHING_CACHE_TIMEOUT)
+
+        # Keep the cached calorimeter's latest temperatures current, for the status API
         if stop_flag:
-            run.is_running, run.is_finished, run.finish_time = False, True, timezone.now()
-            calorimeter.stop_flag = False
+            forget_device(calorimeter)
+        elif new_data_points:
+            calorimeter.last_comm_time = received_at
+            calorimeter.current_ref_temp = new_data_points[-1].temp_ref
+            calorimeter.current_sample_temp = new_data_points[-1].temp_sample
+            remember_device(calorimeter)
 
-        # Change this calorimeter's last communication time and temperatures
-        # so that we can determine whether it's actively connected to the server
-        # and display semi-real-time temp to user
-        calorimeter.last_comm_time = timezone.now()
-        calorimeter.current_ref_temp = last_data_point['temp_ref']
-        calorimeter.current_sample_temp = last_data_point['temp_sample']
-
-        calorimeter.save()
-        run.save()
+        # Push the new data points to browsers watching this run, once per batch
+        if response['data_point'] and not duplicate:
+            publish_run_event(run_id, 'data', response['data_point'])
 
         if response['errors']:
             return Response(response, status=status.HTTP_400_BAD_REQUEST)
         return Response(response)
 
 
+class DataStreamAPI(APIView):
+    """
+    Pushes live events of a run to a browser with Server-Sent Events,
+    as published by :meth:`DataPointListAPI.post` to the hub in :mod:`controls.hub`.
+
+    ``data`` events carry a list of newly received data points, in the same format as :meth:`DataPointListAPI.get`.
+    A ``finished`` event carries the run details once the run has ended.
+
+    Each open stream holds a server worker thread, so the server should run threaded or gevent workers.
+    """
+
+    permission_classes = (DeviceAccessPermission, )
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (EventStreamRenderer, )
+
+    keepalive_interval = 15
+    """Seconds of silence after which a comment is sent, to keep proxies from closing the connection."""
+
+    def get(self, request, format=None):
+        """Open an event stream for a run (with its ID specified in GET parameter `run`)."""
+        try:
+            run_id = int(request.GET['run'])
+        except (KeyError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if not device_runs(request).filter(id=run_id).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        subscription = get_broker().subscribe(run_channel(run_id))
+        response = StreamingHttpResponse(self.stream(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream(self, subscription):
+        """Generates the event stream until the run finishes or the client disconnects."""
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = json.loads(subscription.get(timeout=self.keepalive_interval))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                yield 'event: {0}\ndata: {1}\n\n'.format(message['event'], json.dumps(message['data']))
+                if message['event'] == 'finished':
+                    return
+        finally:
+            subscription.close()
+
+
+class DataPointRollupAPI(APIView):
+    """
+    Gives aggregated data points for a specific run over a time window,
+    read from the coarsest precomputed rollup level that satisfies the requested resolution.
+    """
+
+    permission_classes = (DeviceAccessPermission, )
+
+    default_points = 500
+    """Approximate number of points returned across the time window if no resolution is requested."""
+
+    def get(self, request, format=None):
+        """
+        Get rollups for a run (with its ID specified in GET parameter `run`),
+        optionally within a time window (GET parameters `since` and `until`, POSIX timestamp or ISO formatted string).
+        The wanted resolution is either given in seconds (GET parameter `resolution`)
+        or as an approximate number of points across the window (GET parameter `points`).
+
+        If the requested resolution is finer than all rollup levels, raw data points are returned instead.
+        :return: JSON Response containing the chosen bucket length in seconds (0 for raw data) and the series.
+        """
+        try:
+            run_id = int(request.GET['run'])
+            since = aware_datetime_parser(request.GET['since']) if 'since' in request.GET else None
+            until = aware_datetime_parser(request.GET['until']) if 'until' in request.GET else None
+
+            if 'resolution' in request.GET:
+                requested = float(request.GET['resolution'])
+            else:
+                points = int(request.GET.get('points', self.default_points))
+                requested = self.get_window_length(run_id, since, until) / max(points, 1)
+        except (KeyError, ValueError, OverflowError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if not device_runs(request).filter(id=run_id).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        resolution = select_resolution(requested)
+
+        if resolution is None:
+            archive = RunArchive.objects.filter(run_id=run_id).first()
+            if archive is not None:
+                data_points = [data_point for data_point in archived_data_points(archive)
+                               if (since is None or data_point.measured_at >= since)
+                               and (until is None or data_point.measured_at < until)]
+            else:
+                data_points = DataPoint.objects.filter(run_id=run_id).order_by('measured_at')
+                if since is not None:
+                    data_points = data_points.filter(measured_at__gte=since)
+                if until is not None:
+                    data_points = data_points.filter(measured_at__lt=until)
+            return Response({
+                'resolution': 0,
+                'data_points': DataPointSerializer(data_points, many=True).data,
+            })
+
+        rollups = DataPointRollup.objects.filter(run_id=run_id, resolution=resolution).order_by('bucket_start')
+        if since is not None:
+            rollups = rollups.filter(bucket_start__gt=since - timedelta(seconds=resolution))
+        if until is not None:
+            rollups = rollups.filter(bucket_start__lt=until)
+        return Response({
+            'resolution': resolution,
+            'rollups': DataPointRollupSerializer(rollups, many=True).data,
+        })
+
+    @staticmethod
+    def get_window_length(run_id, since, until):
+        """
+        Length of the time window in seconds.
+        Open ends of the window are taken from the finest rollup level,
+        whose (run, resolution, bucket_start) unique index answers this without scanning raw data points.
+        """
+        if since is None or until is None:
+            finest = ROLLUP_RESOLUTIONS[0]
+            span = DataPointRollup.objects.filter(run_id=run_id, resolution=finest).aggregate(
+                first=Min('bucket_start'), last=Max('bucket_start'))
+            if span['first'] is None:
+                return 0.
+            since = since or span['first']
+            until = until or span['last'] + timedelta(seconds=finest)
+        return max((until - since).total_seconds(), 0.)
+
+
 def DataDownloadView(request, run_id):
-    """On-the-fly generation of CSV data files and HTTP attachment response to client's download request."""
+    """On-the-fly generation of data files as an HTTP attachment response to client's download request.
+    CSV files are streamed; columnar binary formats (`npz`, `parquet`, `hdf5`) are built in memory."""
 
     if request.method == 'POST':
-        return HttpResponseNotAllowed
+        return HttpResponseNotAllowed(['GET'])
+
+    calorimeter = get_device(request.GET.get('access_code'), request.GET.get('serial'))
+    if calorimeter is None and not DEBUG:
+        return HttpResponseForbidden()
+    runs = Run.objects.filter(calorimeter=calorimeter) if calorimeter is not None else Run.objects.all()
 
     try:
         file_format = request.GET['format']
@@ -320,25 +787,20 @@ def DataDownloadView(request, run_id):
         file_format = 'csv'
 
     if file_format == 'csv':
-        run = get_object_or_404(Run, id=run_id)
-        response = HttpResponse(content_type='text/csv')
+        run = get_object_or_404(runs, id=run_id)
+        response = StreamingHttpResponse(stream_csv(run), content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="{0}.csv"'.format(run.name or 'Run #'+run_id)
+        return response
 
-        data_points_by_measurement_time = DataPoint.objects.filter(run=run).order_by('measured_at')
-        writer = csv.writer(response)
-        writer.writerow(['Time', 'Temperature (sample)', 'Temperature (reference)',
-                         'Heat Output (sample)', 'Heat Output (reference)'])
-        time_origin = data_points_by_measurement_time[0].measured_at
-
-        for dp in data_points_by_measurement_time:
-            time_delta = dp.measured_at - time_origin
-            writer.writerow([
-                time_delta.total_seconds(),
-                dp.temp_sample,
-                dp.temp_ref,
-                dp.heat_sample,
-                dp.heat_ref,
-            ])
+    if file_format in BINARY_EXPORT_FORMATS:
+        if not is_format_available(file_format):
+            return HttpResponse('Exporting as {0} is not supported on this server.'.format(file_format),
+                                status=501)
+        run = get_object_or_404(runs.select_related('calorimeter'), id=run_id)
+        export, content_type, _ = BINARY_EXPORT_FORMATS[file_format]
+        response = HttpResponse(export(run), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(run.name or 'Run #'+run_id,
+                                                                                 file_format)
         return response
 
-    return HttpResponseBadRequest
+    return HttpResponseBadRequest()
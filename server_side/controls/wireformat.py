@@ -0,0 +1,91 @@
+""" Decoding of the compact binary encoding of data point batches uploaded by the device.
+
+The layout is documented, and encoded, in the device's ``wireformat.py``.
+Measurements may be packed as floats, or with the fixed-point delta encoding of :mod:`controls.deltacodec`.
+A decoded batch has the same shape as a JSON upload to :class:`controls.views.DataPointListAPI`.
+"""
+
+import json
+import struct
+import zlib
+from datetime import timedelta
+
+from rest_framework import serializers
+
+from server_side.controls import deltacodec
+
+CONTENT_TYPE = 'application/x-dsc-columns'
+MAGIC = b'DSC1'
+COLUMNS = ('temp_ref', 'temp_sample', 'heat_ref', 'heat_sample', )
+
+MAX_DECODED_BYTES = 1024 * 1024
+"""Largest decompressed body accepted, far beyond the largest batch the device uploads,
+so that a small compressed body cannot inflate without limit."""
+
+
+def decode_batch(body, content_encoding=None):
+    """
+    Decodes an encoded data upload payload.
+
+    :param body: bytes of the request body
+    :param content_encoding: value of the request's Content-Encoding header, either `deflate` or none
+    :return: the payload dict, whose `data` field is a list of data point dicts
+    :exception ValueError: if the body is not a valid encoded payload, or decompresses to more than
+        :const:`MAX_DECODED_BYTES`
+    """
+    if content_encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+        try:
+            body = decompressor.decompress(body, MAX_DECODED_BYTES)
+        except zlib.error as e:
+            raise ValueError("Invalid deflate stream: {0}".format(e))
+        if decompressor.unconsumed_tail:
+            raise ValueError("Decompressed body is larger than {0} bytes.".format(MAX_DECODED_BYTES))
+        if not decompressor.eof:
+            raise ValueError("Truncated deflate stream.")
+    elif content_encoding not in (None, '', 'identity'):
+        raise ValueError("Unsupported content encoding {0}".format(content_encoding))
+
+    if body[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an encoded data point batch.")
+    try:
+        position = len(MAGIC)
+        header_length, = struct.unpack_from('<I', body, position)
+        position += 4
+        payload = json.loads(body[position:position + header_length].decode('utf-8'))
+        position += header_length
+
+        count = payload.pop('count')
+        base_time = payload.pop('base_time', None)
+        codec = payload.pop('codec', 'float')
+        if codec == 'delta' and count:
+            columns = {name: [float(value) for value in values]
+                       for name, values in deltacodec.decode(body[position:]).items()}
+            columns['offset'] = [offset / 1000 for offset in columns['offset']]
+            if any(len(columns[column]) != count for column in ('offset', ) + COLUMNS):
+                raise ValueError("Delta encoded columns do not hold {0} data points.".format(count))
+            position = len(body)
+        else:
+            columns = {'offset': struct.unpack_from('<{0}d'.format(count), body, position)}
+            position += 8 * count
+            for column in COLUMNS:
+                columns[column] = struct.unpack_from('<{0}f'.format(count), body, position)
+                position += 4 * count
+    except (struct.error, UnicodeDecodeError, KeyError, TypeError) as e:
+        raise ValueError("Malformed encoded data point batch: {0!r}".format(e))
+    if position != len(body):
+        raise ValueError("Encoded data point batch has trailing bytes.")
+
+    if count:
+        # the base time is interpreted as the ISO timestamps of JSON uploads are
+        try:
+            base_time = serializers.DateTimeField(input_formats=['iso-8601']).to_internal_value(base_time)
+        except serializers.ValidationError as e:
+            raise ValueError("Invalid base time: {0}".format(e))
+
+    payload['data'] = [
+        dict({column: columns[column][i] for column in COLUMNS},
+             measured_at=base_time + timedelta(seconds=columns['offset'][i]))
+        for i in range(count)
+    ]
+    return payload
@@ -155,3 +155,16 @@ if not DEBUG:
     )
 REST_FRAMEWORK['DEFAULT_PAGINATION_CLASS'] = 'rest_framework.pagination.PageNumberPagination'
 REST_FRAMEWORK['PAGE_SIZE'] = 5
+
+# Live data streaming to browsers
+# Use 'server_side.controls.hub.RedisBroker' when running more than one server process
+DATA_HUB_BROKER = 'server_side.controls.hub.InProcessBroker'
+DATA_HUB_REDIS_URL = 'redis://localhost:6379/0'
+
+# Recording of data uploaded by devices
+# 'sync' writes each batch to the database within the upload request.
+# 'queued' only appends batches to INGEST_QUEUE_DIR, to be written by `manage.py drain_ingest_queue`;
+# it needs the Redis data hub broker, so that events published by the drainer reach browsers,
+# and drain_ingest_queue refuses to run without it.
+INGEST_MODE = 'sync'
+INGEST_QUEUE_DIR = os.path.join(BASE_DIR, 'ingest_queue')
@@ -12,9 +12,15 @@ urlpatterns = [
 
     # APIs
     url(r'^api/status/', views.CalorimeterStatusAPI.as_view()),
+    url(r'^api/fleet/', views.FleetAPI.as_view()),
     url(r'^api/runs/', views.RunListAPI.as_view()),
     url(r'^api/run/(?P<pk>[0-9]+)/$', views.RunDetailsAPI.as_view()),
+    url(r'^api/run/(?P<pk>[0-9]+)/analysis/$', views.RunAnalysisAPI.as_view()),
+    url(r'^api/run/(?P<pk>[0-9]+)/blank/$', views.RunBlankAPI.as_view()),
+    url(r'^api/overlay/', views.RunOverlayAPI.as_view()),
     url(r'^api/data/', views.DataPointListAPI.as_view()),
+    url(r'^api/rollups/', views.DataPointRollupAPI.as_view()),
+    url(r'^api/stream/', views.DataStreamAPI.as_view()),
 
     # Download data
     url(r'^download/([0-9]+)/', views.DataDownloadView),
@@ -48,6 +48,14 @@ MAX_RAMP_RATE = 20
 """Maximum increment in temperature (degrees Celsius) per minute.
 Note the web API parameters override this setting."""
 
+RAMP_OFFSET = 0.434
+"""Offset, in degrees Celsius per minute, added to ramp rates before converting them to set point increments.
+Note the web API parameters override this setting."""
+
+RAMP_GAIN = 0.02
+"""Set point increment per loop cycle, in degrees Celsius, per degree Celsius per minute of (offset) ramp rate.
+Note the web API parameters override this setting."""
+
 
 #
 # ==========================================
@@ -72,6 +80,41 @@ WEB_API_MIN_UPLOAD_LENGTH = 5
 """Minimum number of measurements that justifies sending a HTTP request.
 Note the web API parameters override this setting."""
 
+WEB_API_UPLOAD_RETRIES = 5
+"""Number of times a failed data upload is repeated before heating is stopped.
+Uploads carry sequence numbers, so the server discards any batch it receives twice."""
+
+WEB_API_RETRY_DELAY = 0.5
+"""Time, in seconds, before the first retry of a failed request. The delay doubles for each further retry."""
+
+WEB_API_UPLOAD_FORMAT = 'columns'
+"""Encoding of uploaded measurements: 'columns' for the compact binary encoding of `wireformat.py`,
+or 'json' for plain JSON, which servers without support for the binary encoding accept."""
+
+WEB_API_UPLOAD_COMPRESSION = True
+"""Whether measurements uploaded in the 'columns' encoding are also compressed with zlib."""
+
+WEB_API_UPLOAD_CODEC = 'delta'
+"""How measurements are packed in the 'columns' encoding: 'delta' for the fixed-point delta encoding of
+`deltacodec.py`, rounded to the resolutions of the sensors and to whole milliseconds, or 'float' for exact floats."""
+
+WEB_API_MAX_UPLOADS_IN_FLIGHT = 3
+"""Maximum number of data uploads awaiting a response at any time.
+Measurements continue while uploads are in flight, which helps on high-latency connections."""
+
+WEB_API_ADAPTIVE_BATCHING = True
+"""Whether the interval between data uploads and their size adapt to the round trip time and error rate
+of uploads. If False, the interval and minimum upload length given by the web API are kept."""
+
+WEB_API_TARGET_UTILISATION = 0.1
+"""Fraction of the time that adaptive batching aims to spend waiting for data upload responses."""
+
+WEB_API_MAX_FLUSH_INTERVAL = 30
+"""Longest time, in seconds, that adaptive batching waits between data uploads."""
+
+WEB_API_MAX_UPLOAD_LENGTH = 240
+"""Maximum number of measurements sent in one data upload. A backlog this long is uploaded straight away."""
+
 # Web API comms access code
 # Change this in local_settings.py in production
 # settings.py is publicly viewable through GitHub but local_settings.py is ignored by Git
@@ -80,6 +123,13 @@ try:
 except ImportError:
     ACCESS_CODE = "SUPER_SECRET_PASSWORD"
 
+# Serial number of this device, as registered on the server.
+# Only needed when several devices share an access code.
+try:
+    from local_settings import SERIAL
+except ImportError:
+    SERIAL = None
+
 #
 # ==========================================
 # LOOP TIME INTERVAL SETTINGS
@@ -121,6 +171,38 @@ TEMP_STABILISATION_MIN_DURATION = 15
 """The minimum time duration in which temperature must stabilise before the program moves on to the next code block."""
 
 
+#
+# ==========================================
+# PID Auto-tune Settings
+# ==========================================
+
+AUTOTUNE_TEMP = 50
+"""Temperature, in degrees Celsius, around which the cells oscillate while auto-tuning.
+Note the web API parameters override this setting."""
+
+AUTOTUNE_RELAY_AMPLITUDE = 25
+"""Half the difference, in percent, between the two duty cycles the heaters are switched between while auto-tuning.
+Larger amplitudes give larger oscillations, which the sensors resolve better."""
+
+AUTOTUNE_HYSTERESIS = 0.25
+"""Half the width, in degrees Celsius, of the band around the set point outside of which the heaters are switched
+while auto-tuning. Wider than the sensor resolution, so that noise does not switch the heaters."""
+
+AUTOTUNE_CYCLES = 3
+"""Number of oscillations measured while auto-tuning, after two are left to settle."""
+
+AUTOTUNE_TIMEOUT = 3600
+"""Seconds after which auto-tuning gives up if the cells have not oscillated enough."""
+
+AUTOTUNE_VALIDATION_STEP = 3
+"""Increase of the set point, in degrees Celsius, that tuned gains are validated with.
+The gains are only saved if the cells settle at the new set point without overshooting it by more than the
+temperature tolerance."""
+
+AUTOTUNE_VALIDATION_TIMEOUT = 1200
+"""Seconds within which the cells must settle for tuned gains to be validated."""
+
+
 #
 # ==========================================
 # Current Sensor Settings
@@ -128,6 +210,14 @@ TEMP_STABILISATION_MIN_DURATION = 15
 MAX_VOLTAGE = 3.3
 """Voltage supplied across the MOSFETs which power the Peltier heaters. Used to calculate energy used."""
 
+HEAT_RESOLUTION = MAX_VOLTAGE * 1000 / 185000
+"""Heat flow, in mW, of one step of the current sensing ADC at full duty cycle.
+Heat flows are measured no finer than this, so uploads in the 'delta' codec are rounded to it."""
+
+TEMP_RESOLUTION = 1 / 16
+"""Resolution of the DS18B20 temperature sensors, in degrees Celsius.
+Temperatures uploaded in the 'delta' codec are rounded to it."""
+
 
 #
 # ==========================================
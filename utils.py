@@ -8,13 +8,16 @@ Jin Cheng 12/12/16:
 """
 
 import asyncio
+import copy
 import json
 import time
 from itertools import combinations
 
+import aiohttp
 import async_timeout
 
 import settings
+import wireformat
 
 
 class StopHeatingError(BaseException):
@@ -23,15 +26,33 @@ class StopHeatingError(BaseException):
     pass
 
 
-async def fetch(session, method, url, payload, timeout=settings.WEB_API_ACTIVE_INTERVAL, **kwargs):
+_etag_cache = {}
+"""Last ETag and decoded JSON response received for each (method, URL), used by :func:`fetch`."""
+
+
+async def fetch(session, method, url, payload, timeout=settings.WEB_API_ACTIVE_INTERVAL, retries=0, wire_format='json',
+                policy=None, **kwargs):
     """
     An asynchronous HTTP request function sending JSON data,
-    with an automatically included ACCESS_CODE field from settings.py.
+    with automatically included ACCESS_CODE (and SERIAL, if set) fields from settings.py.
+
+    If the server tagged an earlier response to the same method and URL with an ETag,
+    the tag is sent back in an `If-None-Match` header.
+    A `304 Not Modified` response then returns a copy of the earlier decoded response without transferring it again.
+
+    Requests that time out, fail to connect or meet a server error can be retried,
+    waiting :const:`settings.WEB_API_RETRY_DELAY` seconds before the first retry and twice as long before each next.
+    Only retry requests that are safe to repeat, such as sequence-numbered data uploads.
 
     :param session: the async HTTP session content manager
     :param method: method of the HTTP request
     :param url: URL of the API endpoint
     :param timeout: raise a time out error after this duration of time (in seconds)
+    :param retries: number of times to repeat a failed request before giving up
+    :param policy: an :class:`AdaptiveBatchPolicy` told the round trip time and outcome of every attempt
+    :param wire_format: 'json', or 'columns' to send a data upload payload in the compact encoding of
+        :mod:`wireformat`, compressed and packed as set by :const:`settings.WEB_API_UPLOAD_COMPRESSION`
+        and :const:`settings.WEB_API_UPLOAD_CODEC`
     :param payload: dictionary containing JSON content
     :param kwargs: extra JSON data to send, omitting ACCESS_CODE (which is automatically included)
     :return: decoded JSON response as dict or list.
@@ -39,29 +60,72 @@ async def fetch(session, method, url, payload, timeout=settings.WEB_API_ACTIVE_I
     if method not in ('GET', 'DELETE', ):
         # automatically insert settings.py access_code
         payload['access_code'] = settings.ACCESS_CODE
+        if settings.SERIAL:
+            payload['serial'] = settings.SERIAL
         payload.update(kwargs)
     else:
         payload = {}
 
-    try:
-        with async_timeout.timeout(timeout):
-            async with session.request(method, url, data=json.dumps(payload),
-                                       headers={'content-type': 'application/json'}) as resp:
+    if wire_format == 'columns':
+        body = wireformat.encode_batch(payload, compress=settings.WEB_API_UPLOAD_COMPRESSION,
+                                       codec=settings.WEB_API_UPLOAD_CODEC)
+        headers = {'content-type': wireformat.CONTENT_TYPE}
+        if settings.WEB_API_UPLOAD_COMPRESSION:
+            headers['content-encoding'] = 'deflate'
+    else:
+        body = json.dumps(payload)
+        headers = {'content-type': 'application/json'}
+    cached = _etag_cache.get((method, url))
+    if cached is not None:
+        headers['if-none-match'] = cached[0]
 
-                # if an HTTP error code is returned, stop heating
-                if resp.status >= 400:
-                    if settings.DEBUG:
-                        print(await resp.text())
-                    raise StopHeatingError
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(settings.WEB_API_RETRY_DELAY * 2 ** (attempt - 1))
+            if settings.DEBUG:
+                print('{0} {1} (retry {2} of {3})'.format(method, url, attempt, retries))
+
+        sent_at = time.time()
+        try:
+            with async_timeout.timeout(timeout):
+                async with session.request(method, url, data=body, headers=headers) as resp:
+                    if policy is not None:
+                        policy.record_attempt(time.time() - sent_at, succeeded=resp.status < 500)
 
-                res = await resp.json()
-                if settings.DEBUG:
-                    print('{0} {1}'.format(method, url))
-                return res
+                    # if nothing has changed since the last response, reuse it
+                    if resp.status == 304 and cached is not None:
+                        if settings.DEBUG:
+                            print('{0} {1} (not modified)'.format(method, url))
+                        return copy.deepcopy(cached[1])
 
-    # if server connection times out, stop heating
-    except asyncio.TimeoutError:
-        raise StopHeatingError
+                    # server errors may be temporary, so retry them if allowed
+                    if resp.status >= 500 and attempt < retries:
+                        continue
+
+                    # if an HTTP error code is returned, stop heating
+                    if resp.status >= 400:
+                        if settings.DEBUG:
+                            print(await resp.text())
+                        raise StopHeatingError
+
+                    res = await resp.json()
+                    if 'ETag' in resp.headers:
+                        _etag_cache[(method, url)] = (resp.headers['ETag'], copy.deepcopy(res))
+                    if settings.DEBUG:
+                        print('{0} {1}'.format(method, url))
+                    return res
+
+        # if server connection times out and retries are exhausted, stop heating
+        except asyncio.TimeoutError:
+            if policy is not None:
+                policy.record_attempt(time.time() - sent_at, succeeded=False)
+            if attempt == retries:
+                raise StopHeatingError
+        except aiohttp.ClientError:
+            if policy is not None:
+                policy.record_attempt(time.time() - sent_at, succeeded=False)
+            if attempt == retries:
+                raise
 
 
 class NetworkQueue(asyncio.Queue):
@@ -73,12 +137,100 @@ class NetworkQueue(asyncio.Queue):
         super(NetworkQueue, self).__init__(*args, **kwargs)
 
     def put(self, *args, **kwargs):
-        """Put a json object into the networking queue, to await upload to the server. """
+        """Put a :class:`classes.DataPoint` into the networking queue, to await upload to the server. """
         if settings.DEBUG:
             print("Network queue size: {0}".format(self.qsize() + 1))
         return super(NetworkQueue, self).put(*args, **kwargs)
 
 
+class AdaptiveBatchPolicy(object):
+    """
+    Decides when queued measurements are uploaded, and how many are sent per request,
+    from the round trip time (RTT) and error rate of recent uploads and the number of measurements waiting.
+
+    Uploads are spaced so that requests keep the link busy for about :const:`settings.WEB_API_TARGET_UTILISATION`
+    of the time: a fast link uploads every measurement or two, so the browser sees them almost live,
+    while a slow or failing link gets fewer, larger requests.
+    A backlog of :attr:`max_batch_size` measurements or more is uploaded straight away, that many per request.
+    """
+
+    smoothing = 0.3
+    """Weight of the newest observation in the moving averages of RTT and error rate."""
+
+    error_backoff = 4
+    """Factor by which the flush interval grows at a 100% error rate."""
+
+    def __init__(self, sample_interval, flush_interval, batch_size, adaptive=True,
+                 min_interval=None, max_interval=None, min_batch_size=1, max_batch_size=None):
+        """
+        :param sample_interval: time, in seconds, between measurements
+        :param flush_interval: initial minimum time, in seconds, between uploads
+        :param batch_size: initial number of measurements that is worth an upload before the flush interval is over
+        :param adaptive: if False, the initial flush interval and batch size are kept
+        :param min_interval: lower bound of the flush interval, by default the sample interval
+        :param max_interval: upper bound of the flush interval
+        :param min_batch_size: lower bound of the batch size
+        :param max_batch_size: upper bound of the batch size, and the most measurements sent per request
+        """
+        self.sample_interval = sample_interval
+        self.adaptive = adaptive
+        self.min_interval = min_interval or sample_interval
+        self.max_interval = max_interval or settings.WEB_API_MAX_FLUSH_INTERVAL
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size or settings.WEB_API_MAX_UPLOAD_LENGTH
+
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.rtt = None
+        self.error_rate = 0.
+        self.backlog = 0
+
+    def record_attempt(self, rtt, succeeded=True):
+        """
+        Takes into account an upload attempt, and adjusts the flush interval and batch size.
+
+        :param rtt: time, in seconds, from sending the request to receiving the response or giving up
+        :param succeeded: whether the attempt received a response that was not a server error
+        """
+        self.rtt = rtt if self.rtt is None else self.smoothing * rtt + (1 - self.smoothing) * self.rtt
+        self.error_rate = self.smoothing * (not succeeded) + (1 - self.smoothing) * self.error_rate
+        if not self.adaptive:
+            return
+
+        interval = self.rtt / settings.WEB_API_TARGET_UTILISATION * (1 + self.error_backoff * self.error_rate)
+        self.flush_interval = clamp(interval, self.min_interval, self.max_interval)
+        # the measurements made within one interval, so that a timely upload is a full batch
+        self.batch_size = int(clamp(round(self.flush_interval / self.sample_interval),
+                                    self.min_batch_size, self.max_batch_size))
+
+    def should_flush(self, qsize, elapsed):
+        """
+        Whether queued measurements should be uploaded now.
+
+        :param qsize: number of measurements waiting
+        :param elapsed: time, in seconds, since the last upload
+        """
+        self.backlog = qsize
+        if qsize >= self.max_batch_size:
+            return True
+        if not self.adaptive:
+            return qsize >= self.batch_size and elapsed >= self.flush_interval
+        if qsize >= self.batch_size:
+            return True
+        return qsize >= self.min_batch_size and elapsed >= self.flush_interval
+
+    def snapshot(self):
+        """The current observations and decisions, as a JSON-ifiable dict for monitoring."""
+        return {
+            'adaptive': self.adaptive,
+            'rtt': self.rtt,
+            'error_rate': self.error_rate,
+            'backlog': self.backlog,
+            'flush_interval': self.flush_interval,
+            'batch_size': self.batch_size,
+        }
+
+
 def clamp(number, min_number=0, max_number=100):
     """
     A function that clamps the input argument number within the given range.
@@ -0,0 +1,77 @@
+"""
+Compact binary encoding of data point batches uploaded to the web API.
+
+A batch sent as JSON spends most of its ~200 bytes per data point on repeated keys and ISO timestamps.
+This encoding sends each measurement as a packed column instead, about 24 bytes per data point,
+and is sent with the :const:`CONTENT_TYPE` content type, which the web server decodes.
+
+Layout, with all numbers little-endian:
+
+#. The 4 bytes of :const:`MAGIC`.
+#. The length of the header, as an unsigned 32-bit integer.
+#. The header: UTF-8 JSON of all payload fields except `data`,
+   plus `count`, the number of data points, and `base_time`, the ISO measurement time of the first data point.
+#. Measurement times as offsets from `base_time` in seconds, as `count` 64-bit floats.
+#. One column of `count` 32-bit floats for each field in :const:`COLUMNS`, in that order.
+
+If the header has `codec` set to `delta`, the last two parts are instead one block of :mod:`deltacodec`,
+holding the series `offset`, in milliseconds, followed by those in :const:`COLUMNS`.
+
+The whole body may be compressed with zlib, which is declared by a `Content-Encoding: deflate` header.
+"""
+
+import json
+import struct
+import zlib
+
+import deltacodec
+import settings
+
+CONTENT_TYPE = 'application/x-dsc-columns'
+MAGIC = b'DSC1'
+COLUMNS = ('temp_ref', 'temp_sample', 'heat_ref', 'heat_sample', )
+
+
+def encode_batch(payload, compress=False, codec='float'):
+    """
+    Encodes a data upload payload.
+
+    :type payload: dict
+    :param payload: JSON-ifiable payload fields, with a `data` field holding a list of :class:`classes.DataPoint`
+    :type compress: bool
+    :param compress: whether to compress the encoded payload with zlib
+    :type codec: str
+    :param codec: 'float' to pack measurements as floats, or 'delta' to round them to the resolutions
+        given in :mod:`settings` and encode them with :mod:`deltacodec`
+    :rtype: bytes
+    :return: the encoded payload
+    """
+    data_points = payload['data']
+    count = len(data_points)
+
+    header = {key: value for key, value in payload.items() if key != 'data'}
+    header['count'] = count
+    parts = []
+    if count:
+        base_time = data_points[0].measured_at
+        header['base_time'] = base_time.isoformat(sep='T')
+        offsets = [(point.measured_at - base_time).total_seconds() for point in data_points]
+        columns = [[getattr(point, column) for point in data_points] for column in COLUMNS]
+
+        if codec == 'delta':
+            header['codec'] = codec
+            quanta = (settings.TEMP_RESOLUTION, settings.TEMP_RESOLUTION,
+                      settings.HEAT_RESOLUTION, settings.HEAT_RESOLUTION)
+            series = [('offset', 1, [round(offset * 1000) for offset in offsets])]
+            series += list(zip(COLUMNS, quanta, columns))
+            parts.append(deltacodec.encode(series, count))
+        else:
+            parts.append(struct.pack('<{0}d'.format(count), *offsets))
+            for values in columns:
+                parts.append(struct.pack('<{0}f'.format(count), *values))
+
+    header = json.dumps(header).encode('utf-8')
+    body = b''.join([MAGIC, struct.pack('<I', len(header)), header] + parts)
+    if compress:
+        body = zlib.compress(body)
+    return body